@@ -0,0 +1,352 @@
+"""Benchmark & load test bot.py terhadap server Bot API palsu (lokal).
+
+Contoh:
+    python bench.py load --users 200 --rate 300 --duration 15
+    python bench.py scheduler --sizes 1000,10000,100000
+    python bench.py all --out hasil.json
+    python bench.py all --out baru.json --compare lama.json
+
+Semua handler asli dijalankan lewat Application sungguhan; hanya API Telegram
+yang diganti server HTTP lokal yang mencatat kapan tiap pesan balasan tiba.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+from urllib.parse import parse_qs
+
+# ========= SERVER BOT API PALSU =========
+class FakeBotAPI:
+    """Server HTTP/1.1 minimal yang menjawab method Bot API seperlunya dan
+    mencatat setiap sendMessage (waktu tiba, chat_id, teks)."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = []  # (perf_counter, chat_id, text)
+        self.listeners = []
+        self._server = None
+        self.port = None
+        self._msg_id = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                _, path, _ = line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (h := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                result = await self._dispatch(path.rsplit("/", 1)[-1], headers.get("content-type", ""), body)
+                data = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: " + str(len(data)).encode() + b"\r\n\r\n" + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, content_type: str, body: bytes):
+        if "json" in content_type:
+            params = json.loads(body or b"{}")
+        else:
+            params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            now = time.perf_counter()
+            self.sent.append((now, chat_id, params.get("text", "")))
+            for fn in self.listeners:
+                fn(now, chat_id, params.get("text", ""))
+            self._msg_id += 1
+            return {"message_id": self._msg_id, "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+        return True
+
+
+def _setup_env(api_url: str, db_path: str):
+    os.environ.update({
+        "BOT_TOKEN": "123:bench",
+        "DATABASE_PATH": db_path,
+        "TELEGRAM_API_URL": api_url,
+        "SEND_GLOBAL_RATE": os.environ.get("SEND_GLOBAL_RATE", "1000000"),
+        "SEND_CHAT_RATE": os.environ.get("SEND_CHAT_RATE", "1000000"),
+        # batas per chat dimatikan: yang diukur throughput bot, bukan pembatasnya
+        "RATE_LIMIT_LIGHT": os.environ.get("RATE_LIMIT_LIGHT", "0"),
+        "RATE_LIMIT_HEAVY": os.environ.get("RATE_LIMIT_HEAVY", "0"),
+        "RATE_LIMIT_EXTERNAL": os.environ.get("RATE_LIMIT_EXTERNAL", "0"),
+        "METRICS_PORT": "0",
+    })
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import bot
+    bot.DB_PATH = db_path
+    bot.TELEGRAM_API_URL = api_url
+    return bot
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    v = sorted(values)
+    pick = lambda q: v[min(len(v) - 1, int(q * len(v)))]
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": v[-1]}
+
+
+def _ms(d):
+    return {k: (round(x * 1000, 3) if x is not None else None) for k, x in d.items()}
+
+
+# ========= LOAD TEST =========
+def _make_update(update_id: int, chat_id: int, text: str) -> dict:
+    cmd = text.split()[0]
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"u{chat_id}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(cmd)}],
+        },
+    }
+
+
+def _random_command(rng: random.Random, bot) -> str:
+    r = rng.random()
+    if r < 0.30:
+        return f"/note_add catatan {rng.randint(1, 10**6)}"
+    if r < 0.45:
+        return "/note_list"
+    if r < 0.70:
+        return f"/money_add {rng.choice('+-')}{rng.randint(1000, 100000)} belanja"
+    if r < 0.80:
+        return "/money_balance"
+    if r < 0.85:
+        return "/money_report"
+    if r < 0.95:
+        run_at = bot.now_local() + timedelta(days=rng.randint(1, 30))
+        return f"/reminder_once {run_at.strftime('%Y-%m-%d %H:%M')} bench"
+    return "/reminder_list"
+
+
+async def run_load(users: int, rate: float, duration: float, reminders: int, latency: float) -> dict:
+    api = FakeBotAPI(latency=latency)
+    await api.start()
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    bot = _setup_env(api.base_url, os.path.join(tmp, "load.sqlite3"))
+    bot.init_db()
+
+    from telegram import Update
+    app = bot.build_application()
+    await app.initialize()
+    await bot.on_startup(app)
+    await app.start()
+
+    # balasan dicocokkan ke command per chat secara FIFO (urutan per chat terjaga)
+    pending = defaultdict(deque)
+    latencies = []
+    reminder_due = {}
+    reminder_lag = []
+
+    def on_message(now, chat_id, text):
+        if text.startswith("⏰ Reminder: lag-"):
+            due = reminder_due.pop(text.rsplit("-", 1)[-1], None)
+            if due is not None:
+                reminder_lag.append(time.time() - due)
+            return
+        if pending[chat_id]:
+            latencies.append(now - pending[chat_id].popleft())
+
+    api.listeners.append(on_message)
+
+    # reminder yang jatuh tempo di tengah load test untuk mengukur lag scheduler
+    for i in range(reminders):
+        due = bot.now_local() + timedelta(seconds=1 + duration * i / max(reminders, 1))
+        reminder_due[str(i)] = int(due.timestamp())  # next_run disimpan per detik
+        await bot._save_reminder_once(10**9 + i, due, f"lag-{i}")
+
+    rng = random.Random(42)
+    interval = 1 / rate
+    sent = 0
+    t_start = time.perf_counter()
+    next_at = t_start
+    while time.perf_counter() - t_start < duration:
+        chat_id = rng.randint(1, users)
+        text = _random_command(rng, bot)
+        sent += 1
+        pending[chat_id].append(time.perf_counter())
+        await app.update_queue.put(Update.de_json(_make_update(sent, chat_id, text), app.bot))
+        next_at += interval
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    offered_seconds = time.perf_counter() - t_start
+
+    # tunggu semua balasan & reminder selesai (maks 30 detik)
+    deadline = time.perf_counter() + 30
+    while (len(latencies) < sent or reminder_due) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - t_start
+
+    await app.stop()
+    await bot.on_shutdown(app)
+    await app.shutdown()
+    await api.stop()
+    return {
+        "users": users, "target_rate": rate, "duration": duration,
+        "requests": sent, "completed": len(latencies),
+        "offered_rate": round(sent / offered_seconds, 1),
+        "throughput": round(len(latencies) / elapsed, 1),
+        "latency_ms": _ms(percentiles(latencies)),
+        "scheduler_lag_ms": _ms(percentiles(reminder_lag)),
+        "reminders_missing": len(reminder_due),
+    }
+
+
+# ========= MICROBENCHMARK SCHEDULER =========
+class _NullBot:
+    def __init__(self):
+        self.count = 0
+
+    async def send_message(self, chat_id, text):
+        self.count += 1
+
+
+class _NullApp:
+    def __init__(self):
+        self.bot = _NullBot()
+
+
+async def run_scheduler(size: int, idle_ticks: int = 2000) -> dict:
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    bot = _setup_env("http://127.0.0.1:9/bot", os.path.join(tmp, f"sched-{size}.sqlite3"))
+    bot.init_db()
+    bot.DB = bot.Database()
+    bot.DB.start()
+    bot.SCHEDULER = bot.ReminderScheduler()
+    bot.DISPATCHER = bot.Dispatcher(concurrency=256, global_rate=1e9, chat_rate=1e9)
+
+    now = int(time.time())
+    created = bot.iso(bot.now_local())
+
+    def populate(conn):
+        conn.executemany("""
+            INSERT INTO reminders (chat_id, kind, message, time_of_day, created_at, active, next_run)
+            VALUES (?, 'daily', ?, '06:00', ?, 1, ?)
+        """, ((i, f"r{i}", created, now + 86400 + i % 3600) for i in range(size)))
+
+    await bot.DB.write(populate)
+
+    t0 = time.perf_counter()
+    await bot.load_reminders()
+    load_s = time.perf_counter() - t0
+
+    app = _NullApp()
+    t0 = time.perf_counter()
+    for _ in range(idle_ticks):
+        await bot.scheduler_tick(app)
+    idle_us = (time.perf_counter() - t0) / idle_ticks * 1e6
+
+    # semua jatuh tempo sekaligus: klaim outbox + kirim + tandai terkirim
+    await bot.DB.execute("UPDATE reminders SET next_run=?", (now - 1,))
+    bot.SCHEDULER = bot.ReminderScheduler()
+    await bot.load_reminders()
+    t0 = time.perf_counter()
+    await bot.scheduler_tick(app)
+    claim_s = time.perf_counter() - t0
+    await asyncio.gather(*list(bot.DISPATCHER._tasks))
+    fire_s = time.perf_counter() - t0
+
+    bot.DB.close()
+    return {
+        "size": size,
+        "load_seconds": round(load_s, 4),
+        "idle_tick_us": round(idle_us, 2),
+        "due_tick_claim_seconds": round(claim_s, 4),
+        "fan_out_seconds": round(fire_s, 4),
+        "sent": app.bot.count,
+    }
+
+
+# ========= CLI =========
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def _compare(new: dict, old: dict, prefix: str = ""):
+    """Cetak selisih angka antara dua hasil benchmark."""
+    for key, value in new.items():
+        if key not in old or key == "timestamp":
+            continue
+        if isinstance(value, dict):
+            _compare(value, old[key], f"{prefix}{key}.")
+        elif isinstance(value, list):
+            for a, b in zip(value, old[key]):
+                if isinstance(a, dict) and isinstance(b, dict):
+                    _compare(a, b, f"{prefix}{key}[{a.get('size', '')}].")
+        elif isinstance(value, (int, float)) and isinstance(old[key], (int, float)) and old[key]:
+            change = (value - old[key]) / old[key] * 100
+            print(f"{prefix}{key}: {old[key]} -> {value} ({change:+.1f}%)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("mode", choices=["load", "scheduler", "all"])
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--rate", type=float, default=200, help="command per detik")
+    ap.add_argument("--duration", type=float, default=10, help="detik")
+    ap.add_argument("--reminders", type=int, default=50, help="reminder yang jatuh tempo selama load test")
+    ap.add_argument("--api-latency", type=float, default=0.0, help="latensi tiruan Bot API (detik)")
+    ap.add_argument("--sizes", default="1000,10000,100000")
+    ap.add_argument("--out", help="simpan hasil ke file JSON")
+    ap.add_argument("--compare", help="bandingkan dengan hasil JSON sebelumnya")
+    args = ap.parse_args()
+
+    result = {"commit": _git_rev(), "timestamp": int(time.time())}
+    if args.mode in ("load", "all"):
+        result["load"] = asyncio.run(run_load(args.users, args.rate, args.duration,
+                                              args.reminders, args.api_latency))
+    if args.mode in ("scheduler", "all"):
+        result["scheduler"] = [asyncio.run(run_scheduler(int(n))) for n in args.sizes.split(",")]
+
+    print(json.dumps(result, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            _compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
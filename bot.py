@@ -1,16 +1,42 @@
 import os
 import asyncio
+import bisect
+import calendar
+import csv
+import functools
+import heapq
+import importlib.util
+import json
+import logging
+import multiprocessing
+import queue
+import signal
 import sqlite3
-from datetime import datetime, timedelta
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Callable, Optional
 import re
-import requests
+import httpx
 import pytz
 from dotenv import load_dotenv
 
-from telegram import Update
+try:
+    import asyncpg   # opsional, hanya untuk STORAGE_URL=postgresql://...
+except ImportError:
+    asyncpg = None
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.constants import ParseMode
+from telegram.error import NetworkError, RetryAfter, TelegramError
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler,
+    Application, ApplicationHandlerStop, BaseUpdateProcessor, CallbackQueryHandler, CommandHandler, MessageHandler, TypeHandler,
     ContextTypes, filters
 )
 
@@ -18,63 +44,831 @@ from telegram.ext import (
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY", "")
+OPENWEATHER_URL = os.getenv("OPENWEATHER_URL", "https://api.openweathermap.org/data/2.5/weather")
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "600"))        # detik
+WEATHER_NEGATIVE_TTL = float(os.getenv("WEATHER_NEGATIVE_TTL", "3600"))  # detik, kota tidak ditemukan
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "1000"))
 DB_PATH = os.getenv("DATABASE_PATH", "bot_data.sqlite3")
+STORAGE_URL = os.getenv("STORAGE_URL", "")   # kosong = SQLite (DB_PATH); postgresql://... = DB bersama
 TZ_NAME = os.getenv("TZ", "Asia/Jakarta")
 TZ = pytz.timezone(TZ_NAME)
 
+# Mode jalan: "polling" (default) atau "webhook" (server HTTP bawaan)
+RUN_MODE = os.getenv("RUN_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")          # URL publik, mis. https://bot.example.com/telegram
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")    # dicek di header X-Telegram-Bot-Api-Secret-Token
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+WORKERS = int(os.getenv("WORKERS", "1"))            # >1 = update dibagi ke beberapa proses per chat
+SHARD = (0, 1)                                      # (index, jumlah) shard proses ini
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")  # kosong = https://api.telegram.org/bot
+
+# Batas kirim Telegram: ~30 pesan/detik global, ~1 pesan/detik per chat
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "32"))
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
+# Reminder yang terlewat (bot mati) masih dikirim kalau telatnya <= jendela ini
+REMINDER_CATCHUP_SECONDS = int(os.getenv("REMINDER_CATCHUP_SECONDS", "3600"))
+DELIVERY_RETENTION_SECONDS = int(os.getenv("DELIVERY_RETENTION_DAYS", "7")) * 86400
+DELIVERY_COMPACT_INTERVAL = 3600   # detik antar job pembersihan log pengiriman
+DELIVERY_COMPACT_BATCH = 5000
+
+log = logging.getLogger("bot")
+
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN kosong. Isi di file .env")
 
+# ========= METRIK & PROFILING =========
+# Counter & histogram sederhana format Prometheus, di-expose lewat endpoint HTTP
+# lokal (METRICS_PORT) dan ringkasannya lewat perintah admin /stats.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))   # 0 = endpoint nonaktif
+PROFILE_HZ = float(os.getenv("PROFILE_HZ", "0"))      # >0 = sampling profiler aktif saat start
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # slot terakhir = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Perkiraan kuantil (batas atas bucket tempat kuantil jatuh)."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+def _labels(labels) -> str:
+    if not labels:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+class Metrics:
+    """Aman dipakai dari thread DB maupun event loop."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)   # (nama, labels) -> nilai
+        self.histograms = {}                 # (nama, labels) -> Histogram
+        self.collectors = []                 # fn() -> [(nama, tipe, {label}, nilai)]
+        self.started = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    def render(self) -> str:
+        lines, typed = [], set()
+
+        def type_line(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda kv: kv[0])
+            histograms = [(k, list(h.counts), h.sum, h.count, h.buckets) for k, h in histograms]
+        for (name, labels), value in counters:
+            type_line(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value:g}")
+        for (name, labels), counts, total, count, buckets in histograms:
+            type_line(name, "histogram")
+            cum = 0
+            for le, c in zip([*buckets, "+Inf"], counts):
+                cum += c
+                lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cum}")
+            lines.append(f"{name}_sum{_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        for collect in self.collectors:
+            for name, kind, labels, value in collect():
+                type_line(name, kind)
+                lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value:g}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+@functools.lru_cache(maxsize=1024)
+def _sql_label(sql: str) -> str:
+    return " ".join(sql.split())[:100]
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor dari TimedConnection.cursor(); dipakai query yang butuh row_factory sendiri."""
+
+    def execute(self, sql, params=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            METRICS.observe("bot_sql_seconds", time.perf_counter() - t0, sql=_sql_label(sql))
+
+    def executemany(self, sql, seq):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq)
+        finally:
+            METRICS.observe("bot_sql_seconds", time.perf_counter() - t0, sql=_sql_label(sql))
+
+class TimedConnection(sqlite3.Connection):
+    """Koneksi sqlite3 yang mencatat durasi tiap statement ke METRICS."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            METRICS.observe("bot_sql_seconds", time.perf_counter() - t0, sql=_sql_label(sql))
+
+    def executemany(self, sql, seq):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq)
+        finally:
+            METRICS.observe("bot_sql_seconds", time.perf_counter() - t0, sql=_sql_label(sql))
+
+class SamplingProfiler:
+    """Sampling profiler ringan: ambil stack thread event loop `hz` kali/detik.
+    Hasil dalam format collapsed stack (bisa langsung dipakai flamegraph.pl)."""
+
+    MAX_DEPTH = 40
+
+    def __init__(self):
+        self.samples = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, hz: float = 100, target: Optional[int] = None):
+        if self._thread is not None:
+            return
+        target = target or threading.main_thread().ident
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(1 / hz, target), name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self, interval: float, target: int):
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None and len(stack) < self.MAX_DEPTH:
+                code = frame.f_code
+                stack.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {n}" for stack, n in self.samples.most_common()) + "\n"
+
+    def top(self, n: int = 10):
+        """Fungsi paling sering berada di puncak stack (self time)."""
+        leaf = Counter()
+        for stack, count in self.samples.items():
+            leaf[stack.rsplit(";", 1)[-1]] += count
+        return leaf.most_common(n)
+
+PROFILER = SamplingProfiler()
+
+async def _serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await asyncio.wait_for(reader.readline(), timeout=5)
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.decode("latin-1").split()
+        path = parts[1] if len(parts) > 1 else "/"
+        if path == "/metrics":
+            status, body = "200 OK", METRICS.render()
+        elif path == "/profile":
+            status, body = "200 OK", PROFILER.collapsed()
+        else:
+            status, body = "404 Not Found", "not found\n"
+        data = body.encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server():
+    if not METRICS_PORT:
+        return None
+    # tiap worker (mode multi-proses) memakai port METRICS_PORT + index shard
+    port = METRICS_PORT + SHARD[0]
+    server = await asyncio.start_server(_serve_metrics, METRICS_HOST, port)
+    log.info("Metrik tersedia di http://%s:%d/metrics", METRICS_HOST, port)
+    return server
+
+def timed(name: str, callback):
+    """Bungkus handler: catat latensi, error, dan umur update saat diproses."""
+    @functools.wraps(callback)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        t0 = time.perf_counter()
+        msg = update.effective_message if isinstance(update, Update) else None
+        if msg is not None and msg.date is not None and update.callback_query is None:
+            METRICS.observe("bot_update_lag_seconds", max(time.time() - msg.date.timestamp(), 0))
+        try:
+            return await callback(update, context)
+        except Exception:
+            METRICS.inc("bot_handler_errors_total", handler=name)
+            raise
+        finally:
+            METRICS.observe("bot_handler_seconds", time.perf_counter() - t0, handler=name)
+    return wrapper
+
 # ========= DATABASE (SQLite) =========
-def db_connect():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+# Semua akses DB berjalan di luar event loop: satu thread penulis (semua
+# INSERT/UPDATE/DELETE lewat sini, commit digabung) dan pool thread pembaca
+# dengan koneksi read-only. Mode WAL membuat pembaca tidak diblok penulis.
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+DB_COMMIT_WINDOW = float(os.getenv("DB_COMMIT_WINDOW_MS", "2")) / 1000
+DB_MAX_BATCH = 256
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))  # tunggu kunci tulis sebelum "database is locked"
+
+def db_connect(readonly: bool = False):
+    if readonly:
+        uri = Path(DB_PATH).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                               check_same_thread=False, factory=TimedConnection)
+    else:
+        conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                               check_same_thread=False, factory=TimedConnection)
+        # harus sebelum tabel pertama dibuat; DB lama diubah sekali lewat `--vacuum`
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")   # aman di WAL, fsync hanya saat checkpoint
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA cache_size=-32000")    # ~32MB per koneksi
+    conn.execute("PRAGMA mmap_size=268435456")  # 256MB
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
-CONN = db_connect()
+def _resolve(fut: asyncio.Future, result, exc):
+    if fut.cancelled():
+        return
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(result)
+
+class Database:
+    """Akses SQLite async. `write(fn, ...)` menjalankan fn(conn, ...) di thread
+    penulis dalam transaksi; `read(fn, ...)` di pool pembaca read-only."""
+
+    def __init__(self, readers: int = DB_READERS, commit_window: float = DB_COMMIT_WINDOW):
+        self.readers = readers
+        self.commit_window = commit_window
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self._read_pool = None
+        self._local = threading.local()
+
+    def start(self):
+        if self._writer is not None:
+            return
+        self._writer = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+        self._writer.start()
+        self._read_pool = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix="db-reader")
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+        self._read_pool.shutdown(wait=True)
+        self._read_pool = None
+
+    # ---- penulis ----
+    def _collect_batch(self, first):
+        """Ambil job yang sudah antri; kalau sedang ramai, tunggu sebentar
+        (commit window) supaya lebih banyak job masuk ke commit yang sama."""
+        batch, stop = [first], False
+        deadline = time.monotonic() + self.commit_window
+        while len(batch) < DB_MAX_BATCH:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if len(batch) == 1 or remaining <= 0:
+                    break
+                try:
+                    job = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if job is None:
+                stop = True
+                break
+            batch.append(job)
+        return batch, stop
+
+    def _writer_loop(self):
+        conn = self._connect_writer()
+        while conn is not None:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stop = self._collect_batch(first)
+            try:
+                results = self._run_batch(conn, batch)
+            except Exception as e:
+                # BEGIN / SAVEPOINT / commit gagal (mis. "database is locked" lewat
+                # busy_timeout): seluruh batch menerima error, thread tetap hidup
+                log.warning("DB writer: batch %d job gagal: %s", len(batch), e)
+                METRICS.inc("bot_db_batch_errors_total")
+                results = [(fut, loop, None, e) for _, _, fut, loop in batch]
+                conn = self._reset_writer(conn)
+            self._finish(results)
+            if stop:
+                break
+        if conn is not None:
+            conn.close()
+
+    def _connect_writer(self):
+        """Buka koneksi penulis; kalau gagal, job yang sedang antri diberi error
+        lalu dicoba lagi dengan backoff. None = ada perintah berhenti."""
+        delay = 0.1
+        while True:
+            try:
+                return db_connect()
+            except Exception as e:
+                log.warning("DB writer: gagal membuka koneksi: %s (coba lagi %.1f dtk)", e, delay)
+                if self._fail_queued(e):
+                    return None
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+
+    def _reset_writer(self, conn):
+        try:
+            conn.rollback()
+            return conn
+        except Exception:
+            conn.close()
+            return self._connect_writer()
+
+    def _fail_queued(self, exc) -> bool:
+        """Gagalkan semua job yang sudah antri. Kembalikan True kalau ada sinyal stop."""
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                return False
+            if job is None:
+                return True
+            _, _, fut, loop = job
+            self._finish([(fut, loop, None, exc)])
+
+    @staticmethod
+    def _finish(results):
+        for fut, loop, res, exc in results:
+            try:
+                loop.call_soon_threadsafe(_resolve, fut, res, exc)
+            except RuntimeError:
+                pass  # event loop pemanggil sudah ditutup
+
+    def _run_batch(self, conn, batch):
+        """Jalankan batch dalam satu transaksi; kembalikan [(fut, loop, hasil, error)].
+        Error di luar job (BEGIN, SAVEPOINT, commit) dilempar ke pemanggil."""
+        results = []
+        conn.execute("BEGIN IMMEDIATE")
+        for fn, args, fut, loop in batch:
+            # savepoint per job: satu job gagal tidak membatalkan job lain di batch
+            conn.execute("SAVEPOINT job")
+            try:
+                res = fn(conn, *args)
+            except Exception as e:
+                conn.execute("ROLLBACK TO job")
+                conn.execute("RELEASE job")
+                results.append((fut, loop, None, e))
+            else:
+                conn.execute("RELEASE job")
+                results.append((fut, loop, res, None))
+        conn.commit()
+        return results
+
+    async def write(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._queue.put((fn, args, fut, loop))
+        return await fut
+
+    # ---- pembaca ----
+    def _read_conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = db_connect(readonly=True)
+        return conn
+
+    def _run_read(self, fn, args):
+        return fn(self._read_conn(), *args)
+
+    async def read(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_pool, self._run_read, fn, args)
+
+    # ---- helper umum ----
+    async def fetchall(self, sql: str, params=()):
+        return await self.read(lambda c: c.execute(sql, params).fetchall())
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.read(lambda c: c.execute(sql, params).fetchone())
+
+    async def execute(self, sql: str, params=()) -> int:
+        """Jalankan satu statement tulis; kembalikan rowcount."""
+        return await self.write(lambda c: c.execute(sql, params).rowcount)
+
+    async def insert(self, sql: str, params=()) -> int:
+        """Jalankan INSERT; kembalikan lastrowid."""
+        return await self.write(lambda c: c.execute(sql, params).lastrowid)
+
+DB = Database()
+
+# ---- Migrasi skema ----
+# Tiap migrasi punya nomor versi urut dan harus idempoten (aman dijalankan ulang
+# di DB lama yang tabelnya sudah ada). Versi yang sudah diterapkan dicatat di
+# tabel schema_version, jadi saat start hanya migrasi baru yang dijalankan.
+def _column_exists(conn, table: str, column: str) -> bool:
+    return any(r["name"] == column for r in conn.execute(f"PRAGMA table_info({table})"))
+
+def _m001_base_tables(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER UNIQUE NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS notes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS money (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        description TEXT,
+        created_at TEXT NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS reminders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,      -- 'once' | 'daily' | 'weekly'
+        message TEXT NOT NULL,
+        run_at TEXT,             -- ISO: utk 'once'
+        time_of_day TEXT,        -- 'HH:MM' utk 'daily' & 'weekly'
+        weekday INTEGER,         -- 0=Mon..6=Sun utk 'weekly'
+        created_at TEXT NOT NULL,
+        active INTEGER NOT NULL DEFAULT 1
+    )
+    """)
+
+def _m002_chat_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notes_chat_id ON notes (chat_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_money_chat_id ON money (chat_id, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_money_chat_created ON money (chat_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reminders_chat_active ON reminders (chat_id, active, id)")
+
+def _m003_reminder_next_run(conn):
+    # next_run = epoch UTC jalan berikutnya, dipakai scheduler saat start
+    if not _column_exists(conn, "reminders", "next_run"):
+        conn.execute("ALTER TABLE reminders ADD COLUMN next_run INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reminders_due ON reminders (active, next_run)")
+    now = now_local()
+    rows = conn.execute("""
+        SELECT id, kind, run_at, time_of_day, weekday FROM reminders
+        WHERE active=1 AND next_run IS NULL
+    """).fetchall()
+    updates = []
+    for r in rows:
+        due = next_fire(_legacy_rule(r), now)
+        if due is not None:
+            updates.append((int(due.timestamp()), r["id"]))
+    conn.executemany("UPDATE reminders SET next_run=? WHERE id=?", updates)
+
+def _m004_money_ledger(conn):
+    # Agregat keuangan: saldo per chat & ringkasan per bulan, diisi dari data lama
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS money_totals (
+        chat_id INTEGER PRIMARY KEY,
+        balance INTEGER NOT NULL DEFAULT 0,
+        tx_count INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS money_monthly (
+        chat_id INTEGER NOT NULL,
+        month TEXT NOT NULL,     -- 'YYYY-MM' (waktu lokal, sama dgn created_at)
+        income INTEGER NOT NULL DEFAULT 0,
+        expense INTEGER NOT NULL DEFAULT 0,
+        tx_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, month)
+    ) WITHOUT ROWID
+    """)
+    rebuild_money_ledger(conn)
+
+def _m005_delivery_log(conn):
+    # Outbox per kejadian reminder: (reminder_id, occurrence) unik, jadi satu
+    # kejadian hanya bisa diklaim sekali walau bot restart / ada beberapa proses.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS reminder_deliveries (
+        reminder_id INTEGER NOT NULL,
+        occurrence INTEGER NOT NULL,   -- epoch UTC jadwal kejadian
+        chat_id INTEGER NOT NULL,
+        message TEXT NOT NULL,
+        state TEXT NOT NULL,           -- 'pending' | 'sent' | 'failed' | 'expired'
+        attempts INTEGER NOT NULL DEFAULT 0,
+        updated_at INTEGER NOT NULL,   -- epoch UTC
+        PRIMARY KEY (reminder_id, occurrence)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_state ON reminder_deliveries (state, updated_at)")
+    # penjaga lama per menit global, digantikan tabel di atas
+    conn.execute("DROP TABLE IF EXISTS _sent_guard")
+
+def _m006_notes_fts(conn):
+    # Index full-text catatan. External content (content='notes'): teks tidak
+    # disimpan dua kali, FTS hanya menyimpan index-nya. chat_id ikut di-index
+    # supaya pencarian langsung dibatasi ke satu chat di dalam FTS, bukan
+    # menyaring hasil semua chat setelahnya. prefix='2 3' = index prefix
+    # pendek supaya query "kop*" tidak perlu menelusuri seluruh kosakata.
+    conn.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+        content, chat_id,
+        content='notes', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS notes_fts_ai AFTER INSERT ON notes BEGIN
+        INSERT INTO notes_fts (rowid, content, chat_id) VALUES (new.id, new.content, new.chat_id);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS notes_fts_ad AFTER DELETE ON notes BEGIN
+        INSERT INTO notes_fts (notes_fts, rowid, content, chat_id) VALUES ('delete', old.id, old.content, old.chat_id);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS notes_fts_au AFTER UPDATE ON notes BEGIN
+        INSERT INTO notes_fts (notes_fts, rowid, content, chat_id) VALUES ('delete', old.id, old.content, old.chat_id);
+        INSERT INTO notes_fts (rowid, content, chat_id) VALUES (new.id, new.content, new.chat_id);
+    END
+    """)
+    rebuild_notes_index(conn)
+
+def rebuild_notes_index(conn):
+    """Bangun ulang index FTS dari tabel notes (backfill DB lama / perbaikan)."""
+    conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('optimize')")
+
+def _m007_recurrence(conn):
+    # Zona waktu per chat + aturan berulang yang lebih kaya. tz NULL = TZ dari env.
+    if not _column_exists(conn, "users", "tz"):
+        conn.execute("ALTER TABLE users ADD COLUMN tz TEXT")
+    for column, ddl in (
+        ("tz", "tz TEXT"),                                    # zona waktu aturan
+        ("every", "every INTEGER NOT NULL DEFAULT 1"),        # 'daily': tiap N hari
+        ("anchor", "anchor TEXT"),                            # 'daily' N>1: tanggal lokal kejadian pertama
+        ("days_mask", "days_mask INTEGER NOT NULL DEFAULT 0"),  # 'weekly': bit 0=Senin .. bit 6=Minggu
+        ("month_day", "month_day INTEGER NOT NULL DEFAULT 0"),  # 'monthly': tanggal 1..31
+    ):
+        if not _column_exists(conn, "reminders", column):
+            conn.execute(f"ALTER TABLE reminders ADD COLUMN {ddl}")
+    conn.execute("UPDATE reminders SET days_mask = 1 << weekday WHERE kind='weekly' AND weekday IS NOT NULL AND days_mask=0")
+
+def _m008_notes_fts_bulk(conn):
+    # Saklar untuk impor massal: selama impor, trigger FTS per baris dilewati dan
+    # index diisi sekaligus dengan INSERT ... SELECT (jauh lebih cepat).
+    conn.execute("CREATE TABLE IF NOT EXISTS notes_fts_bulk (active INTEGER NOT NULL)")
+    if conn.execute("SELECT COUNT(*) FROM notes_fts_bulk").fetchone()[0] == 0:
+        conn.execute("INSERT INTO notes_fts_bulk (active) VALUES (0)")
+    conn.execute("DROP TRIGGER IF EXISTS notes_fts_ai")
+    conn.execute("""
+    CREATE TRIGGER notes_fts_ai AFTER INSERT ON notes
+    WHEN (SELECT active FROM notes_fts_bulk) = 0 BEGIN
+        INSERT INTO notes_fts (rowid, content, chat_id) VALUES (new.id, new.content, new.chat_id);
+    END
+    """)
+
+def _m009_maintenance(conn):
+    # Kapan reminder dimatikan (untuk retensi) dan bulan yang transaksinya sudah direkap
+    if not _column_exists(conn, "reminders", "inactive_since"):
+        conn.execute("ALTER TABLE reminders ADD COLUMN inactive_since INTEGER")
+    conn.execute("UPDATE reminders SET inactive_since=? WHERE active=0 AND inactive_since IS NULL",
+                 (int(time.time()),))
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reminders_inactive ON reminders (inactive_since) WHERE active=0")
+    if not _column_exists(conn, "money_monthly", "rolled_up"):
+        conn.execute("ALTER TABLE money_monthly ADD COLUMN rolled_up INTEGER NOT NULL DEFAULT 0")
+
+MIGRATIONS = [
+    (1, "tabel dasar", _m001_base_tables),
+    (2, "index per chat", _m002_chat_indexes),
+    (3, "kolom reminders.next_run", _m003_reminder_next_run),
+    (4, "ledger saldo & ringkasan bulanan", _m004_money_ledger),
+    (5, "log pengiriman reminder", _m005_delivery_log),
+    (6, "index full-text catatan", _m006_notes_fts),
+    (7, "zona waktu per chat & aturan reminder", _m007_recurrence),
+    (8, "impor massal catatan", _m008_notes_fts_bulk),
+    (9, "retensi reminder & rekap keuangan", _m009_maintenance),
+]
+
+def migrate(conn) -> int:
+    """Terapkan migrasi yang belum jalan; kembalikan versi skema terbaru."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )
+    """)
+    current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+    for version, name, fn in MIGRATIONS:
+        if version <= current:
+            continue
+        # BEGIN eksplisit: sqlite3 tidak membuka transaksi otomatis untuk DDL
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            fn(conn)
+            conn.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?,?,?)",
+                         (version, name, iso(now_local())))
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        log.info("Migrasi %d (%s) diterapkan", version, name)
+        current = version
+    return current
 
 def init_db():
-    with CONN:
-        CONN.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id INTEGER UNIQUE NOT NULL
-        )
-        """)
-        CONN.execute("""
-        CREATE TABLE IF NOT EXISTS notes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id INTEGER NOT NULL,
-            content TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        )
-        """)
-        CONN.execute("""
-        CREATE TABLE IF NOT EXISTS money (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id INTEGER NOT NULL,
-            amount INTEGER NOT NULL,
-            description TEXT,
-            created_at TEXT NOT NULL
-        )
-        """)
-        CONN.execute("""
-        CREATE TABLE IF NOT EXISTS reminders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id INTEGER NOT NULL,
-            kind TEXT NOT NULL,      -- 'once' | 'daily' | 'weekly'
-            message TEXT NOT NULL,
-            run_at TEXT,             -- ISO: utk 'once'
-            time_of_day TEXT,        -- 'HH:MM' utk 'daily' & 'weekly'
-            weekday INTEGER,         -- 0=Mon..6=Sun utk 'weekly'
-            created_at TEXT NOT NULL,
-            active INTEGER NOT NULL DEFAULT 1
-        )
-        """)
+    conn = db_connect()
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+
+# Query yang dijalankan handler; dicek dengan EXPLAIN QUERY PLAN lewat
+# `python bot.py --check-queries` (dan tests/) supaya tidak ada yang full table
+# scan. SQL diambil dari konstanta/builder yang dipakai handler, jadi daftar ini
+# tidak bisa basi saat query diubah.
+def handler_queries():
+    """Kembalikan {nama: (sql, params)} dengan parameter contoh."""
+    queries = {
+        "chat_tz": (CHAT_TZ_SQL, (1,)),
+        "note_del": (NOTE_DELETE_SQL, (1, 1)),
+        "note_search": (NOTE_SEARCH_SQL, (_fts_query(1, ["kopi"]), 1, PAGE_SIZE)),
+        "money_balance": (BALANCE_SQL, (1,)),
+        "money_balance_recent": (BALANCE_RECENT_SQL, (1,)),
+        "money_report_summary": (MONTH_SUMMARY_SQL, (1, "2025-01")),
+        "money_report_categories": (CATEGORY_SQL, (1,) + _month_bounds(2025, 1)),
+        "reminder_list": (REMINDER_LIST_SQL, (1,)),
+        "reminder_del": (REMINDER_DEACTIVATE_SQL, (0, 1, 1)),
+        "load_reminders": (SCHEDULE_SQL, (1, 0)),
+        "resend_pending": (PENDING_SQL, (1, 0)),
+        "compact_deliveries": (COMPACT_DELIVERIES_SQL, (0, 1)),
+    }
+    for direction in ("first", "old", "new"):
+        queries[f"note_list_{direction}"] = _notes_page_query(1, direction, 1)
+    for direction in ("first", "prev", "next"):
+        queries[f"money_report_{direction}"] = _money_page_query(1, "2025-01", direction, 1)
+    for kind, (sql, _) in EXPORTS.items():
+        queries[f"{kind}_export"] = (sql, (1,))
+    return queries
+
+def _is_full_scan(detail: str) -> bool:
+    # Semua SCAN membaca seluruh tabel/index, termasuk "SCAN t USING (COVERING)
+    # INDEX ...". Kecuali tabel virtual yang dibatasi constraint, mis. FTS5 MATCH
+    # ("VIRTUAL TABLE INDEX 0:M2"); tanpa constraint detailnya berakhir "0:".
+    return detail.startswith("SCAN ") and not re.search(r"VIRTUAL TABLE INDEX \d+:\S", detail)
+
+def check_query_plans(conn):
+    """Kembalikan daftar (nama, detail) untuk query yang melakukan full scan."""
+    bad = []
+    for name, (sql, params) in handler_queries().items():
+        for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+            detail = row["detail"]
+            if _is_full_scan(detail):
+                bad.append((name, detail))
+    return bad
+
+# ---- Cache per chat ----
+# Data kecil yang sering dibaca ulang (daftar reminder, saldo) disimpan di memori
+# proses dan dibuang oleh handler yang mengubahnya (write-through invalidation).
+# Aman karena satu chat selalu ditangani proses yang sama (lihat MULTI-PROSES)
+# dan update dalam satu chat diproses berurutan. Dengan DB bersama (STORAGE_URL)
+# node lain bisa mengubah data, jadi default-nya cache dimatikan.
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "0" if STORAGE_URL else "10000"))  # jumlah chat per cache
 
-def ensure_user(chat_id: int):
-    with CONN:
-        CONN.execute("INSERT OR IGNORE INTO users (chat_id) VALUES (?)", (chat_id,))
+class LRUCache:
+    """Cache LRU berukuran tetap. Pembaca mengambil `epoch` sebelum query DB dan
+    menyerahkannya ke put(); kalau di antaranya ada invalidate, hasil query itu
+    mungkin sudah basi dan tidak disimpan."""
+
+    def __init__(self, maxsize: int = CHAT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.epoch = 0
+        self._data = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is None:
+            self.stats["misses"] += 1
+            return None
+        self._data.move_to_end(key)
+        self.stats["hits"] += 1
+        return value
+
+    def put(self, key, value, epoch: int):
+        if epoch != self.epoch or not self.maxsize:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, key):
+        self.epoch += 1
+        self._data.pop(key, None)
+
+KNOWN_USERS = set()                # chat_id yang pasti sudah ada di tabel users
+REMINDER_CACHE = LRUCache()        # chat_id -> baris reminder aktif
+BALANCE_CACHE = LRUCache()         # chat_id -> (saldo, 10 transaksi terakhir)
+TZ_CACHE = LRUCache()              # chat_id -> nama zona waktu ("" = default)
+
+async def ensure_user(chat_id: int):
+    # user lama tidak perlu transaksi tulis sama sekali
+    if chat_id in KNOWN_USERS:
+        return
+    await STORE.ensure_user(chat_id)
+    KNOWN_USERS.add(chat_id)
+
+CHAT_TZ_SQL = "SELECT tz FROM users WHERE chat_id=?"
+
+async def chat_tz_name(chat_id: int) -> Optional[str]:
+    """Zona waktu pilihan chat (/timezone), atau None kalau memakai TZ default."""
+    name = TZ_CACHE.get(chat_id)
+    if name is None:
+        epoch = TZ_CACHE.epoch
+        name = await STORE.chat_tz(chat_id) or ""
+        TZ_CACHE.put(chat_id, name, epoch)
+    return name or None
 
 # ========= UTIL =========
 def now_local():
@@ -102,10 +896,13 @@ START_TEXT = (
     "• /reminder_help – bantuan reminder\n"
     "• /note_add <teks> – tambah catatan\n"
     "• /note_list – lihat catatan\n"
+    "• /note_search <kata> – cari catatan\n"
     "• /note_del <id> – hapus catatan\n"
+    "• /note_import, /note_export [csv|jsonl] – impor/ekspor catatan\n"
     "• /money_add <+/-nominal> <keterangan> – catat transaksi\n"
     "• /money_balance – lihat saldo & ringkas\n"
-    "• /money_report [mm yyyy] – laporan bulan berjalan/tertentu\n"
+    "• /money_report [mm yyyy] [grafik] – laporan bulan berjalan/tertentu\n"
+    "• /money_import, /money_export [csv|jsonl] – impor/ekspor transaksi\n"
     "• /weather <kota> – cuaca saat ini\n"
 )
 
@@ -116,15 +913,20 @@ REMINDER_HELP = (
     "  Contoh: /reminder_once 2025-08-19 14:30 Meeting PM\n"
     "• /reminder_daily <HH:MM> <pesan>\n"
     "  Contoh: /reminder_daily 06:00 Sholat Subuh\n"
-    "• /reminder_weekly <Senin..Minggu> <HH:MM> <pesan>\n"
-    "  Contoh: /reminder_weekly Jumat 16:00 Rapat mingguan\n"
+    "• /reminder_every <N> <HH:MM> <pesan> – tiap N hari\n"
+    "  Contoh: /reminder_every 3 07:00 Siram tanaman\n"
+    "• /reminder_weekly <Senin..Minggu[,hari lain]> <HH:MM> <pesan>\n"
+    "  Contoh: /reminder_weekly Senin,Rabu,Jumat 16:00 Olahraga\n"
+    "• /reminder_monthly <1-31> <HH:MM> <pesan>\n"
+    "  Contoh: /reminder_monthly 25 09:00 Bayar listrik\n"
+    "• /timezone [Area/Kota | WIB | WITA | WIT] – lihat/ganti zona waktu\n"
     "• /reminder_list – daftar reminder aktif\n"
     "• /reminder_del <id> – matikan reminder\n"
 )
 
 # ========= HANDLERS DASAR =========
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ensure_user(update.effective_chat.id)
+    await ensure_user(update.effective_chat.id)
     await update.message.reply_text(START_TEXT, parse_mode=ParseMode.MARKDOWN)
 
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -133,28 +935,146 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ========= CATATAN =========
 async def note_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    ensure_user(chat_id)
+    await ensure_user(chat_id)
     text = " ".join(context.args).strip()
     if not text:
         await update.message.reply_text("Contoh: /note_add Beli kopi susu.")
         return
-    with CONN:
-        CONN.execute(
-            "INSERT INTO notes (chat_id, content, created_at) VALUES (?,?,?)",
-            (chat_id, text, iso(now_local()))
-        )
+    await STORE.add_note(chat_id, text, iso(now_local()))
     await update.message.reply_text("📝 Catatan ditambahkan.")
 
+# Daftar dipecah per halaman dengan keyset pagination (WHERE id < ? LIMIT n),
+# jadi tiap request hanya membaca satu halaman berapapun panjang riwayatnya.
+PAGE_SIZE = 20
+PREVIEW_CHARS = 200  # potong teks panjang supaya satu baris tidak memenuhi halaman
+MESSAGE_LIMIT = 4000  # di bawah batas 4096 karakter pesan Telegram; halaman dipotong kalau lewat
+
+def _preview(text: Optional[str], limit: int = PREVIEW_CHARS) -> str:
+    text = text or ""
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def _message_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2   # Telegram menghitung panjang dalam unit UTF-16
+
+def _fit_lines(lines, budget: int, from_end: bool = False) -> int:
+    """Jumlah baris (dari awal, atau dari akhir kalau from_end) yang muat dalam `budget`."""
+    used = 0
+    for n, line in enumerate(reversed(lines) if from_end else lines):
+        used += _message_len(line) + 1   # + newline
+        if used > budget:
+            return max(n, 1)
+    return len(lines)
+
+def _page_keyboard(prev_data: Optional[str], next_data: Optional[str],
+                   prev_label: str = "⬅️ Sebelumnya", next_label: str = "Berikutnya ➡️"):
+    buttons = []
+    if prev_data:
+        buttons.append(InlineKeyboardButton(prev_label, callback_data=prev_data))
+    if next_data:
+        buttons.append(InlineKeyboardButton(next_label, callback_data=next_data))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+def _notes_page_query(chat_id: int, direction: str, cursor: int):
+    """direction: 'first' | 'old' (id < cursor) | 'new' (id > cursor). Kembalikan (sql, params)."""
+    limit = PAGE_SIZE + 1
+    if direction == "new":
+        return ("SELECT id, content, created_at FROM notes WHERE chat_id=? AND id>? ORDER BY id ASC LIMIT ?",
+                (chat_id, cursor, limit))
+    if direction == "old":
+        return ("SELECT id, content, created_at FROM notes WHERE chat_id=? AND id<? ORDER BY id DESC LIMIT ?",
+                (chat_id, cursor, limit))
+    return ("SELECT id, content, created_at FROM notes WHERE chat_id=? ORDER BY id DESC LIMIT ?",
+            (chat_id, limit))
+
+def _notes_page_result(rows, direction: str):
+    """Kembalikan (rows urut id turun, ada_lebih_baru, ada_lebih_lama)."""
+    more = len(rows) > PAGE_SIZE
+    if direction == "new":
+        return list(reversed(rows[:PAGE_SIZE])), more, True
+    return rows[:PAGE_SIZE], direction == "old", more
+
+def _fetch_notes_page(conn, chat_id: int, direction: str, cursor: int):
+    sql, params = _notes_page_query(chat_id, direction, cursor)
+    return _notes_page_result(conn.execute(sql, params).fetchall(), direction)
+
+async def _render_notes(chat_id: int, direction: str = "first", cursor: int = 0):
+    rows, has_newer, has_older = await STORE.notes_page(chat_id, direction, cursor)
+    if not rows:
+        return None, None
+    head = "📒 *Catatan:*\n"
+    lines = [f"{r['id']}. {_preview(r['content'])}  _({r['created_at']})_" for r in rows]
+    # Satu halaman penuh catatan panjang bisa melewati batas pesan: sisanya pindah
+    # ke halaman berikutnya. Baris yang dibuang selalu yang terjauh dari cursor,
+    # jadi tombol navigasi (id baris tepi yang tampil) tidak melompati catatan.
+    keep = _fit_lines(lines, MESSAGE_LIMIT - _message_len(head), from_end=direction == "new")
+    if keep < len(rows):
+        if direction == "new":
+            rows, lines, has_newer = rows[-keep:], lines[-keep:], True
+        else:
+            rows, lines, has_older = rows[:keep], lines[:keep], True
+    markup = _page_keyboard(
+        f"notes:new:{rows[0]['id']}" if has_newer else None,
+        f"notes:old:{rows[-1]['id']}" if has_older else None,
+        prev_label="⬅️ Lebih baru", next_label="Lebih lama ➡️",
+    )
+    return head + "\n".join(lines), markup
+
 async def note_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    rows = CONN.execute(
-        "SELECT id, content, created_at FROM notes WHERE chat_id=? ORDER BY id DESC", (chat_id,)
-    ).fetchall()
-    if not rows:
+    text, markup = await _render_notes(chat_id)
+    if text is None:
         await update.message.reply_text("Belum ada catatan.")
         return
-    lines = [f"{r['id']}. {r['content']}  _({r['created_at']})_" for r in rows[:100]]
-    await update.message.reply_text("📒 *Catatan:*\n" + "\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+    await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+
+async def note_list_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    _, direction, cursor = query.data.split(":")
+    text, markup = await _render_notes(update.effective_chat.id, direction, int(cursor))
+    if text is None:
+        await query.edit_message_text("Tidak ada catatan lagi.")
+        return
+    await query.edit_message_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+
+# Pencarian lewat FTS5 (tabel notes_fts, dijaga sinkron oleh trigger). Input
+# user dipecah jadi kata lalu tiap kata di-quote sebagai prefix ("kop"*), jadi
+# operator FTS dari user tidak pernah diinterpretasi mentah.
+SEARCH_MAX_TERMS = 8
+
+def _search_terms(text: str):
+    return re.findall(r"\w+", text)[:SEARCH_MAX_TERMS]
+
+def _fts_query(chat_id: int, terms) -> str:
+    words = " AND ".join(f'"{t}"*' for t in terms)
+    return f'chat_id:"{abs(chat_id)}" AND content:({words})'
+
+# chat_id di FTS di-tokenize tanpa tanda minus, jadi tetap dicek ulang di notes
+NOTE_SEARCH_SQL = """
+    SELECT n.id, n.created_at, snippet(notes_fts, 0, '*', '*', '…', 12) AS snip
+    FROM notes_fts JOIN notes n ON n.id = notes_fts.rowid
+    WHERE notes_fts MATCH ? AND n.chat_id=?
+    ORDER BY bm25(notes_fts, 1.0, 0.0)
+    LIMIT ?
+"""
+
+def _search_notes(conn, chat_id: int, match: str):
+    return conn.execute(NOTE_SEARCH_SQL, (match, chat_id, PAGE_SIZE)).fetchall()
+
+async def note_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    terms = _search_terms(" ".join(context.args))
+    if not terms:
+        await update.message.reply_text("Contoh: /note_search kopi susu")
+        return
+    rows = await STORE.search_notes(chat_id, terms)
+    if not rows:
+        await update.message.reply_text("Tidak ada catatan yang cocok.")
+        return
+    lines = [f"{r['id']}. {r['snip']}  _({r['created_at']})_" for r in rows]
+    await update.message.reply_text("🔎 *Hasil pencarian:*\n" + "\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+NOTE_DELETE_SQL = "DELETE FROM notes WHERE id=? AND chat_id=?"
 
 async def note_del(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
@@ -162,17 +1082,123 @@ async def note_del(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Contoh: /note_del 12")
         return
     rid = int(context.args[0])
-    with CONN:
-        cur = CONN.execute("DELETE FROM notes WHERE id=? AND chat_id=?", (rid, chat_id))
-    if cur.rowcount:
+    if await STORE.delete_note(chat_id, rid):
         await update.message.reply_text(f"Catatan {rid} dihapus.")
     else:
         await update.message.reply_text("ID tidak ditemukan.")
 
 # ========= KEUANGAN =========
+# Saldo & ringkasan bulanan disimpan di money_totals / money_monthly dan
+# di-update dalam transaksi yang sama dengan INSERT ke money, jadi saldo cukup
+# dibaca satu baris tanpa SUM atas seluruh riwayat.
+# INTEGER SQLite / BIGINT PostgreSQL. Simetris supaya -amount (kolom expense)
+# juga muat. Saldo & total bulanan dijaga di rentang yang sama oleh _ledger_fit:
+# SQLite diam-diam mengubah hasil penjumlahan yang lewat batas jadi REAL.
+AMOUNT_MIN, AMOUNT_MAX = -(2**63 - 1), 2**63 - 1
+
+def _ledger_deltas(rows):
+    """Jumlahkan transaksi (chat_id, amount, created_at) per chat / bulan, jadi impor
+    besar cukup beberapa upsert per potong. Kembalikan (totals, monthly) terurut kunci."""
+    totals = defaultdict(lambda: [0, 0])
+    monthly = defaultdict(lambda: [0, 0, 0])
+    for chat_id, amount, created_at in rows:
+        t = totals[chat_id]
+        t[0] += amount
+        t[1] += 1
+        m = monthly[(chat_id, created_at[:7])]
+        m[0 if amount > 0 else 1] += abs(amount)
+        m[2] += 1
+    return ([(chat_id, balance, n) for chat_id, (balance, n) in sorted(totals.items())],
+            [(chat_id, month, inc, exp, n) for (chat_id, month), (inc, exp, n) in sorted(monthly.items())])
+
+def _ledger_apply(conn, rows):
+    """Tambahkan transaksi (chat_id, amount, created_at) ke agregat."""
+    totals, monthly = _ledger_deltas(rows)
+    conn.executemany("""
+        INSERT INTO money_totals (chat_id, balance, tx_count) VALUES (?, ?, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET
+            balance = balance + excluded.balance,
+            tx_count = tx_count + excluded.tx_count
+    """, totals)
+    conn.executemany("""
+        INSERT INTO money_monthly (chat_id, month, income, expense, tx_count) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(chat_id, month) DO UPDATE SET
+            income = income + excluded.income,
+            expense = expense + excluded.expense,
+            tx_count = tx_count + excluded.tx_count,
+            rolled_up = 0
+    """, monthly)
+
+def _ledger_fit(rows, balances, months):
+    """Saring transaksi (chat_id, amount, keterangan, created_at) yang membuat saldo
+    atau pemasukan / pengeluaran bulanan keluar dari rentang int64. `balances`
+    {chat_id: saldo} dan `months` {(chat_id, 'YYYY-MM'): (pemasukan, pengeluaran)}
+    adalah nilai di DB saat ini. Kembalikan baris yang aman ditulis, urutan tetap."""
+    balances, months = dict(balances), dict(months)
+    fit = []
+    for row in rows:
+        chat_id, amount, created_at = row[0], row[1], row[3]
+        key = (chat_id, created_at[:7])
+        balance = balances.get(chat_id, 0) + amount
+        income, expense = months.get(key, (0, 0))
+        if amount > 0:
+            income += amount
+        else:
+            expense -= amount
+        if not AMOUNT_MIN <= balance <= AMOUNT_MAX or income > AMOUNT_MAX or expense > AMOUNT_MAX:
+            continue
+        balances[chat_id] = balance
+        months[key] = (income, expense)
+        fit.append(row)
+    return fit
+
+def _ledger_keys(rows):
+    """(chat_id terurut, (chat_id, bulan) terurut) yang disentuh transaksi `rows`."""
+    return sorted({r[0] for r in rows}), sorted({(r[0], r[3][:7]) for r in rows})
+
+def _checked_money_rows(conn, rows):
+    chats, keys = _ledger_keys(rows)
+    balances, months = {}, {}
+    for chat_id in chats:
+        row = conn.execute(BALANCE_SQL, (chat_id,)).fetchone()
+        if row:
+            balances[chat_id] = row["balance"]
+    for chat_id, month in keys:
+        row = conn.execute(MONTH_SUMMARY_SQL, (chat_id, month)).fetchone()
+        if row:
+            months[(chat_id, month)] = (row["income"], row["expense"])
+    return _ledger_fit(rows, balances, months)
+
+def _insert_money(conn, chat_id: int, amount: int, desc: str, created_at: str) -> Optional[int]:
+    """Catat satu transaksi; None kalau saldo / total bulanan akan melewati batas."""
+    row = (chat_id, amount, desc, created_at)
+    if not _checked_money_rows(conn, [row]):
+        return None
+    cur = conn.execute("INSERT INTO money (chat_id, amount, description, created_at) VALUES (?,?,?,?)", row)
+    _ledger_apply(conn, [(chat_id, amount, created_at)])
+    return cur.lastrowid
+
+def rebuild_money_ledger(conn, chat_id: Optional[int] = None):
+    """Hitung ulang agregat dari tabel money (semua chat, atau satu chat)."""
+    where, params = ("WHERE chat_id=?", (chat_id,)) if chat_id is not None else ("", ())
+    conn.execute(f"DELETE FROM money_totals {where}", params)
+    conn.execute(f"DELETE FROM money_monthly {where}", params)
+    conn.execute(f"""
+        INSERT INTO money_totals (chat_id, balance, tx_count)
+        SELECT chat_id, SUM(amount), COUNT(*) FROM money {where} GROUP BY chat_id
+    """, params)
+    conn.execute(f"""
+        INSERT INTO money_monthly (chat_id, month, income, expense, tx_count)
+        SELECT chat_id, substr(created_at, 1, 7),
+               SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END),
+               SUM(CASE WHEN amount < 0 THEN -amount ELSE 0 END),
+               COUNT(*)
+        FROM money {where} GROUP BY chat_id, substr(created_at, 1, 7)
+    """, params)
+
 async def money_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    ensure_user(chat_id)
+    await ensure_user(chat_id)
     if len(context.args) < 2:
         await update.message.reply_text("Format: /money_add <+/-nominal> <keterangan>\nContoh: /money_add -15000 Beli kopi")
         return
@@ -181,22 +1207,40 @@ async def money_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.message.reply_text("Nominal harus angka (boleh negatif/positif).")
         return
+    if not AMOUNT_MIN <= amount <= AMOUNT_MAX:
+        await update.message.reply_text("Nominal terlalu besar.")
+        return
     desc = " ".join(context.args[1:]).strip()
-    with CONN:
-        CONN.execute(
-            "INSERT INTO money (chat_id, amount, description, created_at) VALUES (?,?,?,?)",
-            (chat_id, amount, desc, iso(now_local()))
-        )
+    created_at = iso(now_local())
+    if await STORE.add_money(chat_id, amount, desc, created_at) is None:
+        await update.message.reply_text("Transaksi ditolak: saldo atau total bulan ini akan melewati batas.")
+        return
+    BALANCE_CACHE.invalidate(chat_id)
+    REPORT_CACHE.invalidate((chat_id, created_at[:7]))
     await update.message.reply_text("✅ Transaksi dicatat.")
 
+BALANCE_SQL = "SELECT balance FROM money_totals WHERE chat_id=?"
+# ringkas 10 transaksi terakhir menurut waktu (bukan id: impor & rekap bulan lama
+# menambah baris ber-id baru dengan created_at lama)
+BALANCE_RECENT_SQL = """
+    SELECT amount, description, created_at FROM money WHERE chat_id=?
+    ORDER BY created_at DESC, id DESC LIMIT 10
+"""
+MONTH_SUMMARY_SQL = "SELECT income, expense, tx_count FROM money_monthly WHERE chat_id=? AND month=?"
+
+def _fetch_balance(conn, chat_id: int):
+    row = conn.execute(BALANCE_SQL, (chat_id,)).fetchone()
+    rows = conn.execute(BALANCE_RECENT_SQL, (chat_id,)).fetchall()
+    return (row["balance"] if row else 0), rows
+
 async def money_balance(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    row = CONN.execute("SELECT COALESCE(SUM(amount),0) AS saldo FROM money WHERE chat_id=?", (chat_id,)).fetchone()
-    saldo = row["saldo"] if row else 0
-    # ringkas 10 transaksi terakhir
-    rows = CONN.execute(
-        "SELECT amount, description, created_at FROM money WHERE chat_id=? ORDER BY id DESC LIMIT 10", (chat_id,)
-    ).fetchall()
+    cached = BALANCE_CACHE.get(chat_id)
+    if cached is None:
+        epoch = BALANCE_CACHE.epoch
+        cached = await STORE.balance(chat_id)
+        BALANCE_CACHE.put(chat_id, cached, epoch)
+    saldo, rows = cached
     lines = [f"{r['created_at']}: {r['amount']} ({r['description']})" for r in rows]
     await update.message.reply_text(
         f"💰 *Saldo:* {saldo}\n\n*Terakhir:* \n" + ("\n".join(lines) if lines else "-"),
@@ -208,13 +1252,179 @@ BULAN_MAP = {
     "juli": 7, "agustus": 8, "september": 9, "oktober": 10, "november": 11, "desember": 12
 }
 
+def _month_bounds(tahun: int, bulan: int):
+    """Batas string created_at untuk satu bulan: [YYYY-MM, YYYY-MM berikutnya)."""
+    nxt = (tahun + 1, 1) if bulan == 12 else (tahun, bulan + 1)
+    return f"{tahun:04d}-{bulan:02d}", f"{nxt[0]:04d}-{nxt[1]:02d}"
+
+def _money_page_query(chat_id: int, month: str, direction: str, cursor: int):
+    """Transaksi satu bulan urut (created_at, id). direction: 'first' | 'next' | 'prev'.
+    Kembalikan (sql, params)."""
+    start, end = _month_bounds(int(month[:4]), int(month[5:7]))
+    limit = PAGE_SIZE + 1
+    base = "SELECT id, amount, description, created_at FROM money WHERE chat_id=? AND created_at>=? AND created_at<?"
+    key = "(SELECT created_at FROM money WHERE id=?)"
+    if direction == "prev":
+        return (base + f" AND (created_at, id) < ({key}, ?) ORDER BY created_at DESC, id DESC LIMIT ?",
+                (chat_id, start, end, cursor, cursor, limit))
+    if direction == "next":
+        return (base + f" AND (created_at, id) > ({key}, ?) ORDER BY created_at, id LIMIT ?",
+                (chat_id, start, end, cursor, cursor, limit))
+    return base + " ORDER BY created_at, id LIMIT ?", (chat_id, start, end, limit)
+
+def _money_page_result(rows, direction: str):
+    """Kembalikan (rows urut naik, ada_sebelumnya, ada_berikutnya)."""
+    more = len(rows) > PAGE_SIZE
+    if direction == "prev":
+        return list(reversed(rows[:PAGE_SIZE])), more, True
+    return rows[:PAGE_SIZE], direction == "next", more
+
+def _fetch_money_page(conn, chat_id: int, month: str, direction: str, cursor: int):
+    sql, params = _money_page_query(chat_id, month, direction, cursor)
+    return _money_page_result(conn.execute(sql, params).fetchall(), direction)
+
+# ---- Rincian per kategori & grafik ----
+# Transaksi dijumlah per keterangan oleh DB (GROUP BY), lalu dilipat ke kategori
+# (#tag atau kata pertama) di Python. Hasilnya di-cache per (chat, bulan) dan
+# dibuang saat ada transaksi baru di bulan itu. Grafik dirender di proses
+# terpisah supaya matplotlib tidak menahan event loop.
+REPORT_TOP_CATEGORIES = 8
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "1"))
+HAS_MATPLOTLIB = importlib.util.find_spec("matplotlib") is not None  # diimpor hanya di proses grafik
+
+# Entri bisa berisi PNG grafik (puluhan KB), jadi batasnya jauh di bawah CHAT_CACHE_SIZE
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "0" if STORAGE_URL else "200"))
+REPORT_CACHE = LRUCache(REPORT_CACHE_SIZE)   # (chat_id, 'YYYY-MM') -> MonthReport
+
+CATEGORY_SQL = """
+    SELECT description,
+           SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) AS income,
+           SUM(CASE WHEN amount < 0 THEN -amount ELSE 0 END) AS expense
+    FROM money WHERE chat_id=? AND created_at>=? AND created_at<?
+    GROUP BY description
+"""
+
+def _fetch_categories(conn, chat_id: int, month: str):
+    start, end = _month_bounds(int(month[:4]), int(month[5:7]))
+    cur = conn.cursor()
+    cur.row_factory = None
+    return cur.execute(CATEGORY_SQL, (chat_id, start, end)).fetchall()
+
+def _category(description: Optional[str]) -> str:
+    text = (description or "").strip().lower()
+    tag = re.search(r"#(\w+)", text)
+    if tag:
+        return tag.group(1)
+    return text.split(maxsplit=1)[0] if text else "lainnya"
+
+def _categorize(rows):
+    """[(keterangan, pemasukan, pengeluaran)] -> [(kategori, pengeluaran)] terbesar dulu;
+    sisa di luar REPORT_TOP_CATEGORIES digabung jadi 'lainnya'."""
+    spent = Counter()
+    for description, _, expense in rows:
+        if expense:
+            spent[_category(description)] += expense
+    top = spent.most_common(REPORT_TOP_CATEGORIES)
+    rest = sum(spent.values()) - sum(v for _, v in top)
+    return top + [("lainnya", rest)] if rest else top
+
+@dataclass
+class MonthReport:
+    income: int
+    expense: int
+    categories: list
+    chart: Optional[bytes] = None   # PNG, dirender saat pertama diminta
+
+async def month_report(chat_id: int, month: str) -> Optional[MonthReport]:
+    key = (chat_id, month)
+    report = REPORT_CACHE.get(key)
+    if report is None:
+        epoch = REPORT_CACHE.epoch
+        summary = await STORE.month_summary(chat_id, month)
+        if not summary:
+            return None
+        categories = _categorize(await STORE.month_categories(chat_id, month))
+        report = MonthReport(summary["income"], summary["expense"], categories)
+        REPORT_CACHE.put(key, report, epoch)
+    return report
+
+def _render_chart_png(title: str, categories) -> bytes:
+    # Jalan di proses grafik: Figure langsung (tanpa pyplot) tidak butuh GUI/state global
+    import io
+    from matplotlib.figure import Figure
+    labels = [name for name, _ in reversed(categories)]
+    values = [value for _, value in reversed(categories)]
+    fig = Figure(figsize=(6, 0.5 * len(labels) + 1.2), dpi=100)
+    ax = fig.subplots()
+    ax.barh(labels, values, color="#d9534f")
+    ax.set_title(title)
+    ax.ticklabel_format(axis="x", style="plain")
+    for i, v in enumerate(values):
+        ax.text(v, i, f" {v:,}".replace(",", "."), va="center", fontsize=8)
+    ax.margins(x=0.2)
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+class ChartRenderer:
+    def __init__(self, workers: int = CHART_WORKERS):
+        self.workers = workers
+        self._pool = None
+
+    async def render(self, title: str, categories) -> bytes:
+        if self._pool is None:
+            # spawn, bukan fork: proses ini punya thread DB yang tidak aman di-fork
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        t0 = time.perf_counter()
+        png = await asyncio.get_running_loop().run_in_executor(self._pool, _render_chart_png, title, categories)
+        METRICS.observe("bot_chart_render_seconds", time.perf_counter() - t0)
+        return png
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+CHARTS = ChartRenderer()
+
+def _format_categories(report: MonthReport) -> str:
+    if not report.categories:
+        return ""
+    lines = ["\nPengeluaran per kategori:"]
+    for name, value in report.categories:
+        share = value * 100 / report.expense if report.expense else 0
+        lines.append(f"  {name}: {value} ({share:.0f}%)")
+    return "\n".join(lines) + "\n"
+
+async def _render_money_report(chat_id: int, month: str, direction: str = "first", cursor: int = 0):
+    report = await month_report(chat_id, month)
+    pemasukan = report.income if report else 0
+    pengeluaran = report.expense if report else 0
+    total = pemasukan - pengeluaran
+    head = f"📊 Laporan {month[5:7]}/{month[:4]}\nTotal: {total}\nPemasukan: {pemasukan}\nPengeluaran: {pengeluaran}\n"
+    if not report:
+        return head + "\n-", None
+    head += _format_categories(report)
+    rows, has_prev, has_next = await STORE.money_page(chat_id, month, direction, cursor)
+    detail = "\n".join(f"{r['created_at']}: {r['amount']} ({_preview(r['description'], 100)})" for r in rows) or "-"
+    markup = _page_keyboard(
+        f"mrep:{month}:prev:{rows[0]['id']}" if rows and has_prev else None,
+        f"mrep:{month}:next:{rows[-1]['id']}" if rows and has_next else None,
+    )
+    return head + "\n" + detail, markup
+
 async def money_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     now = now_local()
-    if len(context.args) >= 2:
+    args = list(context.args)
+    want_chart = bool(args) and args[-1].lower() in ("grafik", "chart")
+    if want_chart:
+        args.pop()
+    if len(args) >= 2:
         # /money_report 08 2025  atau  /money_report Agustus 2025
-        bulan_arg = context.args[0].lower()
-        tahun = int(context.args[1])
+        bulan_arg = args[0].lower()
+        tahun = int(args[1])
         if bulan_arg.isdigit():
             bulan = int(bulan_arg)
         else:
@@ -222,24 +1432,396 @@ async def money_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         bulan, tahun = now.month, now.year
 
-    start = datetime(tahun, bulan, 1, tzinfo=TZ)
-    if bulan == 12:
-        end = datetime(tahun+1, 1, 1, tzinfo=TZ)
-    else:
-        end = datetime(tahun, bulan+1, 1, tzinfo=TZ)
-
-    rows = CONN.execute(
-        "SELECT amount, description, created_at FROM money WHERE chat_id=? AND created_at>=? AND created_at<? ORDER BY id",
-        (chat_id, iso(start), iso(end))
-    ).fetchall()
-    total = sum(r["amount"] for r in rows)
-    pemasukan = sum(r["amount"] for r in rows if r["amount"] > 0)
-    pengeluaran = sum(-r["amount"] for r in rows if r["amount"] < 0)
-    head = f"📊 Laporan {bulan:02d}/{tahun}\nTotal: {total}\nPemasukan: {pemasukan}\nPengeluaran: {pengeluaran}\n"
-    detail = "\n".join([f"{r['created_at']}: {r['amount']} ({r['description']})" for r in rows]) or "-"
-    await update.message.reply_text(head + "\n" + detail)
+    month = f"{tahun:04d}-{bulan:02d}"
+    text, markup = await _render_money_report(chat_id, month)
+    await update.message.reply_text(text, reply_markup=markup)
+    if want_chart:
+        await _send_chart(update, chat_id, month)
+
+async def _send_chart(update: Update, chat_id: int, month: str):
+    if not HAS_MATPLOTLIB:
+        await update.message.reply_text("Grafik butuh paket matplotlib (pip install matplotlib).")
+        return
+    report = await month_report(chat_id, month)
+    if not report or not report.categories:
+        await update.message.reply_text("Belum ada pengeluaran untuk digrafikkan.")
+        return
+    if report.chart is None:
+        report.chart = await CHARTS.render(f"Pengeluaran {month[5:7]}/{month[:4]}", report.categories)
+    await update.message.reply_photo(photo=report.chart, caption=f"📈 Pengeluaran {month[5:7]}/{month[:4]}")
+
+async def money_report_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    _, month, direction, cursor = query.data.split(":")
+    text, markup = await _render_money_report(update.effective_chat.id, month, direction, int(cursor))
+    await query.edit_message_text(text, reply_markup=markup)
+
+# ========= IMPOR / EKSPOR =========
+# Impor: file CSV/JSONL dibaca bertahap di thread terpisah, IMPORT_CHUNK baris
+# per potong, lalu tiap potong ditulis dengan executemany sebagai satu job
+# writer (writer menggabungkan beberapa job dalam satu transaksi). Ekspor:
+# kursor di-iterasi langsung ke file, tanpa memuat seluruh riwayat ke memori.
+IMPORT_CHUNK = int(os.getenv("IMPORT_CHUNK", "5000"))
+
+# nama kolom yang diterima (header CSV / key JSONL, huruf kecil)
+MONEY_FIELDS = {
+    "amount": ("amount", "nominal", "jumlah"),
+    "description": ("description", "keterangan", "desc"),
+    "created_at": ("created_at", "tanggal", "date"),
+}
+NOTE_FIELDS = {
+    "content": ("content", "isi", "catatan", "text"),
+    "created_at": ("created_at", "tanggal", "date"),
+}
+
+IMPORT_HELP = (
+    "Kirim file CSV (baris pertama = header) atau JSONL (satu objek JSON per baris) "
+    "dengan caption {cmd}, atau balas file tersebut dengan {cmd}.\n"
+    "Kolom: {cols}. Kolom tanggal opsional (YYYY-MM-DD atau YYYY-MM-DD HH:MM)."
+)
+
+def _file_format(name: str) -> Optional[str]:
+    name = (name or "").lower()
+    if name.endswith((".csv", ".txt")):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return None
+
+def _read_records(path: str, fmt: str, fields: dict):
+    """Yield dict {nama kolom baku: nilai} per baris; None untuk baris rusak."""
+    alias = {a: key for key, names in fields.items() for a in names}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if fmt == "csv":
+            sample = f.read(4096)
+            f.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+            except csv.Error:
+                dialect = csv.excel
+            reader = csv.reader(f, dialect)
+            header = [alias.get(h.strip().lower()) for h in next(reader, [])]
+            for values in reader:
+                if values:
+                    yield {k: v for k, v in zip(header, values) if k}
+        else:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    obj = json.loads(line)
+                except ValueError:
+                    yield None
+                    continue
+                yield {alias[k.lower()]: v for k, v in obj.items() if k.lower() in alias} if isinstance(obj, dict) else None
+
+@functools.lru_cache(maxsize=4096)
+def _import_timestamp(value: str, tz_name: Optional[str]) -> str:
+    dt = datetime.fromisoformat(value.strip().replace("/", "-"))
+    if dt.tzinfo is None:
+        dt = localize(pytz.timezone(tz_name) if tz_name else TZ, dt)
+    return iso(dt)
+
+def _parse_amount(value) -> int:
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    return int(str(value).strip().replace(" ", "").replace("_", ""))
+
+def _money_row(rec: dict, chat_id: int, tz_name: Optional[str], now: str):
+    amount = _parse_amount(rec["amount"])
+    if not AMOUNT_MIN <= amount <= AMOUNT_MAX:
+        # di luar int64: executemany akan OverflowError dan membatalkan satu potong penuh
+        raise ValueError("nominal di luar rentang")
+    created = rec.get("created_at")
+    created = _import_timestamp(str(created), tz_name) if created else now
+    return chat_id, amount, str(rec.get("description") or "").strip(), created
+
+def _note_row(rec: dict, chat_id: int, tz_name: Optional[str], now: str):
+    content = rec.get("content")
+    if not isinstance(content, str) or not content.strip():
+        raise ValueError("isi kosong / bukan teks")   # mis. null di JSONL
+    content = content.strip()
+    created = rec.get("created_at")
+    created = _import_timestamp(str(created), tz_name) if created else now
+    return chat_id, content, created
+
+def _chunks(records, convert, stats: dict):
+    """Kelompokkan baris valid per IMPORT_CHUNK; baris rusak (termasuk None dari
+    _read_records) dihitung di stats['bad']."""
+    chunk = []
+    for rec in records:
+        try:
+            chunk.append(convert(rec))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            stats["bad"] += 1
+            continue
+        if len(chunk) >= IMPORT_CHUNK:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _import_money_chunk(conn, rows) -> int:
+    """Tulis satu potong; baris yang membuat saldo melewati batas dilewati.
+    Kembalikan jumlah baris yang ditulis."""
+    rows = _checked_money_rows(conn, rows)
+    conn.executemany("INSERT INTO money (chat_id, amount, description, created_at) VALUES (?,?,?,?)", rows)
+    _ledger_apply(conn, [(chat_id, amount, created_at) for chat_id, amount, _, created_at in rows])
+    return len(rows)
+
+def _import_notes_chunk(conn, rows) -> int:
+    # Trigger FTS per baris dimatikan selama potong ini, index diisi sekaligus.
+    # Aman: hanya thread writer yang menulis, dan semuanya dalam satu savepoint.
+    conn.execute("UPDATE notes_fts_bulk SET active=1")
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM notes").fetchone()[0]
+    conn.executemany("INSERT INTO notes (chat_id, content, created_at) VALUES (?,?,?)", rows)
+    conn.execute("""
+        INSERT INTO notes_fts (rowid, content, chat_id)
+        SELECT id, content, chat_id FROM notes WHERE id > ?
+    """, (last_id,))
+    conn.execute("UPDATE notes_fts_bulk SET active=0")
+    return len(rows)
+
+IMPORTS = {
+    # nama -> (kolom, konversi baris, method STORE untuk menulis, label)
+    "money": (MONEY_FIELDS, _money_row, "import_money", "transaksi"),
+    "note": (NOTE_FIELDS, _note_row, "import_notes", "catatan"),
+}
+
+async def _run_import(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str, document):
+    chat_id = update.effective_chat.id
+    fields, convert, method, label = IMPORTS[kind]
+    write_chunk = getattr(STORE, method)
+    fmt = _file_format(document.file_name)
+    if fmt is None:
+        await update.message.reply_text("Format file harus .csv atau .jsonl.")
+        return
+    await ensure_user(chat_id)
+    tz_name = await chat_tz_name(chat_id)
+    now = iso(now_local())
+    fd, path = tempfile.mkstemp(prefix=f"import-{chat_id}-", suffix="." + fmt)
+    os.close(fd)
+    stats = {"bad": 0}
+    total = 0
+    months = set()   # bulan yang laporannya perlu dibuang dari cache
+    try:
+        tg_file = await context.bot.get_file(document.file_id)
+        await tg_file.download_to_drive(path)
+        chunks = _chunks(_read_records(path, fmt, fields), lambda rec: convert(rec, chat_id, tz_name, now), stats)
+        while True:
+            # parsing di thread terpisah supaya event loop tidak tertahan
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            written = await write_chunk(chunk)
+            total += written
+            stats["bad"] += len(chunk) - written   # ditolak saat ditulis (saldo melewati batas)
+            if kind == "money":
+                months.update(created_at[:7] for _, _, _, created_at in chunk)
+    except (OSError, UnicodeDecodeError, csv.Error, TelegramError) as e:
+        log.warning("Impor %s gagal: %s", kind, e)
+        await update.message.reply_text(f"Gagal membaca file: {e} ({total} {label} sudah terimpor)")
+        return
+    except STORE_ERRORS as e:
+        # potong yang gagal dibatalkan utuh; potong sebelumnya sudah tersimpan
+        log.warning("Impor %s gagal ditulis: %s", kind, e)
+        await update.message.reply_text(f"Gagal menyimpan data: {e} ({total} {label} sudah terimpor)")
+        return
+    finally:
+        os.unlink(path)
+        if total and kind == "money":
+            BALANCE_CACHE.invalidate(chat_id)
+        for month in months:
+            REPORT_CACHE.invalidate((chat_id, month))
+    METRICS.inc("bot_import_rows_total", total, kind=kind)
+    extra = f", {stats['bad']} baris dilewati (tidak valid)" if stats["bad"] else ""
+    await update.message.reply_text(f"📥 {total} {label} diimpor{extra}.")
+
+async def _import_command(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str):
+    # /money_import sebagai balasan ke pesan berisi file
+    reply = update.message.reply_to_message
+    document = reply.document if reply else None
+    if document is None:
+        cmd = f"/{kind}_import"
+        cols = ", ".join(names[0] for names in IMPORTS[kind][0].values())
+        await update.message.reply_text(IMPORT_HELP.format(cmd=cmd, cols=cols))
+        return
+    await _run_import(update, context, kind, document)
+
+async def money_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _import_command(update, context, "money")
+
+async def note_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _import_command(update, context, "note")
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # file dikirim dengan caption /money_import atau /note_import
+    m = re.match(r"/(money|note)_import\b", update.message.caption or "")
+    await _run_import(update, context, m.group(1), update.message.document)
+
+EXPORTS = {
+    # nama -> (query, header)
+    "money": ("SELECT id, amount, description, created_at FROM money WHERE chat_id=? ORDER BY id",
+              ("id", "amount", "description", "created_at")),
+    "note": ("SELECT id, content, created_at FROM notes WHERE chat_id=? ORDER BY id",
+             ("id", "content", "created_at")),
+}
+
+def _export_to_file(conn, kind: str, chat_id: int, fmt: str, path: str) -> int:
+    sql, header = EXPORTS[kind]
+    cur = conn.cursor()
+    cur.row_factory = None
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for row in cur.execute(sql, (chat_id,)):
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in cur.execute(sql, (chat_id,)):
+                f.write(json.dumps(dict(zip(header, row)), ensure_ascii=False) + "\n")
+                count += 1
+    return count
+
+async def _export_command(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str):
+    chat_id = update.effective_chat.id
+    fmt = (context.args[0].lower() if context.args else "csv")
+    if fmt not in ("csv", "jsonl"):
+        await update.message.reply_text(f"Contoh: /{kind}_export csv  atau  /{kind}_export jsonl")
+        return
+    fd, path = tempfile.mkstemp(prefix=f"export-{chat_id}-", suffix="." + fmt)
+    os.close(fd)
+    try:
+        count = await STORE.export(kind, chat_id, fmt, path)
+        if not count:
+            await update.message.reply_text("Belum ada data untuk diekspor.")
+            return
+        filename = f"{'keuangan' if kind == 'money' else 'catatan'}-{now_local():%Y%m%d}.{fmt}"
+        with open(path, "rb") as f:
+            await update.message.reply_document(document=f, filename=filename, caption=f"📤 {count} baris")
+    finally:
+        os.unlink(path)
+
+async def money_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _export_command(update, context, "money")
+
+async def note_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _export_command(update, context, "note")
 
 # ========= CUACA =========
+# Satu AsyncClient (koneksi di-pool) untuk semua request, cache TTL+LRU per
+# nama kota yang dinormalisasi, dan single-flight: request bersamaan untuk kota
+# yang sama menunggu satu panggilan upstream yang sama. Kota yang tidak dikenal
+# disimpan di negative cache supaya tidak menghabiskan kuota.
+class CityNotFound(Exception):
+    pass
+
+class WeatherError(Exception):
+    pass
+
+class WeatherClient:
+    def __init__(self, api_key: str = OPENWEATHER_API_KEY, base_url: str = OPENWEATHER_URL,
+                 ttl: float = WEATHER_CACHE_TTL, negative_ttl: float = WEATHER_NEGATIVE_TTL,
+                 max_size: int = WEATHER_CACHE_SIZE, timeout: float = 12):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.timeout = timeout
+        self._client = None
+        self._cache = OrderedDict()   # key -> (expires_at, data | None)
+        self._inflight = {}           # key -> asyncio.Task
+        self.stats = {"hits": 0, "negative_hits": 0, "misses": 0, "coalesced": 0,
+                      "upstream_calls": 0, "errors": 0, "upstream_seconds": 0.0}
+
+    @staticmethod
+    def normalize(city: str) -> str:
+        return " ".join(city.split()).casefold()
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            )
+        return self._client
+
+    def _cache_get(self, key: str):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return entry
+
+    def _cache_put(self, key: str, data: Optional[dict], ttl: float):
+        self._cache[key] = (time.monotonic() + ttl, data)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    async def _fetch(self, key: str, city: str) -> dict:
+        self.stats["upstream_calls"] += 1
+        t0 = time.monotonic()
+        try:
+            resp = await self._http().get(self.base_url, params={
+                "q": city, "appid": self.api_key, "lang": "id", "units": "metric",
+            })
+        except httpx.HTTPError:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.stats["upstream_seconds"] += time.monotonic() - t0
+        if resp.status_code == 404:
+            self._cache_put(key, None, self.negative_ttl)
+            raise CityNotFound(city)
+        try:
+            data = resp.json()
+        except ValueError:
+            data = {}
+        if resp.status_code != 200 or str(data.get("cod")) != "200":
+            self.stats["errors"] += 1
+            raise WeatherError(data.get("message") or f"HTTP {resp.status_code}")
+        self._cache_put(key, data, self.ttl)
+        return data
+
+    async def get(self, city: str) -> dict:
+        """Data cuaca mentah OpenWeatherMap; CityNotFound / WeatherError / httpx.HTTPError kalau gagal."""
+        key = self.normalize(city)
+        entry = self._cache_get(key)
+        if entry is not None:
+            if entry[1] is None:
+                self.stats["negative_hits"] += 1
+                raise CityNotFound(city)
+            self.stats["hits"] += 1
+            return entry[1]
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["misses"] += 1
+            task = asyncio.create_task(self._fetch(key, city))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+        # shield: satu pemanggil yang dibatalkan tidak membatalkan yang lain
+        return await asyncio.shield(task)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+WEATHER = WeatherClient()
+
 async def weather(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not OPENWEATHER_API_KEY:
         await update.message.reply_text("OPENWEATHER_API_KEY belum diisi di .env")
@@ -248,21 +1830,19 @@ async def weather(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Contoh: /weather Jakarta")
         return
     city = " ".join(context.args)
-    url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={OPENWEATHER_API_KEY}&lang=id&units=metric"
-
-    # Jalankan request blocking di thread terpisah agar tidak menghambat event loop
-    def do_request():
-        return requests.get(url, timeout=12).json()
     try:
-        data = await asyncio.to_thread(do_request)
+        data = await WEATHER.get(city)
+    except (CityNotFound, WeatherError):
+        await update.message.reply_text("Kota tidak ditemukan atau API error.")
+        return
+    except httpx.TimeoutException:
+        # pesan httpx untuk timeout sering kosong
+        await update.message.reply_text("Layanan cuaca tidak merespons, coba lagi nanti.")
+        return
     except Exception as e:
         await update.message.reply_text(f"Gagal mengambil data: {e}")
         return
 
-    if str(data.get("cod")) != "200":
-        await update.message.reply_text("Kota tidak ditemukan atau API error.")
-        return
-
     desc = data["weather"][0]["description"].title()
     temp = data["main"]["temp"]
     humid = data["main"]["humidity"]
@@ -281,36 +1861,146 @@ HARI_MAP = {
     "jumat": 4, "jum'at": 4, "sabtu": 5, "minggu": 6
 }
 
-def _save_reminder_once(chat_id: int, run_at: datetime, message: str) -> int:
-    with CONN:
-        cur = CONN.execute("""
-            INSERT INTO reminders (chat_id, kind, message, run_at, created_at, active)
-            VALUES (?,?,?,?,?,1)
-        """, (chat_id, "once", message, iso(run_at), iso(now_local())))
-        return cur.lastrowid
-
-def _save_reminder_daily(chat_id: int, hhmm: str, message: str) -> int:
-    with CONN:
-        cur = CONN.execute("""
-            INSERT INTO reminders (chat_id, kind, message, time_of_day, created_at, active)
-            VALUES (?,?,?,?,?,1)
-        """, (chat_id, "daily", message, hhmm, iso(now_local())))
-        return cur.lastrowid
-
-def _save_reminder_weekly(chat_id: int, weekday: int, hhmm: str, message: str) -> int:
-    with CONN:
-        cur = CONN.execute("""
-            INSERT INTO reminders (chat_id, kind, message, time_of_day, weekday, created_at, active)
-            VALUES (?,?,?,?,?,1)
-        """, (chat_id, "weekly", message, hhmm, weekday, iso(now_local())))
-        return cur.lastrowid
+# ---- Aturan berulang ----
+# Waktu jalan selalu dihitung dari tanggal lokal di zona waktu aturan lalu
+# di-localize, jadi jam dinding tetap benar melewati DST. Kebijakan DST:
+# - jam yang tidak ada (gap, jam dimajukan): dijalankan bergeser maju sebesar
+#   gap-nya, mis. 02:30 pada hari jam 02:00 -> 03:00 jadi 03:30;
+# - jam yang muncul dua kali (overlap, jam dimundurkan): dijalankan sekali saja,
+#   pada kemunculan pertama.
+@dataclass(frozen=True)
+class Recurrence:
+    kind: str                          # 'once' | 'daily' | 'weekly' | 'monthly'
+    tz: Optional[str] = None           # None = TZ default
+    run_at: Optional[str] = None       # 'once': ISO dengan offset
+    time_of_day: Optional[str] = None  # 'HH:MM' lokal untuk yang berulang
+    every: int = 1                     # 'daily': tiap N hari
+    anchor: Optional[str] = None       # 'daily' N>1: tanggal lokal kejadian pertama
+    days_mask: int = 0                 # 'weekly': bit 0=Senin .. bit 6=Minggu
+    month_day: int = 0                 # 'monthly': 1..31, bulan pendek -> hari terakhir
 
-async def reminder_once(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id = update.effective_chat.id
-    ensure_user(chat_id)
-    if len(context.args) < 3:
-        await update.message.reply_text("Format: /reminder_once <YYYY-MM-DD> <HH:MM> <pesan>")
-        return
+    @property
+    def zone(self):
+        return pytz.timezone(self.tz) if self.tz else TZ
+
+def rule_from_row(row, tz: Optional[str] = None) -> Recurrence:
+    return Recurrence(row["kind"], tz or row["tz"], row["run_at"], row["time_of_day"],
+                      row["every"] or 1, row["anchor"], row["days_mask"], row["month_day"])
+
+def _legacy_rule(row) -> Recurrence:
+    # baris sebelum migrasi 7 (belum ada kolom tz/days_mask/...)
+    mask = 1 << row["weekday"] if row["weekday"] is not None else 0
+    return Recurrence(row["kind"], run_at=row["run_at"], time_of_day=row["time_of_day"], days_mask=mask)
+
+def localize(tz, naive: datetime) -> datetime:
+    """Localize jam dinding dengan kebijakan DST di atas."""
+    try:
+        return tz.localize(naive, is_dst=None)
+    except pytz.NonExistentTimeError:
+        return tz.normalize(tz.localize(naive, is_dst=False))
+    except pytz.AmbiguousTimeError:
+        return tz.localize(naive, is_dst=True)
+
+def _candidate_days(rule: Recurrence, start: date):
+    """Tanggal lokal (urut naik, mulai `start`) yang cocok dengan aturan."""
+    if rule.kind == "daily":
+        day, step = start, max(rule.every, 1)
+        if step > 1 and rule.anchor:
+            anchor = date.fromisoformat(rule.anchor)
+            day = anchor if start <= anchor else start + timedelta(days=(anchor - start).days % step)
+        while True:
+            yield day
+            day += timedelta(days=step)
+    elif rule.kind == "weekly":
+        if not rule.days_mask & 0x7F:
+            return
+        day = start
+        while True:
+            if rule.days_mask >> day.weekday() & 1:
+                yield day
+            day += timedelta(days=1)
+    elif rule.kind == "monthly":
+        if not 1 <= rule.month_day <= 31:
+            return
+        year, month = start.year, start.month
+        while True:
+            day = date(year, month, min(rule.month_day, calendar.monthrange(year, month)[1]))
+            if day >= start:
+                yield day
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+def next_fire(rule: Recurrence, after: datetime) -> Optional[datetime]:
+    """Waktu jalan berikutnya (> after) untuk satu aturan, atau None kalau tidak valid."""
+    if rule.kind == "once":
+        return from_iso(rule.run_at) if rule.run_at else None
+    hhmm = parse_hhmm(rule.time_of_day or "")
+    if not hhmm:
+        return None
+    tz = rule.zone
+    for day in _candidate_days(rule, after.astimezone(tz).date()):
+        cand = localize(tz, datetime(day.year, day.month, day.day, hhmm[0], hhmm[1]))
+        if cand > after:
+            return cand
+    return None
+
+@functools.lru_cache(maxsize=65536)
+def next_fire_ts(rule: Recurrence, after_ts: int) -> Optional[int]:
+    """next_fire dalam epoch UTC. Di-cache per (aturan, waktu): reminder dengan
+    aturan sama yang jatuh tempo bersamaan (mis. ribuan "harian 06:00") cukup
+    dihitung sekali saat dijadwal ulang atau dimuat."""
+    nxt = next_fire(rule, datetime.fromtimestamp(after_ts, pytz.utc))
+    return int(nxt.timestamp()) if nxt is not None else None
+
+def advance_due(rule: Recurrence, due: float, now_ts: float) -> Optional[int]:
+    """Jadwal berikutnya setelah kejadian `due` (None = reminder selesai). Lanjut dari
+    kejadian sebelumnya supaya kejadian yang terlewat (masih dalam jendela catch-up)
+    ikut dikirim; yang lebih tua dari jendela dilompati."""
+    if rule.kind == "once":
+        return None
+    return next_fire_ts(rule, max(int(due), int(now_ts) - REMINDER_CATCHUP_SECONDS))
+
+REMINDER_LIST_SQL = """
+    SELECT id, kind, message, run_at, time_of_day, weekday, tz, every, anchor, days_mask, month_day, active
+    FROM reminders WHERE chat_id=? AND active=1 ORDER BY id DESC
+"""
+
+REMINDER_INSERT_SQL = """
+    INSERT INTO reminders (chat_id, kind, message, run_at, time_of_day, tz, every, anchor,
+                           days_mask, month_day, created_at, active, next_run)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,1,?)
+"""
+
+REMINDER_DEACTIVATE_SQL = "UPDATE reminders SET active=0, inactive_since=? WHERE id=? AND chat_id=?"
+
+def _reminder_params(chat_id: int, message: str, rule: Recurrence, created_at: str, next_run):
+    return (chat_id, rule.kind, message, rule.run_at, rule.time_of_day, rule.tz, rule.every, rule.anchor,
+            rule.days_mask, rule.month_day, created_at, next_run)
+
+async def _save_reminder(chat_id: int, message: str, rule: Recurrence) -> int:
+    now = now_local()
+    next_run = next_fire_ts(rule, int(now.timestamp()))
+    rid = await STORE.add_reminder(chat_id, message, rule, iso(now), next_run)
+    REMINDER_CACHE.invalidate(chat_id)
+    SCHEDULER.add(rid, chat_id, message, rule, due=next_run)
+    return rid
+
+async def _save_reminder_once(chat_id: int, run_at: datetime, message: str, tz: Optional[str] = None) -> int:
+    return await _save_reminder(chat_id, message, Recurrence("once", tz, run_at=iso(run_at)))
+
+async def _chat_zone(chat_id: int):
+    name = await chat_tz_name(chat_id)
+    return name, (pytz.timezone(name) if name else TZ)
+
+def _parse_time_arg(s: str) -> Optional[str]:
+    hhmm = parse_hhmm(s)
+    return f"{hhmm[0]:02d}:{hhmm[1]:02d}" if hhmm else None
+
+async def reminder_once(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    await ensure_user(chat_id)
+    if len(context.args) < 3:
+        await update.message.reply_text("Format: /reminder_once <YYYY-MM-DD> <HH:MM> <pesan>")
+        return
     date_str, time_str = context.args[0], context.args[1]
     msg = " ".join(context.args[2:])
     try:
@@ -319,71 +2009,165 @@ async def reminder_once(update: Update, context: ContextTypes.DEFAULT_TYPE):
             raise ValueError("jam")
         y,m,d = map(int, date_str.split("-"))
         hour, minute = hhmm
-        run_at = TZ.localize(datetime(y, m, d, hour, minute))
+        tz_name, tz = await _chat_zone(chat_id)
+        run_at = localize(tz, datetime(y, m, d, hour, minute))
         if run_at < now_local():
             await update.message.reply_text("Waktu sudah lewat. Pilih waktu di masa depan.")
             return
-        rid = _save_reminder_once(chat_id, run_at, msg)
+        rid = await _save_reminder_once(chat_id, run_at, msg, tz_name)
         await update.message.reply_text(f"⏰ Reminder sekali dibuat (ID {rid}) untuk {run_at.strftime('%Y-%m-%d %H:%M')}.")
     except Exception:
         await update.message.reply_text("Format salah. Contoh: /reminder_once 2025-08-19 14:30 Meeting")
 
 async def reminder_daily(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    ensure_user(chat_id)
+    await ensure_user(chat_id)
     if len(context.args) < 2:
         await update.message.reply_text("Format: /reminder_daily <HH:MM> <pesan>")
         return
     hhmm_str = context.args[0]
     msg = " ".join(context.args[1:])
-    hhmm = parse_hhmm(hhmm_str)
+    hhmm = _parse_time_arg(hhmm_str)
     if not hhmm:
         await update.message.reply_text("Jam tidak valid. Contoh: 06:30")
         return
-    rid = _save_reminder_daily(chat_id, f"{hhmm[0]:02d}:{hhmm[1]:02d}", msg)
+    tz_name, _ = await _chat_zone(chat_id)
+    rid = await _save_reminder(chat_id, msg, Recurrence("daily", tz_name, time_of_day=hhmm))
     await update.message.reply_text(f"🔁 Reminder harian dibuat (ID {rid}) pada {hhmm_str}.")
 
+async def reminder_every(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    await ensure_user(chat_id)
+    if len(context.args) < 3 or not context.args[0].isdigit() or not 1 <= int(context.args[0]) <= 365:
+        await update.message.reply_text("Format: /reminder_every <N hari 1-365> <HH:MM> <pesan>")
+        return
+    every = int(context.args[0])
+    hhmm = _parse_time_arg(context.args[1])
+    msg = " ".join(context.args[2:])
+    if not hhmm:
+        await update.message.reply_text("Jam tidak valid. Contoh: 07:00")
+        return
+    tz_name, tz = await _chat_zone(chat_id)
+    # hitungan N hari dimulai dari kejadian pertama (hari ini kalau jamnya belum lewat)
+    first = next_fire(Recurrence("daily", tz_name, time_of_day=hhmm), now_local())
+    anchor = first.astimezone(tz).date().isoformat()
+    rid = await _save_reminder(chat_id, msg, Recurrence("daily", tz_name, time_of_day=hhmm, every=every, anchor=anchor))
+    await update.message.reply_text(f"🔁 Reminder tiap {every} hari dibuat (ID {rid}) pada {hhmm}, mulai {anchor}.")
+
 async def reminder_weekly(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    ensure_user(chat_id)
+    await ensure_user(chat_id)
     if len(context.args) < 3:
-        await update.message.reply_text("Format: /reminder_weekly <Senin..Minggu> <HH:MM> <pesan>")
+        await update.message.reply_text("Format: /reminder_weekly <Senin..Minggu[,hari lain]> <HH:MM> <pesan>")
         return
-    day_name = context.args[0].lower()
+    day_names = [d for d in context.args[0].lower().split(",") if d]
     hhmm_str = context.args[1]
     msg = " ".join(context.args[2:])
-    if day_name not in HARI_MAP:
-        await update.message.reply_text("Hari tidak valid. Gunakan: Senin, Selasa, Rabu, Kamis, Jumat, Sabtu, Minggu")
+    if not day_names or any(d not in HARI_MAP for d in day_names):
+        await update.message.reply_text("Hari tidak valid. Gunakan: Senin, Selasa, Rabu, Kamis, Jumat, Sabtu, Minggu "
+                                        "(beberapa hari dipisah koma, mis. Senin,Kamis)")
         return
-    hhmm = parse_hhmm(hhmm_str)
+    hhmm = _parse_time_arg(hhmm_str)
     if not hhmm:
         await update.message.reply_text("Jam tidak valid. Contoh: 16:00")
         return
-    rid = _save_reminder_weekly(chat_id, HARI_MAP[day_name], f"{hhmm[0]:02d}:{hhmm[1]:02d}", msg)
-    await update.message.reply_text(f"🗓️ Reminder mingguan dibuat (ID {rid}) setiap {day_name.title()} {hhmm_str}.")
+    mask = 0
+    for d in day_names:
+        mask |= 1 << HARI_MAP[d]
+    tz_name, _ = await _chat_zone(chat_id)
+    rid = await _save_reminder(chat_id, msg, Recurrence("weekly", tz_name, time_of_day=hhmm, days_mask=mask))
+    await update.message.reply_text(f"🗓️ Reminder mingguan dibuat (ID {rid}) setiap {_days_text(mask)} {hhmm_str}.")
+
+async def reminder_monthly(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    await ensure_user(chat_id)
+    if len(context.args) < 3 or not context.args[0].isdigit() or not 1 <= int(context.args[0]) <= 31:
+        await update.message.reply_text("Format: /reminder_monthly <tanggal 1-31> <HH:MM> <pesan>")
+        return
+    month_day = int(context.args[0])
+    hhmm = _parse_time_arg(context.args[1])
+    msg = " ".join(context.args[2:])
+    if not hhmm:
+        await update.message.reply_text("Jam tidak valid. Contoh: 09:00")
+        return
+    tz_name, _ = await _chat_zone(chat_id)
+    rid = await _save_reminder(chat_id, msg, Recurrence("monthly", tz_name, time_of_day=hhmm, month_day=month_day))
+    note = " (bulan yang lebih pendek: hari terakhirnya)" if month_day > 28 else ""
+    await update.message.reply_text(f"📆 Reminder bulanan dibuat (ID {rid}) tiap tanggal {month_day} {hhmm}{note}.")
+
+HARI_NAMA = ["Senin", "Selasa", "Rabu", "Kamis", "Jumat", "Sabtu", "Minggu"]
+
+def _days_text(mask: int) -> str:
+    return ",".join(HARI_NAMA[i] for i in range(7) if mask >> i & 1) or "?"
+
+def _describe_reminder(r) -> str:
+    if r["kind"] == "once":
+        return f"[Sekali] {r['run_at']}"
+    if r["kind"] == "daily":
+        every = r["every"] or 1
+        return f"[Harian] {r['time_of_day']}" if every == 1 else f"[Tiap {every} hari] {r['time_of_day']}"
+    if r["kind"] == "weekly":
+        return f"[Mingguan] {_days_text(r['days_mask'])} {r['time_of_day']}"
+    return f"[Bulanan] tgl {r['month_day']} {r['time_of_day']}"
 
 async def reminder_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    rows = CONN.execute("""
-        SELECT id, kind, message, run_at, time_of_day, weekday, active
-        FROM reminders
-        WHERE chat_id=? AND active=1
-        ORDER BY id DESC
-    """, (chat_id,)).fetchall()
+    rows = REMINDER_CACHE.get(chat_id)
+    if rows is None:
+        epoch = REMINDER_CACHE.epoch
+        rows = await STORE.list_reminders(chat_id)
+        REMINDER_CACHE.put(chat_id, rows, epoch)
     if not rows:
         await update.message.reply_text("Tidak ada reminder aktif.")
         return
-    inv_hari = {v:k.title() for k,v in HARI_MAP.items()}
-    lines = []
+    lines = [f"{r['id']}. {_describe_reminder(r)} – {r['message']}" for r in rows]
+    await update.message.reply_text("📋 *Reminder Aktif:*\n" + "\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+# ---- Zona waktu per chat ----
+TZ_ALIASES = {"wib": "Asia/Jakarta", "wita": "Asia/Makassar", "wit": "Asia/Jayapura"}
+_TZ_LOOKUP = {name.lower(): name for name in pytz.all_timezones}
+
+def _moved_reminders(rows, tz_name: str, now_ts: int):
+    """Reminder berulang yang aktif ikut pindah ke zona baru (jam dindingnya tetap);
+    reminder sekali tetap di waktu absolutnya. Kembalikan [(id, pesan, rule, due)]."""
+    moved = []
     for r in rows:
         if r["kind"] == "once":
-            lines.append(f"{r['id']}. [Sekali] {r['run_at']} – {r['message']}")
-        elif r["kind"] == "daily":
-            lines.append(f"{r['id']}. [Harian] {r['time_of_day']} – {r['message']}")
-        else:
-            day = inv_hari.get(r["weekday"], "?")
-            lines.append(f"{r['id']}. [Mingguan] {day} {r['time_of_day']} – {r['message']}")
-    await update.message.reply_text("📋 *Reminder Aktif:*\n" + "\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+            continue
+        rule = rule_from_row(r, tz=tz_name)
+        moved.append((r["id"], r["message"], rule, next_fire_ts(rule, now_ts)))
+    return moved
+
+def _set_chat_tz(conn, chat_id: int, tz_name: str, now_ts: int):
+    """Simpan zona waktu chat dan pindahkan reminder berulangnya (lihat _moved_reminders)."""
+    conn.execute("UPDATE users SET tz=? WHERE chat_id=?", (tz_name, chat_id))
+    rows = conn.execute(REMINDER_LIST_SQL, (chat_id,)).fetchall()
+    moved = _moved_reminders(rows, tz_name, now_ts)
+    conn.executemany("UPDATE reminders SET tz=?, next_run=? WHERE id=?",
+                     [(tz_name, due, rid) for rid, _, _, due in moved])
+    return moved
+
+async def timezone_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    await ensure_user(chat_id)
+    if not context.args:
+        name = await chat_tz_name(chat_id)
+        await update.message.reply_text(
+            f"🌐 Zona waktu: {name or TZ_NAME}{'' if name else ' (default)'}\n"
+            "Ganti: /timezone Asia/Makassar (atau WIB / WITA / WIT)"
+        )
+        return
+    arg = context.args[0].lower()
+    name = TZ_ALIASES.get(arg) or _TZ_LOOKUP.get(arg)
+    if not name:
+        await update.message.reply_text("Zona waktu tidak dikenal. Contoh: Asia/Jakarta, Asia/Makassar, Europe/Berlin")
+        return
+    moved = await STORE.set_chat_tz(chat_id, name, int(time.time()))
+    TZ_CACHE.invalidate(chat_id)
+    REMINDER_CACHE.invalidate(chat_id)
+    for rid, message, rule, due in moved:
+        SCHEDULER.add(rid, chat_id, message, rule, due=due)
+    await update.message.reply_text(f"🌐 Zona waktu diganti ke {name}. {len(moved)} reminder berulang dijadwal ulang.")
 
 async def reminder_del(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
@@ -391,75 +2175,1225 @@ async def reminder_del(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Contoh: /reminder_del 7")
         return
     rid = int(context.args[0])
-    with CONN:
-        cur = CONN.execute("UPDATE reminders SET active=0 WHERE id=? AND chat_id=?", (rid, chat_id))
-    if cur.rowcount:
+    if await STORE.deactivate_reminder(chat_id, rid):
+        REMINDER_CACHE.invalidate(chat_id)
+        SCHEDULER.remove(rid)
         await update.message.reply_text(f"Reminder {rid} dimatikan.")
     else:
         await update.message.reply_text("ID reminder tidak ditemukan.")
 
-# ========= JOB QUEUE (Scheduler) =========
-async def scheduler_tick(context: ContextTypes.DEFAULT_TYPE):
-    """Dijalankan tiap 30 detik: kirim reminder yang saatnya jalan."""
-    app = context.application
-    now = now_local()
+# ========= PENGIRIMAN (dispatcher ber-rate-limit) =========
+class TokenBucket:
+    """Token bucket berbasis reservasi (GCRA): tiap acquire memesan slot waktu
+    berikutnya lalu menunggu sampai slot itu tiba, jadi antrian panjang tetap
+    rata tanpa busy-loop. `capacity` = jumlah burst yang diizinkan. `clock` harus
+    sejalan dengan asyncio.sleep (default time.monotonic = jam event loop)."""
 
-    # 1) Reminder sekali
-    rows_once = CONN.execute("""
-        SELECT id, chat_id, message, run_at FROM reminders
-        WHERE kind='once' AND active=1
-    """).fetchall()
-    to_disable = []
-    for r in rows_once:
-        run_at = from_iso(r["run_at"])
-        if run_at <= now:
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.clock = clock
+        self.tat = 0.0            # theoretical arrival time slot berikutnya
+        self.blocked_until = 0.0
+
+    def reserve(self) -> float:
+        """Pesan satu slot; kembalikan lama tunggu (detik) sebelum boleh dipakai."""
+        now = self.clock()
+        self.tat = max(self.tat, now) + 1 / self.rate
+        wait = self.tat - now - self.capacity / self.rate
+        return max(wait, self.blocked_until - now, 0.0)
+
+    def pause(self, seconds: float):
+        """Tahan bucket (mis. flood-wait dari Telegram); setelahnya tanpa burst."""
+        until = self.clock() + seconds
+        self.blocked_until = max(self.blocked_until, until)
+        self.tat = max(self.tat, until + self.capacity / self.rate)
+
+    def idle(self) -> bool:
+        return self.tat <= self.clock()
+
+    async def acquire(self):
+        while True:
+            wait = self.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            # pause() bisa datang saat kita sedang menunggu; kalau begitu antri ulang
+            if self.clock() >= self.blocked_until:
+                return
+
+def _retry_after_seconds(e: RetryAfter) -> float:
+    ra = e.retry_after
+    return ra.total_seconds() if isinstance(ra, timedelta) else float(ra)
+
+@dataclass
+class BatchStats:
+    size: int
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    started: float = field(default_factory=time.monotonic)
+    finished: float = 0.0
+    latencies: list = field(default_factory=list)
+    results: list = field(default_factory=list)   # True/False per pesan, urutan sama dgn input
+
+    def summary(self) -> str:
+        elapsed = max((self.finished or time.monotonic()) - self.started, 1e-9)
+        lat = sorted(self.latencies)
+        p50 = lat[len(lat) // 2] if lat else 0.0
+        p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))] if lat else 0.0
+        return (f"batch {self.size} pesan: terkirim={self.sent} gagal={self.failed} "
+                f"retry={self.retries} durasi={elapsed:.2f}s "
+                f"throughput={self.sent / elapsed:.1f}/s p50={p50 * 1000:.0f}ms p95={p95 * 1000:.0f}ms")
+
+class Dispatcher:
+    """Kirim banyak pesan sekaligus dengan batas konkurensi, rate limit global
+    dan per chat, serta retry untuk RetryAfter / error jaringan."""
+
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, concurrency: int = SEND_CONCURRENCY, global_rate: float = SEND_GLOBAL_RATE,
+                 chat_rate: float = SEND_CHAT_RATE, max_retries: int = SEND_MAX_RETRIES,
+                 clock: Callable[[], float] = time.monotonic):
+        self._sem = asyncio.Semaphore(concurrency)
+        self._clock = clock
+        self._global = TokenBucket(global_rate, clock=clock)
+        self._chat_rate = chat_rate
+        self._chats = {}
+        self._tasks = set()
+        self.max_retries = max_retries
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle()}
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, capacity=1, clock=self._clock)
+        return bucket
+
+    async def _send_one(self, bot, chat_id: int, text: str, stats: BatchStats) -> bool:
+        for attempt in range(self.max_retries + 1):
+            # token per chat dulu, baru global, supaya slot global tidak terbuang menunggu chat
+            await self._chat_bucket(chat_id).acquire()
+            await self._global.acquire()
+            backoff = 0
+            async with self._sem:
+                t0 = self._clock()
+                try:
+                    await bot.send_message(chat_id=chat_id, text=text)
+                except RetryAfter as e:
+                    self._global.pause(_retry_after_seconds(e))
+                    METRICS.inc("bot_send_flood_wait_total")
+                except NetworkError:
+                    backoff = min(2 ** attempt, 30)
+                except TelegramError as e:
+                    # Forbidden / BadRequest dsb: tidak ada gunanya diulang
+                    log.warning("Gagal kirim ke %s: %s", chat_id, e)
+                    stats.failed += 1
+                    METRICS.inc("bot_send_total", result="failed")
+                    return False
+                else:
+                    elapsed = self._clock() - t0
+                    stats.latencies.append(elapsed)
+                    stats.sent += 1
+                    METRICS.inc("bot_send_total", result="ok")
+                    METRICS.observe("bot_send_seconds", elapsed)
+                    return True
+            if attempt < self.max_retries:
+                stats.retries += 1
+                METRICS.inc("bot_send_total", result="retry")
+                if backoff:
+                    await asyncio.sleep(backoff)
+        log.warning("Gagal kirim ke %s setelah %d percobaan", chat_id, self.max_retries + 1)
+        stats.failed += 1
+        METRICS.inc("bot_send_total", result="failed")
+        return False
+
+    async def send_batch(self, bot, messages) -> BatchStats:
+        """messages: iterable (chat_id, text). Selesai saat semua terkirim/gagal."""
+        messages = list(messages)
+        stats = BatchStats(len(messages), started=self._clock())
+        stats.results = await asyncio.gather(*(self._send_one(bot, cid, text, stats) for cid, text in messages))
+        stats.finished = self._clock()
+        log.info(stats.summary())
+        return stats
+
+    def track(self, coro) -> asyncio.Task:
+        """Jalankan coroutine pengiriman di background; ikut dibatalkan saat close()."""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def submit(self, bot, messages) -> asyncio.Task:
+        """Jalankan send_batch di background tanpa menahan pemanggil."""
+        return self.track(self.send_batch(bot, messages))
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+DISPATCHER = Dispatcher()
+
+# ========= SCHEDULER (antrian prioritas waktu jatuh tempo) =========
+# Setiap reminder aktif dihitung waktu jalan berikutnya sekali saja (saat dibuat
+# atau saat bot start) lalu disimpan di heap. Loop scheduler tidur sampai
+# deadline paling awal, dan dibangunkan lebih cepat kalau ada reminder
+# baru/dihapus. Tick tanpa reminder jatuh tempo = O(1), tanpa query DB.
+SCHEDULER_MAX_SLEEP = 60  # detik; batas tidur agar tetap sinkron dengan jam dinding
+SCHEDULER_RETRY_SECONDS = 2  # jeda sebelum tick diulang setelah error (DB terkunci, koneksi putus)
+
+@dataclass
+class ScheduledReminder:
+    id: int
+    chat_id: int
+    message: str
+    rule: Recurrence
+    due: float = 0.0  # epoch detik, harus sama dgn entri heap yang valid
+
+    @property
+    def kind(self) -> str:
+        return self.rule.kind
+
+class ReminderScheduler:
+    def __init__(self):
+        self._heap = []    # (due_epoch, reminder_id)
+        self._items = {}   # reminder_id -> ScheduledReminder
+        self._wake = asyncio.Event()
+        self._task = None
+        self.max_sleep = SCHEDULER_MAX_SLEEP
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, rid: int, chat_id: int, message: str, rule: Recurrence,
+            due: Optional[float] = None, now: Optional[datetime] = None):
+        """Daftarkan reminder. `due` (epoch) dipakai kalau sudah diketahui, selain
+        itu dihitung dari aturan reminder."""
+        if due is None:
+            due = next_fire_ts(rule, int((now or now_local()).timestamp()))
+            if due is None:
+                return
+        self._push(ScheduledReminder(rid, chat_id, message, rule), due)
+
+    def remove(self, rid: int):
+        # Entri heap dibiarkan (lazy delete); akan dilewati saat di-pop
+        if self._items.pop(rid, None) is not None:
+            self._wake.set()
+
+    def load(self, rows, now: Optional[datetime] = None):
+        """rows: tuple (id, chat_id, message, next_run, kind, tz, run_at, time_of_day,
+        every, anchor, days_mask, month_day) -- lihat _fetch_schedule."""
+        # next_run yang sudah lewat (bot sempat mati) tetap dipakai: scheduler_tick
+        # yang memutuskan dikirim (masih dalam jendela catch-up) atau kedaluwarsa.
+        # Aturan identik dipakai bersama (hemat memori & cache next_fire_ts), dan
+        # heap dibangun sekali dengan heapify, bukan push satu per satu.
+        now_ts = int((now or now_local()).timestamp())
+        rules = {}
+        for r in rows:
+            key = r[4:]
+            rule = rules.get(key)
+            if rule is None:
+                kind, tz, run_at, time_of_day, every, anchor, days_mask, month_day = key
+                rule = rules[key] = Recurrence(kind, tz, run_at, time_of_day, every or 1,
+                                               anchor, days_mask, month_day)
+            rid, chat_id, message, due = r[:4]
+            if due is None:
+                due = next_fire_ts(rule, now_ts)
+                if due is None:
+                    continue
+            self._items[rid] = ScheduledReminder(rid, chat_id, message, rule, due)
+        self._heap = [(it.due, it.id) for it in self._items.values()]
+        heapq.heapify(self._heap)
+        self._wake.set()
+
+    def _push(self, item: ScheduledReminder, due: float):
+        old = self._items.get(item.id)
+        if old is not None and old is not item and old.due == due:
+            # id sama didaftarkan ulang dgn waktu sama: entri heap lama masih berlaku
+            item.due = due
+            self._items[item.id] = item
+            return
+        item.due = due
+        self._items[item.id] = item
+        if not self._heap or due < self._heap[0][0]:
+            self._wake.set()
+        heapq.heappush(self._heap, (due, item.id))
+        # Buang entri basi kalau heap membengkak karena banyak reminder dihapus
+        if len(self._heap) > 2 * len(self._items) + 1024:
+            self._heap = [(it.due, it.id) for it in self._items.values()]
+            heapq.heapify(self._heap)
+
+    def pop_due(self, now_ts: float):
+        """Ambil semua reminder yang jatuh tempo (due <= now_ts)."""
+        due = []
+        while self._heap and self._heap[0][0] <= now_ts:
+            ts, rid = heapq.heappop(self._heap)
+            item = self._items.get(rid)
+            if item is None or item.due != ts:
+                continue  # sudah dihapus / dijadwal ulang
+            due.append(item)
+        return due
+
+    def reschedule(self, item: ScheduledReminder, nxt: Optional[float]):
+        """Pasang jadwal berikutnya (None = selesai) setelah kejadian diklaim di DB.
+        Item yang sementara itu dihapus / diganti (/reminder_del, /timezone) dibiarkan."""
+        if self._items.get(item.id) is not item:
+            return
+        if nxt is None:
+            del self._items[item.id]
+            return
+        self._push(item, nxt)
+
+    def restore(self, items):
+        """Kembalikan item dari pop_due ke heap (klaim gagal, dicoba di tick berikutnya)."""
+        for item in items:
+            if self._items.get(item.id) is item:
+                heapq.heappush(self._heap, (item.due, item.id))
+
+    def seconds_until_next(self, now_ts: float) -> float:
+        if not self._heap:
+            return self.max_sleep
+        return min(max(self._heap[0][0] - now_ts, 0), self.max_sleep)
+
+    async def run(self, app: Application):
+        while True:
             try:
-                await app.bot.send_message(chat_id=r["chat_id"], text=f"⏰ Reminder: {r['message']}")
+                more = await scheduler_tick(app)
             except Exception:
+                # error sementara tidak boleh mematikan scheduler; reminder yang
+                # gagal diklaim sudah dikembalikan ke heap oleh scheduler_tick
+                log.exception("Scheduler: tick gagal, dicoba lagi %ss", SCHEDULER_RETRY_SECONDS)
+                METRICS.inc("bot_scheduler_errors_total")
+                await asyncio.sleep(SCHEDULER_RETRY_SECONDS)
+                continue
+            self._wake.clear()
+            timeout = 0 if more else self.seconds_until_next(time.time())
+            if timeout <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
                 pass
-            to_disable.append(r["id"])
-    if to_disable:
-        with CONN:
-            CONN.executemany("UPDATE reminders SET active=0 WHERE id=?", [(i,) for i in to_disable])
-
-    # 2) Harian
-    rows_daily = CONN.execute("""
-        SELECT id, chat_id, message, time_of_day FROM reminders
-        WHERE kind='daily' AND active=1
-    """).fetchall()
-    now_hhmm = now.strftime("%H:%M")
-    # agar tidak kirim berulang-ulang selama 1 menit penuh, kita pakai "penanda" per menit via cache table sederhana:
-    CONN.execute("""CREATE TABLE IF NOT EXISTS _sent_guard (
-        key TEXT PRIMARY KEY, created_at TEXT
-    )""")
-    guard_key = f"daily-{now.strftime('%Y-%m-%d %H:%M')}"
-    guard_exists = CONN.execute("SELECT key FROM _sent_guard WHERE key=?", (guard_key,)).fetchone()
-    if not guard_exists:
-        for r in rows_daily:
-            if r["time_of_day"] == now_hhmm:
-                try:
-                    await app.bot.send_message(chat_id=r["chat_id"], text=f"⏰ Reminder: {r['message']}")
-                except Exception:
-                    pass
-        with CONN:
-            CONN.execute("INSERT OR IGNORE INTO _sent_guard (key, created_at) VALUES (?,?)", (guard_key, iso(now)))
-
-    # 3) Mingguan
-    rows_weekly = CONN.execute("""
-        SELECT id, chat_id, message, time_of_day, weekday FROM reminders
-        WHERE kind='weekly' AND active=1
-    """).fetchall()
-    guard_key2 = f"weekly-{now.strftime('%Y-%m-%d %H:%M')}"
-    guard_exists2 = CONN.execute("SELECT key FROM _sent_guard WHERE key=?", (guard_key2,)).fetchone()
-    if not guard_exists2:
-        for r in rows_weekly:
-            if r["weekday"] == now.weekday() and r["time_of_day"] == now_hhmm:
-                try:
-                    await app.bot.send_message(chat_id=r["chat_id"], text=f"⏰ Reminder: {r['message']}")
-                except Exception:
-                    pass
-        with CONN:
-            CONN.execute("INSERT OR IGNORE INTO _sent_guard (key, created_at) VALUES (?,?)", (guard_key2, iso(now)))
+
+    def start(self, app: Application):
+        self._task = asyncio.create_task(self.run(app))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+SCHEDULER = ReminderScheduler()
+
+SCHEDULE_SQL = """
+    SELECT id, chat_id, message, next_run, kind, tz, run_at, time_of_day, every, anchor,
+           days_mask, month_day
+    FROM reminders WHERE active=1 AND abs(chat_id) % ? = ?
+"""
+
+def _fetch_schedule(conn, count: int, index: int):
+    cur = conn.cursor()
+    cur.row_factory = None  # tuple biasa: jauh lebih cepat dari sqlite3.Row untuk jutaan baris
+    return cur.execute(SCHEDULE_SQL, (count, index)).fetchall()
+
+async def load_reminders():
+    # Dengan banyak worker, tiap worker hanya memuat reminder milik shard-nya
+    index, count = SHARD
+    SCHEDULER.load(await STORE.load_schedule(count, index))
+
+# ---- Log pengiriman (outbox) ----
+# Alur satu kejadian: scheduler mengklaim (INSERT OR IGNORE state 'pending')
+# dalam transaksi yang sama dengan update next_run/active, baru kirim, lalu
+# menandai 'sent' / 'failed'. Kejadian yang sudah diklaim tidak dikirim ulang.
+# Kalau proses mati setelah klaim, baris 'pending' dikirim ulang saat start
+# (satu-satunya celah duplikat: mati tepat setelah kirim sebelum ditandai).
+def _claim_occurrences(conn, occurrences, to_disable, next_runs, now_ts: int):
+    claimed = []
+    for rid, occ, chat_id, message, state in occurrences:
+        cur = conn.execute("""
+            INSERT OR IGNORE INTO reminder_deliveries
+                (reminder_id, occurrence, chat_id, message, state, updated_at)
+            VALUES (?,?,?,?,?,?)
+        """, (rid, occ, chat_id, message, state, now_ts))
+        if cur.rowcount and state == "pending":
+            claimed.append((rid, occ, chat_id, message))
+    conn.executemany("UPDATE reminders SET active=0, inactive_since=? WHERE id=?",
+                     [(now_ts, rid) for rid, in to_disable])
+    conn.executemany("UPDATE reminders SET next_run=? WHERE id=?", next_runs)
+    return claimed
+
+def _mark_delivered(conn, rows):
+    conn.executemany("""
+        UPDATE reminder_deliveries SET state=?, attempts=attempts+1, updated_at=?
+        WHERE reminder_id=? AND occurrence=?
+    """, rows)
+
+async def deliver(bot, claimed):
+    """Kirim kejadian yang sudah diklaim lalu catat hasilnya di outbox."""
+    stats = await DISPATCHER.send_batch(bot, [(chat_id, f"⏰ Reminder: {message}")
+                                              for _, _, chat_id, message in claimed])
+    now_ts = int(time.time())
+    await STORE.mark_delivered([
+        ("sent" if ok else "failed", now_ts, rid, occ)
+        for (rid, occ, _, _), ok in zip(claimed, stats.results)
+    ])
+
+async def resend_pending(app: Application):
+    """Kirim ulang kejadian yang sudah diklaim tapi belum tercatat terkirim
+    (proses sebelumnya mati di tengah jalan)."""
+    index, count = SHARD
+    rows = await STORE.pending_deliveries(count, index)
+    if rows:
+        log.info("Mengirim ulang %d reminder yang tertunda", len(rows))
+        DISPATCHER.track(deliver(app.bot, rows))
+
+PENDING_SQL = """
+    SELECT reminder_id, occurrence, chat_id, message FROM reminder_deliveries
+    WHERE state='pending' AND abs(chat_id) % ? = ?
+"""
+
+COMPACT_DELIVERIES_SQL = """
+    DELETE FROM reminder_deliveries WHERE (reminder_id, occurrence) IN (
+        SELECT reminder_id, occurrence FROM reminder_deliveries
+        WHERE state IN ('sent', 'failed', 'expired') AND updated_at < ?
+        LIMIT ?
+    )
+"""
+
+def _compact_deliveries(conn, cutoff: int, limit: int) -> int:
+    return conn.execute(COMPACT_DELIVERIES_SQL, (cutoff, limit)).rowcount
+
+async def compact_deliveries(context: ContextTypes.DEFAULT_TYPE):
+    """Job berkala: hapus log pengiriman lama per batch kecil supaya tabel tetap kecil."""
+    cutoff = int(time.time()) - DELIVERY_RETENTION_SECONDS
+    total = 0
+    while True:
+        n = await STORE.compact_deliveries(cutoff, DELIVERY_COMPACT_BATCH)
+        total += n
+        if n < DELIVERY_COMPACT_BATCH:
+            break
+    if total:
+        log.info("Log pengiriman: %d baris lama dihapus", total)
+
+def _occurrence_state(due: float, now_ts: float) -> str:
+    lag = max(now_ts - due, 0)
+    METRICS.observe("bot_scheduler_lag_seconds", lag)
+    # terlewat lebih lama dari jendela catch-up (mis. bot mati lama): tidak dikirim
+    if lag <= REMINDER_CATCHUP_SECONDS:
+        return "pending"
+    METRICS.inc("bot_reminder_expired_total")
+    return "expired"
+
+CLAIM_BATCH = 1000  # reminder per klaim di mode DB bersama
+
+async def scheduler_tick(app: Application) -> bool:
+    """Kirim semua reminder yang sudah jatuh tempo lalu jadwalkan ulang yang berulang.
+    Kembalikan True kalau masih ada yang jatuh tempo (tick lagi tanpa menunggu)."""
+    now_ts = now_local().timestamp()
+    due = SCHEDULER.pop_due(now_ts)
+    more = False
+    if STORE.shared:
+        # Beberapa node berbagi DB: jadwal diklaim langsung dari DB, heap lokal
+        # hanya membangunkan loop saat reminder baru di node ini jatuh tempo.
+        for item in due:
+            SCHEDULER.remove(item.id)
+        claimed, more = await STORE.claim_due(int(now_ts), CLAIM_BATCH)
+    elif due:
+        # Jadwal di memori baru dimajukan setelah klaim ter-commit; kalau klaim
+        # gagal, item kembali ke heap dan kejadiannya tidak hilang.
+        occurrences, to_disable, next_runs = [], [], []
+        nexts = [advance_due(item.rule, item.due, now_ts) for item in due]
+        for item, nxt in zip(due, nexts):
+            occurrences.append((item.id, int(item.due), item.chat_id, item.message,
+                                _occurrence_state(item.due, now_ts)))
+            if nxt is None:
+                to_disable.append((item.id,))
+            else:
+                next_runs.append((int(nxt), item.id))
+        try:
+            claimed = await STORE.claim_occurrences(occurrences, to_disable, next_runs, int(now_ts))
+        except Exception:
+            SCHEDULER.restore(due)
+            raise
+        for item, nxt in zip(due, nexts):
+            SCHEDULER.reschedule(item, nxt)
+            if nxt is None:
+                REMINDER_CACHE.invalidate(item.chat_id)
+    else:
+        return False
+    if claimed:
+        # Kirim di background supaya batch besar tidak menahan tick berikutnya
+        DISPATCHER.track(deliver(app.bot, claimed))
+    return more
+
+# ========= STORAGE (backend data) =========
+# Handler tidak memanggil SQL langsung tapi lewat STORE. Default SQLite lokal
+# (satu node, cache per proses). STORAGE_URL=postgresql://... memakai PostgreSQL
+# lewat asyncpg supaya beberapa node bot bisa berbagi satu database: reminder
+# jatuh tempo diklaim dari DB dengan FOR UPDATE SKIP LOCKED, jadi tiap kejadian
+# hanya dikirim satu node.
+class SqliteStore:
+    """Backend SQLite: membungkus DB (thread penulis + pool pembaca)."""
+    shared = False  # True = DB dipakai bersama beberapa node
+
+    async def start(self):
+        DB.start()
+
+    async def close(self):
+        DB.close()
+
+    # ---- user ----
+    async def ensure_user(self, chat_id: int):
+        await DB.execute("INSERT OR IGNORE INTO users (chat_id) VALUES (?)", (chat_id,))
+
+    async def chat_tz(self, chat_id: int) -> Optional[str]:
+        row = await DB.fetchone(CHAT_TZ_SQL, (chat_id,))
+        return row["tz"] if row else None
+
+    async def set_chat_tz(self, chat_id: int, tz_name: str, now_ts: int):
+        return await DB.write(_set_chat_tz, chat_id, tz_name, now_ts)
+
+    # ---- catatan ----
+    async def add_note(self, chat_id: int, content: str, created_at: str) -> int:
+        return await DB.insert("INSERT INTO notes (chat_id, content, created_at) VALUES (?,?,?)",
+                               (chat_id, content, created_at))
+
+    async def notes_page(self, chat_id: int, direction: str, cursor: int):
+        return await DB.read(_fetch_notes_page, chat_id, direction, cursor)
+
+    async def search_notes(self, chat_id: int, terms):
+        return await DB.read(_search_notes, chat_id, _fts_query(chat_id, terms))
+
+    async def delete_note(self, chat_id: int, note_id: int) -> bool:
+        return bool(await DB.execute(NOTE_DELETE_SQL, (note_id, chat_id)))
+
+    async def import_notes(self, rows) -> int:
+        return await DB.write(_import_notes_chunk, rows)
+
+    # ---- keuangan ----
+    async def add_money(self, chat_id: int, amount: int, desc: str, created_at: str) -> Optional[int]:
+        return await DB.write(_insert_money, chat_id, amount, desc, created_at)
+
+    async def balance(self, chat_id: int):
+        return await DB.read(_fetch_balance, chat_id)
+
+    async def month_summary(self, chat_id: int, month: str):
+        return await DB.fetchone(MONTH_SUMMARY_SQL, (chat_id, month))
+
+    async def money_page(self, chat_id: int, month: str, direction: str, cursor: int):
+        return await DB.read(_fetch_money_page, chat_id, month, direction, cursor)
+
+    async def month_categories(self, chat_id: int, month: str):
+        return await DB.read(_fetch_categories, chat_id, month)
+
+    async def import_money(self, rows) -> int:
+        return await DB.write(_import_money_chunk, rows)
+
+    async def export(self, kind: str, chat_id: int, fmt: str, path: str) -> int:
+        return await DB.read(_export_to_file, kind, chat_id, fmt, path)
+
+    # ---- reminder ----
+    async def add_reminder(self, chat_id: int, message: str, rule: Recurrence, created_at: str, next_run) -> int:
+        return await DB.insert(REMINDER_INSERT_SQL, _reminder_params(chat_id, message, rule, created_at, next_run))
+
+    async def list_reminders(self, chat_id: int):
+        return await DB.fetchall(REMINDER_LIST_SQL, (chat_id,))
+
+    async def deactivate_reminder(self, chat_id: int, rid: int) -> bool:
+        return bool(await DB.execute(REMINDER_DEACTIVATE_SQL, (int(time.time()), rid, chat_id)))
+
+    async def load_schedule(self, count: int, index: int):
+        return await DB.read(_fetch_schedule, count, index)
+
+    # ---- outbox ----
+    async def claim_occurrences(self, occurrences, to_disable, next_runs, now_ts: int):
+        return await DB.write(_claim_occurrences, occurrences, to_disable, next_runs, now_ts)
+
+    async def mark_delivered(self, rows):
+        await DB.write(_mark_delivered, rows)
+
+    async def pending_deliveries(self, count: int, index: int):
+        rows = await DB.fetchall(PENDING_SQL, (count, index))
+        return [tuple(r) for r in rows]
+
+    async def compact_deliveries(self, cutoff: int, limit: int) -> int:
+        return await DB.write(_compact_deliveries, cutoff, limit)
+
+    # ---- pemeliharaan ----
+    async def purge_reminders(self, cutoff: int, limit: int) -> int:
+        return await DB.write(_purge_reminders, cutoff, limit)
+
+    async def rollup_candidates(self, before_month: str, count: int, index: int, limit: int):
+        return [tuple(r) for r in await DB.fetchall(ROLLUP_CANDIDATES_SQL, (before_month, count, index, limit))]
+
+    async def rollup_month(self, chat_id: int, month: str) -> int:
+        return await DB.write(_rollup_money_month, chat_id, month)
+
+    async def optimize(self, budget: float) -> int:
+        """VACUUM bertahap selama `budget` detik lalu ANALYZE. Kembalikan jumlah halaman dibebaskan."""
+        freed = 0
+        if await DB.read(_auto_vacuum_mode) == 2:   # INCREMENTAL; DB lama perlu `--vacuum` sekali
+            deadline = time.monotonic() + budget
+            while time.monotonic() < deadline:
+                n = await DB.write(_vacuum_slice, VACUUM_SLICE_PAGES)
+                freed += n
+                if n < VACUUM_SLICE_PAGES:
+                    break
+        await DB.write(_analyze)
+        return freed
+
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "2"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+PG_POLL_SECONDS = float(os.getenv("PG_POLL_SECONDS", "1"))   # interval klaim reminder dari DB
+PG_PENDING_STALE = 300   # detik; 'pending' lebih tua dari ini dianggap node pengirimnya mati
+PG_SCHEMA_LOCK = 72270017  # kunci advisory: node yang start bersamaan tidak bentrok DDL
+
+PG_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS users (
+        chat_id BIGINT PRIMARY KEY,
+        tz TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS notes (
+        id BIGSERIAL PRIMARY KEY,
+        chat_id BIGINT NOT NULL,
+        content TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        search TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_notes_chat_id ON notes (chat_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_notes_search ON notes USING GIN (search)",
+    """CREATE TABLE IF NOT EXISTS money (
+        id BIGSERIAL PRIMARY KEY,
+        chat_id BIGINT NOT NULL,
+        amount BIGINT NOT NULL,
+        description TEXT,
+        created_at TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_money_chat_id ON money (chat_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_money_chat_created ON money (chat_id, created_at, id)",
+    """CREATE TABLE IF NOT EXISTS money_totals (
+        chat_id BIGINT PRIMARY KEY,
+        balance BIGINT NOT NULL DEFAULT 0,
+        tx_count BIGINT NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS money_monthly (
+        chat_id BIGINT NOT NULL,
+        month TEXT NOT NULL,
+        income BIGINT NOT NULL DEFAULT 0,
+        expense BIGINT NOT NULL DEFAULT 0,
+        tx_count BIGINT NOT NULL DEFAULT 0,
+        rolled_up SMALLINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, month)
+    )""",
+    "ALTER TABLE money_monthly ADD COLUMN IF NOT EXISTS rolled_up SMALLINT NOT NULL DEFAULT 0",
+    """CREATE TABLE IF NOT EXISTS reminders (
+        id BIGSERIAL PRIMARY KEY,
+        chat_id BIGINT NOT NULL,
+        kind TEXT NOT NULL,
+        message TEXT NOT NULL,
+        run_at TEXT,
+        time_of_day TEXT,
+        weekday INTEGER,
+        tz TEXT,
+        every INTEGER NOT NULL DEFAULT 1,
+        anchor TEXT,
+        days_mask INTEGER NOT NULL DEFAULT 0,
+        month_day INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT NOT NULL,
+        active SMALLINT NOT NULL DEFAULT 1,
+        next_run BIGINT,
+        inactive_since BIGINT
+    )""",
+    "ALTER TABLE reminders ADD COLUMN IF NOT EXISTS inactive_since BIGINT",
+    "CREATE INDEX IF NOT EXISTS idx_reminders_inactive ON reminders (inactive_since) WHERE active=0",
+    "CREATE INDEX IF NOT EXISTS idx_reminders_chat_active ON reminders (chat_id, id) WHERE active=1",
+    "CREATE INDEX IF NOT EXISTS idx_reminders_due ON reminders (next_run) WHERE active=1",
+    """CREATE TABLE IF NOT EXISTS reminder_deliveries (
+        reminder_id BIGINT NOT NULL,
+        occurrence BIGINT NOT NULL,
+        chat_id BIGINT NOT NULL,
+        message TEXT NOT NULL,
+        state TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        updated_at BIGINT NOT NULL,
+        PRIMARY KEY (reminder_id, occurrence)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_deliveries_state ON reminder_deliveries (state, updated_at)",
+)
+
+@functools.lru_cache(maxsize=None)
+def _pg(sql: str) -> str:
+    """Ubah placeholder SQLite (?) ke gaya PostgreSQL ($1, $2, ...)."""
+    n = 0
+    def number(_):
+        nonlocal n
+        n += 1
+        return f"${n}"
+    return re.sub(r"\?", number, sql)
+
+def _pg_count(status: str) -> int:
+    # status asyncpg: 'DELETE 3', 'UPDATE 1', 'COPY 10', 'INSERT 0 1'
+    return int(status.rsplit(" ", 1)[-1])
+
+def _timed_pg(method, prefix: str = ""):
+    """Bungkus method asyncpg.Connection supaya durasinya masuk bot_sql_seconds."""
+    @functools.wraps(method)
+    async def timed(self, query, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return await method(self, query, *args, **kwargs)
+        finally:
+            METRICS.observe("bot_sql_seconds", time.perf_counter() - t0, sql=_sql_label(prefix + query))
+    return timed
+
+class _TimedPgCursor:
+    """Iterasi cursor server-side; yang dihitung hanya waktu menunggu baris dari
+    PostgreSQL (bukan kerja pemanggil di antaranya), dicatat sekali saat selesai."""
+
+    def __init__(self, factory, query: str):
+        self._factory = factory
+        self._query = query
+        self._it = None
+        self._elapsed = 0.0
+
+    def __aiter__(self):
+        self._it = self._factory.__aiter__()
+        return self
+
+    async def __anext__(self):
+        t0 = time.perf_counter()
+        try:
+            return await self._it.__anext__()
+        except BaseException:
+            self._elapsed += time.perf_counter() - t0
+            METRICS.observe("bot_sql_seconds", self._elapsed, sql=_sql_label(self._query))
+            raise
+        else:
+            self._elapsed += time.perf_counter() - t0
+
+if asyncpg is not None:
+    class TimedPgConnection(asyncpg.Connection):
+        """Padanan TimedConnection untuk pool asyncpg (pool.fetch dsb. lewat sini juga)."""
+        execute = _timed_pg(asyncpg.Connection.execute)
+        executemany = _timed_pg(asyncpg.Connection.executemany)
+        fetch = _timed_pg(asyncpg.Connection.fetch)
+        fetchrow = _timed_pg(asyncpg.Connection.fetchrow)
+        fetchval = _timed_pg(asyncpg.Connection.fetchval)
+        copy_from_query = _timed_pg(asyncpg.Connection.copy_from_query, "COPY ")
+        copy_records_to_table = _timed_pg(asyncpg.Connection.copy_records_to_table, "COPY ")
+
+        def cursor(self, query, *args, **kwargs):
+            return _TimedPgCursor(super().cursor(query, *args, **kwargs), query)
+
+class PostgresStore:
+    """Backend PostgreSQL (asyncpg) untuk beberapa node bot yang berbagi satu DB.
+    asyncpg menyiapkan (prepare) dan meng-cache statement per koneksi pool, jadi
+    query handler yang berulang tidak di-parse ulang."""
+    shared = True
+
+    def __init__(self, dsn: str, min_size: int = PG_POOL_MIN, max_size: int = PG_POOL_MAX):
+        if asyncpg is None:
+            raise RuntimeError("STORAGE_URL PostgreSQL butuh paket asyncpg (pip install asyncpg)")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+
+    async def start(self):
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size,
+                                              connection_class=TimedPgConnection)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", PG_SCHEMA_LOCK)
+                for ddl in PG_SCHEMA:
+                    await conn.execute(ddl)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    # ---- user ----
+    async def ensure_user(self, chat_id: int):
+        await self.pool.execute("INSERT INTO users (chat_id) VALUES ($1) ON CONFLICT DO NOTHING", chat_id)
+
+    async def chat_tz(self, chat_id: int) -> Optional[str]:
+        return await self.pool.fetchval(_pg(CHAT_TZ_SQL), chat_id)
+
+    async def set_chat_tz(self, chat_id: int, tz_name: str, now_ts: int):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("UPDATE users SET tz=$1 WHERE chat_id=$2", tz_name, chat_id)
+                rows = await conn.fetch(_pg(REMINDER_LIST_SQL), chat_id)
+                moved = _moved_reminders(rows, tz_name, now_ts)
+                await conn.executemany("UPDATE reminders SET tz=$1, next_run=$2 WHERE id=$3",
+                                       [(tz_name, due, rid) for rid, _, _, due in moved])
+        return moved
+
+    # ---- catatan ----
+    async def add_note(self, chat_id: int, content: str, created_at: str) -> int:
+        return await self.pool.fetchval(
+            "INSERT INTO notes (chat_id, content, created_at) VALUES ($1,$2,$3) RETURNING id",
+            chat_id, content, created_at)
+
+    async def notes_page(self, chat_id: int, direction: str, cursor: int):
+        sql, params = _notes_page_query(chat_id, direction, cursor)
+        return _notes_page_result(await self.pool.fetch(_pg(sql), *params), direction)
+
+    async def search_notes(self, chat_id: int, terms):
+        # prefix match seperti FTS5 ("kopi"*); kata dari \w+ aman untuk to_tsquery
+        query = " & ".join(f"{t}:*" for t in terms)
+        return await self.pool.fetch("""
+            SELECT id, created_at,
+                   ts_headline('simple', content, q, 'StartSel=*, StopSel=*, MaxWords=12, MinWords=4') AS snip
+            FROM notes, to_tsquery('simple', $2) q
+            WHERE chat_id=$1 AND search @@ q
+            ORDER BY ts_rank(search, q) DESC
+            LIMIT $3
+        """, chat_id, query, PAGE_SIZE)
+
+    async def delete_note(self, chat_id: int, note_id: int) -> bool:
+        status = await self.pool.execute(_pg(NOTE_DELETE_SQL), note_id, chat_id)
+        return _pg_count(status) > 0
+
+    async def import_notes(self, rows) -> int:
+        await self.pool.copy_records_to_table("notes", records=rows, columns=("chat_id", "content", "created_at"))
+        return len(rows)
+
+    # ---- keuangan ----
+    async def _ledger_apply(self, conn, rows):
+        totals, monthly = _ledger_deltas(rows)
+        await conn.executemany("""
+            INSERT INTO money_totals (chat_id, balance, tx_count) VALUES ($1, $2, $3)
+            ON CONFLICT (chat_id) DO UPDATE SET
+                balance = money_totals.balance + excluded.balance,
+                tx_count = money_totals.tx_count + excluded.tx_count
+        """, totals)
+        await conn.executemany("""
+            INSERT INTO money_monthly (chat_id, month, income, expense, tx_count) VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (chat_id, month) DO UPDATE SET
+                income = money_monthly.income + excluded.income,
+                expense = money_monthly.expense + excluded.expense,
+                tx_count = money_monthly.tx_count + excluded.tx_count,
+                rolled_up = 0
+        """, monthly)
+
+    async def _checked_money_rows(self, conn, rows):
+        """Lihat _ledger_fit. Baris money_totals dikunci sampai commit supaya node
+        lain tidak menambah saldo chat yang sama di antara cek dan tulis."""
+        chats, keys = _ledger_keys(rows)
+        balances = dict(await conn.fetch(
+            "SELECT chat_id, balance FROM money_totals WHERE chat_id = ANY($1::bigint[]) FOR UPDATE", chats))
+        months = {}
+        for chat_id, month in keys:
+            row = await conn.fetchrow(_pg(MONTH_SUMMARY_SQL), chat_id, month)
+            if row:
+                months[(chat_id, month)] = (row["income"], row["expense"])
+        return _ledger_fit(rows, balances, months)
+
+    async def add_money(self, chat_id: int, amount: int, desc: str, created_at: str) -> Optional[int]:
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                if not await self._checked_money_rows(conn, [(chat_id, amount, desc, created_at)]):
+                    return None
+                mid = await conn.fetchval(
+                    "INSERT INTO money (chat_id, amount, description, created_at) VALUES ($1,$2,$3,$4) RETURNING id",
+                    chat_id, amount, desc, created_at)
+                await self._ledger_apply(conn, [(chat_id, amount, created_at)])
+        return mid
+
+    async def balance(self, chat_id: int):
+        async with self.pool.acquire() as conn:
+            saldo = await conn.fetchval(_pg(BALANCE_SQL), chat_id)
+            rows = await conn.fetch(_pg(BALANCE_RECENT_SQL), chat_id)
+        return saldo or 0, rows
+
+    async def month_summary(self, chat_id: int, month: str):
+        return await self.pool.fetchrow(_pg(MONTH_SUMMARY_SQL), chat_id, month)
+
+    async def money_page(self, chat_id: int, month: str, direction: str, cursor: int):
+        sql, params = _money_page_query(chat_id, month, direction, cursor)
+        return _money_page_result(await self.pool.fetch(_pg(sql), *params), direction)
+
+    async def month_categories(self, chat_id: int, month: str):
+        start, end = _month_bounds(int(month[:4]), int(month[5:7]))
+        # SUM(bigint) di PostgreSQL menghasilkan numeric; dikembalikan ke bigint
+        sql = _pg(CATEGORY_SQL).replace(" AS income", "::bigint AS income").replace(" AS expense", "::bigint AS expense")
+        return [tuple(r) for r in await self.pool.fetch(sql, chat_id, start, end)]
+
+    async def import_money(self, rows) -> int:
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await self._checked_money_rows(conn, rows)
+                await conn.copy_records_to_table(
+                    "money", records=rows, columns=("chat_id", "amount", "description", "created_at"))
+                await self._ledger_apply(conn, [(chat_id, amount, created_at) for chat_id, amount, _, created_at in rows])
+        return len(rows)
+
+    async def export(self, kind: str, chat_id: int, fmt: str, path: str) -> int:
+        sql, header = EXPORTS[kind]
+        async with self.pool.acquire() as conn:
+            if fmt == "csv":
+                status = await conn.copy_from_query(_pg(sql), chat_id, output=path, format="csv", header=True)
+                return _pg_count(status)
+            count = 0
+            with open(path, "w", encoding="utf-8") as f:
+                async with conn.transaction():   # cursor server-side butuh transaksi
+                    async for row in conn.cursor(_pg(sql), chat_id):
+                        f.write(json.dumps(dict(zip(header, row)), ensure_ascii=False) + "\n")
+                        count += 1
+            return count
+
+    # ---- reminder ----
+    async def add_reminder(self, chat_id: int, message: str, rule: Recurrence, created_at: str, next_run) -> int:
+        return await self.pool.fetchval(_pg(REMINDER_INSERT_SQL) + " RETURNING id",
+                                        *_reminder_params(chat_id, message, rule, created_at, next_run))
+
+    async def list_reminders(self, chat_id: int):
+        return await self.pool.fetch(_pg(REMINDER_LIST_SQL), chat_id)
+
+    async def deactivate_reminder(self, chat_id: int, rid: int) -> bool:
+        status = await self.pool.execute(_pg(REMINDER_DEACTIVATE_SQL), int(time.time()), rid, chat_id)
+        return _pg_count(status) > 0
+
+    async def load_schedule(self, count: int, index: int):
+        rows = await self.pool.fetch(_pg(SCHEDULE_SQL), count, index)
+        return [tuple(r) for r in rows]
+
+    # ---- outbox ----
+    async def claim_due(self, now_ts: int, limit: int):
+        """Klaim maksimal `limit` reminder jatuh tempo dari DB. Baris yang sedang
+        dikunci node lain dilewati (SKIP LOCKED), jadi node tidak saling menunggu
+        dan tiap kejadian hanya diklaim sekali. Kembalikan (klaim, masih_ada)."""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch("""
+                    SELECT id, chat_id, message, next_run, kind, tz, run_at, time_of_day, every, anchor,
+                           days_mask, month_day
+                    FROM reminders WHERE active=1 AND next_run <= $1
+                    ORDER BY next_run LIMIT $2
+                    FOR UPDATE SKIP LOCKED
+                """, now_ts, limit)
+                if not rows:
+                    return [], False
+                occurrences, to_disable, next_runs = [], [], []
+                for (rid, chat_id, message, due, kind, tz, run_at, time_of_day, every, anchor,
+                     days_mask, month_day) in rows:
+                    rule = Recurrence(kind, tz, run_at, time_of_day, every or 1, anchor, days_mask, month_day)
+                    occurrences.append((rid, due, chat_id, message, _occurrence_state(due, now_ts)))
+                    nxt = advance_due(rule, due, now_ts)
+                    if nxt is None:
+                        to_disable.append((rid,))
+                    else:
+                        next_runs.append((nxt, rid))
+                inserted = await conn.fetch("""
+                    INSERT INTO reminder_deliveries (reminder_id, occurrence, chat_id, message, state, updated_at)
+                    SELECT o.*, $6::bigint
+                    FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $4::text[], $5::text[]) AS o
+                    ON CONFLICT DO NOTHING
+                    RETURNING reminder_id, occurrence, chat_id, message, state
+                """, *map(list, zip(*occurrences)), now_ts)
+                await conn.executemany("UPDATE reminders SET active=0, inactive_since=$1 WHERE id=$2",
+                                       [(now_ts, rid) for rid, in to_disable])
+                await conn.executemany("UPDATE reminders SET next_run=$1 WHERE id=$2", next_runs)
+        claimed = [(r[0], r[1], r[2], r[3]) for r in inserted if r[4] == "pending"]
+        return claimed, len(rows) == limit
+
+    async def mark_delivered(self, rows):
+        await self.pool.executemany("""
+            UPDATE reminder_deliveries SET state=$1, attempts=attempts+1, updated_at=$2
+            WHERE reminder_id=$3 AND occurrence=$4
+        """, rows)
+
+    async def pending_deliveries(self, count: int, index: int):
+        # Node lain mungkin sedang mengirim 'pending' yang masih baru; hanya yang
+        # sudah basi yang diambil alih (updated_at diperbarui supaya tidak diambil dua kali).
+        now_ts = int(time.time())
+        rows = await self.pool.fetch("""
+            UPDATE reminder_deliveries SET updated_at=$1
+            WHERE (reminder_id, occurrence) IN (
+                SELECT reminder_id, occurrence FROM reminder_deliveries
+                WHERE state='pending' AND updated_at < $2 AND abs(chat_id) % $3 = $4
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING reminder_id, occurrence, chat_id, message
+        """, now_ts, now_ts - PG_PENDING_STALE, count, index)
+        return [tuple(r) for r in rows]
+
+    async def compact_deliveries(self, cutoff: int, limit: int) -> int:
+        return _pg_count(await self.pool.execute(_pg(COMPACT_DELIVERIES_SQL), cutoff, limit))
+
+    # ---- pemeliharaan ----
+    async def purge_reminders(self, cutoff: int, limit: int) -> int:
+        return _pg_count(await self.pool.execute(_pg(PURGE_REMINDERS_SQL), cutoff, limit))
+
+    async def rollup_candidates(self, before_month: str, count: int, index: int, limit: int):
+        return [tuple(r) for r in await self.pool.fetch(_pg(ROLLUP_CANDIDATES_SQL), before_month,
+                                                         count, index, limit)]
+
+    async def rollup_month(self, chat_id: int, month: str) -> int:
+        start, end = _month_bounds(int(month[:4]), int(month[5:7]))
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # node lain yang sedang merekap bulan yang sama dilewati
+                locked = await conn.fetchval("""
+                    SELECT 1 FROM money_monthly WHERE chat_id=$1 AND month=$2 AND rolled_up=0
+                    FOR UPDATE SKIP LOCKED
+                """, chat_id, month)
+                if locked is None:
+                    return 0
+                # SUM(bigint) di PostgreSQL menghasilkan numeric; dikembalikan ke bigint
+                groups = await conn.fetch(_pg(ROLLUP_GROUPS_SQL).replace("SUM(amount)", "SUM(amount)::bigint"),
+                                          chat_id, start, end)
+                rows = _rollup_rows(chat_id, month, groups)
+                removed = _pg_count(await conn.execute(
+                    "DELETE FROM money WHERE chat_id=$1 AND created_at>=$2 AND created_at<$3", chat_id, start, end))
+                await conn.executemany("INSERT INTO money (chat_id, amount, description, created_at) VALUES ($1,$2,$3,$4)",
+                                       rows)
+                await conn.execute("UPDATE money_monthly SET rolled_up=1 WHERE chat_id=$1 AND month=$2", chat_id, month)
+        return removed - len(rows)
+
+    async def optimize(self, budget: float) -> int:
+        return 0   # VACUUM / ANALYZE diurus autovacuum PostgreSQL
+
+# Error penulisan dari backend mana pun (mis. nilai di luar rentang kolom)
+STORE_ERRORS = (sqlite3.Error, OverflowError) + ((asyncpg.PostgresError,) if asyncpg is not None else ())
+
+def make_store():
+    if not STORAGE_URL:
+        return SqliteStore()
+    if STORAGE_URL.startswith(("postgres://", "postgresql://")):
+        return PostgresStore(STORAGE_URL)
+    raise RuntimeError(f"STORAGE_URL tidak dikenal: {STORAGE_URL.split(':', 1)[0]}")
+
+STORE = make_store()
+
+# ========= PEMELIHARAAN (retensi, rekap, VACUUM) =========
+# Job berkala di job_queue. Semua kerja dipecah jadi potongan kecil (satu
+# DB.write per potong) supaya kunci tulis tidak pernah ditahan lama dan tulisan
+# handler tetap bisa masuk di sela-selanya.
+MAINTENANCE_INTERVAL = int(os.getenv("MAINTENANCE_INTERVAL", "3600"))   # detik antar job
+REMINDER_RETENTION_SECONDS = int(os.getenv("REMINDER_RETENTION_DAYS", "30")) * 86400  # 0 = simpan selamanya
+MONEY_ROLLUP_MONTHS = int(os.getenv("MONEY_ROLLUP_MONTHS", "0"))   # 0 = mati; N = rekap bulan > N bulan lalu
+VACUUM_BUDGET = float(os.getenv("VACUUM_BUDGET_MS", "200")) / 1000  # total waktu VACUUM per job
+VACUUM_SLICE_PAGES = 128   # halaman per potong (~1-3 ms kunci tulis)
+MAINTENANCE_BATCH = 500
+
+PURGE_REMINDERS_SQL = """
+    DELETE FROM reminders WHERE id IN (
+        SELECT id FROM reminders WHERE active=0 AND inactive_since < ? LIMIT ?
+    )
+"""
+
+ROLLUP_CANDIDATES_SQL = """
+    SELECT chat_id, month FROM money_monthly
+    WHERE month < ? AND rolled_up=0 AND tx_count > 2 AND abs(chat_id) % ? = ?
+    LIMIT ?
+"""
+
+def _purge_reminders(conn, cutoff: int, limit: int) -> int:
+    return conn.execute(PURGE_REMINDERS_SQL, (cutoff, limit)).rowcount
+
+ROLLUP_GROUPS_SQL = """
+    SELECT description, amount > 0, SUM(amount), MIN(created_at) FROM money
+    WHERE chat_id=? AND created_at>=? AND created_at<? GROUP BY description, amount > 0
+"""
+
+def _rollup_rows(chat_id: int, month: str, groups):
+    """Baris pengganti transaksi satu bulan: satu rekap pemasukan dan satu rekap
+    pengeluaran per kategori (#tag di keterangan), jadi rincian kategori
+    /money_report bulan itu tetap sama setelah direkap."""
+    merged = {}
+    for description, income, total, first in groups:
+        key = None if income else _category(description)
+        old_total, old_first = merged.get(key, (0, first))
+        merged[key] = (old_total + total, min(old_first, first))
+    rows = []
+    for cat, (total, first) in merged.items():
+        if not total:
+            continue
+        if cat is None:
+            desc = f"rekap pemasukan {month}"
+        else:
+            # kategori dari kata pertama yang bukan \w+ tidak bisa jadi #tag; tetap kata pertama
+            label = "#" + cat if re.fullmatch(r"\w+", cat) else cat
+            desc = f"{label} rekap pengeluaran {month}"
+        rows.append((chat_id, total, desc, first))
+    rows.sort(key=lambda r: (r[3], r[2]))
+    return rows
+
+def _rollup_money_month(conn, chat_id: int, month: str) -> int:
+    """Ganti semua transaksi satu bulan dengan baris rekap (lihat _rollup_rows).
+    Saldo dan ringkasan bulanan (money_totals / money_monthly) tidak berubah."""
+    start, end = _month_bounds(int(month[:4]), int(month[5:7]))
+    rows = _rollup_rows(chat_id, month, conn.execute(ROLLUP_GROUPS_SQL, (chat_id, start, end)).fetchall())
+    removed = conn.execute("DELETE FROM money WHERE chat_id=? AND created_at>=? AND created_at<?",
+                           (chat_id, start, end)).rowcount
+    conn.executemany("INSERT INTO money (chat_id, amount, description, created_at) VALUES (?,?,?,?)", rows)
+    conn.execute("UPDATE money_monthly SET rolled_up=1 WHERE chat_id=? AND month=?", (chat_id, month))
+    return removed - len(rows)
+
+def _auto_vacuum_mode(conn) -> int:
+    return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+def _vacuum_slice(conn, pages: int) -> int:
+    # incremental_vacuum membebaskan satu halaman per langkah, sedangkan sqlite3
+    # hanya melangkah sekali per execute: diulang per halaman.
+    todo = min(pages, conn.execute("PRAGMA freelist_count").fetchone()[0])
+    for _ in range(todo):
+        conn.execute("PRAGMA incremental_vacuum(1)")
+    return todo
+
+def _analyze(conn):
+    conn.execute("PRAGMA analysis_limit=400")   # ANALYZE dari sampel, bukan seluruh tabel
+    conn.execute("PRAGMA optimize")             # hanya tabel yang statistiknya sudah basi
+
+def _months_ago(n: int) -> str:
+    now = now_local()
+    total = now.year * 12 + now.month - 1 - n
+    return f"{total // 12:04d}-{total % 12 + 1:02d}"
+
+async def run_maintenance(context: ContextTypes.DEFAULT_TYPE):
+    """Jalan di tiap worker. Rekap transaksi hanya untuk chat shard ini, supaya
+    cache saldo/laporan yang ikut dibuang adalah cache worker pemilik chat-nya.
+    Hapus reminder lama & VACUUM cukup sekali, di worker 0."""
+    t0 = time.perf_counter()
+    purged = rolled = freed = 0
+    index, count = SHARD
+    if REMINDER_RETENTION_SECONDS and index == 0:
+        cutoff = int(time.time()) - REMINDER_RETENTION_SECONDS
+        while True:
+            n = await STORE.purge_reminders(cutoff, MAINTENANCE_BATCH)
+            purged += n
+            if n < MAINTENANCE_BATCH:
+                break
+    if MONEY_ROLLUP_MONTHS:
+        for chat_id, month in await STORE.rollup_candidates(_months_ago(MONEY_ROLLUP_MONTHS),
+                                                            count, index, MAINTENANCE_BATCH):
+            rolled += await STORE.rollup_month(chat_id, month)
+            BALANCE_CACHE.invalidate(chat_id)
+            REPORT_CACHE.invalidate((chat_id, month))
+    if index == 0:
+        freed = await STORE.optimize(VACUUM_BUDGET)
+    METRICS.inc("bot_maintenance_rows_total", purged, task="reminder_purge")
+    METRICS.inc("bot_maintenance_rows_total", rolled, task="money_rollup")
+    METRICS.inc("bot_maintenance_rows_total", freed, task="vacuum_pages")
+    METRICS.observe("bot_maintenance_seconds", time.perf_counter() - t0)
+    if purged or rolled or freed:
+        log.info("Pemeliharaan: %d reminder dihapus, %d transaksi direkap, %d halaman dibebaskan",
+                 purged, rolled, freed)
+
+async def on_startup(app: Application):
+    await STORE.start()
+    if STORE.shared:
+        SCHEDULER.max_sleep = min(SCHEDULER_MAX_SLEEP, PG_POLL_SECONDS)
+    else:
+        await load_reminders()
+    await resend_pending(app)
+    SCHEDULER.start(app)
+    app.job_queue.run_repeating(compact_deliveries, interval=DELIVERY_COMPACT_INTERVAL, first=60)
+    app.job_queue.run_repeating(prune_rate_buckets, interval=RATE_PRUNE_INTERVAL, first=RATE_PRUNE_INTERVAL)
+    app.job_queue.run_repeating(run_maintenance, interval=MAINTENANCE_INTERVAL, first=300)
+    app.bot_data["metrics_server"] = await start_metrics_server()
+    if PROFILE_HZ > 0:
+        PROFILER.start(PROFILE_HZ)
+
+async def on_shutdown(app: Application):
+    server = app.bot_data.pop("metrics_server", None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    PROFILER.stop()
+    await SCHEDULER.stop()
+    await DISPATCHER.close()
+    await WEATHER.close()
+    CHARTS.close()
+    await STORE.close()
+
+# ========= ADMIN (statistik & profiling) =========
+def _collect_runtime():
+    yield "bot_scheduler_pending", "gauge", {}, len(SCHEDULER)
+    for key, value in WEATHER.stats.items():
+        yield f"bot_weather_{key}_total", "counter", {}, value
+    yield "bot_known_users", "gauge", {}, len(KNOWN_USERS)
+    yield "bot_rate_buckets", "gauge", {}, len(RATE_LIMITER)
+    caches = (("reminders", REMINDER_CACHE), ("balance", BALANCE_CACHE), ("tz", TZ_CACHE),
+              ("report", REPORT_CACHE))
+    for name, cache in caches:
+        yield "bot_cache_entries", "gauge", {"cache": name}, len(cache)
+    for key in ("hits", "misses", "evictions"):
+        for name, cache in caches:
+            yield f"bot_cache_{key}_total", "counter", {"cache": name}, cache.stats[key]
+
+METRICS.collectors.append(_collect_runtime)
+
+def is_admin(update: Update) -> bool:
+    user = update.effective_user
+    return user is not None and user.id in ADMIN_IDS
+
+def _fmt_ms(seconds: float) -> str:
+    return "∞" if seconds == float("inf") else f"{seconds * 1000:.0f}ms"
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        await update.message.reply_text("Perintah khusus admin.")
+        return
+    uptime = int(time.time() - METRICS.started)
+    lines = [
+        "📈 Statistik",
+        f"Uptime: {uptime // 3600}j {uptime % 3600 // 60}m",
+        f"Reminder terjadwal: {len(SCHEDULER)}",
+        "",
+        "Handler (jumlah, p50, p95):",
+    ]
+    with METRICS._lock:
+        handlers = sorted((dict(k[1])["handler"], h) for k, h in METRICS.histograms.items()
+                          if k[0] == "bot_handler_seconds")
+        lines += [f"  {name}: {h.count}, {_fmt_ms(h.quantile(0.5))}, {_fmt_ms(h.quantile(0.95))}"
+                  for name, h in handlers] or ["  -"]
+        sends = {dict(k[1]).get("result"): v for k, v in METRICS.counters.items() if k[0] == "bot_send_total"}
+        lag = METRICS.histogram("bot_scheduler_lag_seconds")
+        throttled = Counter()
+        for k, v in METRICS.counters.items():
+            if k[0] == "bot_throttled_total":
+                throttled[dict(k[1])["cost"]] += v
+    lines.append("")
+    lines.append(f"Kirim: ok={sends.get('ok', 0):g} gagal={sends.get('failed', 0):g} retry={sends.get('retry', 0):g}")
+    if throttled:
+        lines.append("Dibatasi: " + ", ".join(f"{cost}={n:g}" for cost, n in sorted(throttled.items())))
+    if lag:
+        lines.append(f"Lag scheduler: p50 {_fmt_ms(lag.quantile(0.5))}, p95 {_fmt_ms(lag.quantile(0.95))}")
+    w = WEATHER.stats
+    lines.append(f"Cuaca: hit={w['hits']} negatif={w['negative_hits']} miss={w['misses']} "
+                 f"gabung={w['coalesced']} upstream={w['upstream_calls']} error={w['errors']}")
+    r, b = REMINDER_CACHE.stats, BALANCE_CACHE.stats
+    lines.append(f"Cache: reminder hit={r['hits']} miss={r['misses']}, saldo hit={b['hits']} miss={b['misses']}, "
+                 f"user dikenal={len(KNOWN_USERS)}")
+    lines.append(f"Profiler: {'aktif' if PROFILER.running else 'nonaktif'}")
+    for func, n in PROFILER.top(5):
+        lines.append(f"  {func}: {n}")
+    await update.message.reply_text("\n".join(lines))
+
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        await update.message.reply_text("Perintah khusus admin.")
+        return
+    arg = context.args[0].lower() if context.args else ""
+    if arg == "on":
+        PROFILER.samples.clear()
+        PROFILER.start(PROFILE_HZ or 100)
+        await update.message.reply_text("Profiler aktif. Lihat hasil: /stats atau GET /profile di endpoint metrik.")
+    elif arg == "off":
+        PROFILER.stop()
+        await update.message.reply_text("Profiler dimatikan.")
+    else:
+        await update.message.reply_text("Format: /profile on|off")
 
 # ========= FALLBACK ECHO =========
 async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -468,45 +3402,378 @@ async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return  # biar command tidak dibalas echo
     await update.message.reply_text("Perintah tidak dikenal. Ketik /help untuk daftar fitur.")
 
-# ========= MAIN =========
-def main():
-    init_db()
+# ========= BATAS PERMINTAAN PER CHAT =========
+# Token bucket per (chat, kelas biaya), dicek oleh TypeHandler di grup -1 sebelum
+# handler mana pun jalan: permintaan yang kelebihan dibuang tanpa menyentuh DB
+# atau API luar. Kelas "berat" untuk perintah yang memindai banyak data atau
+# memanggil layanan luar, "ringan" untuk sisanya.
+COMMAND_COST = {
+    "weather": "external",
+    "money_report": "heavy", "money_report_page": "heavy",
+    "money_export": "heavy", "note_export": "heavy",
+    "money_import": "heavy", "note_import": "heavy", "import_document": "heavy",
+    "note_search": "heavy",
+}
+
+def _parse_rate(spec: str):
+    """'jumlah/detik' -> (kapasitas, token per detik); '0' atau kosong = tanpa batas."""
+    if not spec or spec == "0":
+        return None
+    count, _, seconds = spec.partition("/")
+    return float(count), float(count) / float(seconds or 1)
+
+RATE_LIMITS = {
+    "light": _parse_rate(os.getenv("RATE_LIMIT_LIGHT", "30/60")),
+    "heavy": _parse_rate(os.getenv("RATE_LIMIT_HEAVY", "6/60")),
+    "external": _parse_rate(os.getenv("RATE_LIMIT_EXTERNAL", "5/60")),
+}
+RATE_PRUNE_INTERVAL = 600  # detik antar pembersihan bucket yang sudah penuh lagi
+
+class RateLimiter:
+    def __init__(self, limits):
+        self.limits = limits
+        self._buckets = {}  # (chat_id, kelas) -> [token, waktu update, sudah diberi tahu]
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def acquire(self, chat_id: int, cost: str, now: float):
+        """Ambil satu token. Kembalikan (boleh, detik sampai token berikutnya, perlu_beri_tahu)."""
+        limit = self.limits.get(cost)
+        if limit is None:
+            return True, 0.0, False
+        capacity, rate = limit
+        bucket = self._buckets.get((chat_id, cost))
+        if bucket is None:
+            bucket = self._buckets[(chat_id, cost)] = [capacity, now, False]
+        else:
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return True, 0.0, False
+        # cukup sekali beri tahu per periode kosong, supaya flood tidak dibalas flood
+        notify = not bucket[2]
+        bucket[2] = True
+        return False, (1 - bucket[0]) / rate, notify
+
+    def prune(self, now: float) -> int:
+        """Buang bucket yang sudah terisi penuh lagi (sama saja dengan bucket baru)."""
+        full = [key for key, (tokens, updated, _) in self._buckets.items()
+                if tokens + (now - updated) * self.limits[key[1]][1] >= self.limits[key[1]][0]]
+        for key in full:
+            del self._buckets[key]
+        return len(full)
+
+RATE_LIMITER = RateLimiter(RATE_LIMITS)
+
+def _update_command(update: Update) -> Optional[str]:
+    """Nama perintah untuk update ini tanpa parsing penuh (None = bukan dari user)."""
+    if update.callback_query is not None:
+        data = update.callback_query.data or ""
+        return "money_report_page" if data.startswith("mrep:") else "note_list_page"
+    # effective_message: CommandHandler juga menangani pesan yang diedit, jadi
+    # mengedit "/weather ..." berulang kali tidak boleh lolos dari batas
+    msg = update.effective_message
+    if msg is None:
+        return None
+    text = msg.text or msg.caption or ""
+    if text.startswith("/"):
+        name = text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+        return "import_document" if msg.document is not None else name
+    return "echo"
+
+async def rate_limit_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat = update.effective_chat
+    name = _update_command(update) if chat is not None else None
+    if name is None:
+        return
+    cost = COMMAND_COST.get(name, "light")
+    ok, wait, notify = RATE_LIMITER.acquire(chat.id, cost, time.monotonic())
+    if ok:
+        return
+    METRICS.inc("bot_throttled_total", command=name, cost=cost)
+    text = f"⏳ Terlalu banyak permintaan. Coba lagi dalam {max(int(wait) + 1, 1)} detik."
+    if update.callback_query is not None:
+        await update.callback_query.answer(text)
+    elif notify:
+        await update.effective_message.reply_text(text)
+    raise ApplicationHandlerStop
+
+async def prune_rate_buckets(context: ContextTypes.DEFAULT_TYPE):
+    RATE_LIMITER.prune(time.monotonic())
+
+# ========= APLIKASI =========
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Proses update secara konkuren antar chat, tapi tetap berurutan dalam
+    satu chat (update tanpa chat diproses bebas)."""
+
+    UNBOUNDED = 2**31 - 1
+
+    # process_update bawaan (@final) mengambil semaphore global sebelum
+    # do_process_update, jadi update yang antri di kunci chat ikut memakan slot:
+    # satu chat dengan banyak update bisa menahan semua chat lain. Karena itu
+    # semaphore bawaan dibuat tak terbatas dan batas sebenarnya (`_slots`) diambil
+    # di do_process_update setelah kunci chat.
+    def __init__(self, max_concurrent_updates: int):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates harus bilangan positif")
+        self._limit = self.UNBOUNDED   # dibaca __init__ bawaan untuk semaphore-nya
+        super().__init__(self.UNBOUNDED)
+        self._limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._active = 0
+        self._locks = {}  # chat_id -> [asyncio.Lock, jumlah pemakai]
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return self._limit
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    @property
+    def current_concurrent_updates(self) -> int:
+        """Update yang sedang diproses (memegang slot), tanpa yang antri di kunci chat."""
+        return self._active
+
+    async def _run(self, coroutine):
+        async with self._slots:
+            self._active += 1
+            try:
+                await coroutine
+            finally:
+                self._active -= 1
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await self._run(coroutine)
+            return
+        entry = self._locks.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+def add_handlers(app: Application):
+    def cmd(name: str, callback):
+        app.add_handler(CommandHandler(name, timed(name, callback)))
+
+    # Batas permintaan per chat, sebelum semua handler lain
+    app.add_handler(TypeHandler(Update, rate_limit_guard), group=-1)
 
     # Command map
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("help", help_cmd))
+    cmd("start", start)
+    cmd("help", help_cmd)
 
     # Notes
-    app.add_handler(CommandHandler("note_add", note_add))
-    app.add_handler(CommandHandler("note_list", note_list))
-    app.add_handler(CommandHandler("note_del", note_del))
+    cmd("note_add", note_add)
+    cmd("note_list", note_list)
+    cmd("note_search", note_search)
+    cmd("note_del", note_del)
+    cmd("note_import", note_import)
+    cmd("note_export", note_export)
+    app.add_handler(CallbackQueryHandler(timed("note_list_page", note_list_page), pattern=r"^notes:(old|new):\d+$"))
 
     # Money
-    app.add_handler(CommandHandler("money_add", money_add))
-    app.add_handler(CommandHandler("money_balance", money_balance))
-    app.add_handler(CommandHandler("money_report", money_report))
+    cmd("money_add", money_add)
+    cmd("money_balance", money_balance)
+    cmd("money_report", money_report)
+    cmd("money_import", money_import)
+    cmd("money_export", money_export)
+    app.add_handler(CallbackQueryHandler(timed("money_report_page", money_report_page), pattern=r"^mrep:\d{4}-\d{2}:(prev|next):\d+$"))
 
     # Weather
-    app.add_handler(CommandHandler("weather", weather))
+    cmd("weather", weather)
 
     # Reminders
-    app.add_handler(CommandHandler("reminder_help", lambda u,c: u.message.reply_text(REMINDER_HELP, parse_mode=ParseMode.MARKDOWN)))
-    app.add_handler(CommandHandler("reminder_once", reminder_once))
-    app.add_handler(CommandHandler("reminder_daily", reminder_daily))
-    app.add_handler(CommandHandler("reminder_weekly", reminder_weekly))
-    app.add_handler(CommandHandler("reminder_list", reminder_list))
-    app.add_handler(CommandHandler("reminder_del", reminder_del))
+    cmd("reminder_help", lambda u,c: u.message.reply_text(REMINDER_HELP, parse_mode=ParseMode.MARKDOWN))
+    cmd("reminder_once", reminder_once)
+    cmd("reminder_daily", reminder_daily)
+    cmd("reminder_every", reminder_every)
+    cmd("reminder_weekly", reminder_weekly)
+    cmd("reminder_monthly", reminder_monthly)
+    cmd("reminder_list", reminder_list)
+    cmd("reminder_del", reminder_del)
+    cmd("timezone", timezone_cmd)
+
+    # Admin
+    cmd("stats", stats_cmd)
+    cmd("profile", profile_cmd)
+
+    # Impor: file dikirim dengan caption /money_import atau /note_import
+    app.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/(money|note)_import\b"),
+                                   timed("import_document", import_document)))
 
     # Fallback
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo))
 
-    # Scheduler tick tiap 30 detik
-    app.job_queue.run_repeating(scheduler_tick, interval=30, first=5)
+def _builder():
+    builder = Application.builder().token(BOT_TOKEN)
+    if TELEGRAM_API_URL:
+        # mis. Bot API server lokal / server palsu untuk testing
+        builder = builder.base_url(TELEGRAM_API_URL).base_file_url(TELEGRAM_API_URL.replace("/bot", "/file/bot"))
+    return builder
+
+def build_application() -> Application:
+    app = (
+        _builder()
+        .concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    add_handlers(app)
+    return app
+
+# ========= MULTI-PROSES (shard per chat) =========
+# WORKERS > 1: proses depan hanya menerima update (polling/webhook) lalu
+# meneruskannya ke worker hash(chat_id) % WORKERS. Satu chat selalu ke worker
+# yang sama, jadi urutan per chat terjaga dan tiap reminder hanya dimuat &
+# dikirim oleh satu worker (scheduler dipartisi dengan kunci yang sama).
+def shard_of(chat_id: int, count: int) -> int:
+    return abs(chat_id) % count  # sama dengan abs(chat_id) % ? di SQL
+
+async def _worker_loop(inbox):
+    app = _builder().concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES)).updater(None).build()
+    add_handlers(app)
+    loop = asyncio.get_running_loop()
+    await app.initialize()
+    await on_startup(app)
+    await app.start()
+    parent = multiprocessing.parent_process()
+
+    def next_update():
+        # timeout supaya worker ikut berhenti kalau proses depan mati mendadak
+        while True:
+            try:
+                return inbox.get(timeout=1)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    return None
+
+    try:
+        while True:
+            data = await loop.run_in_executor(None, next_update)
+            if data is None:
+                break
+            await app.update_queue.put(Update.de_json(data, app.bot))
+    finally:
+        await app.stop()
+        await on_shutdown(app)
+        await app.shutdown()
 
-    print("🤖 Bot berjalan...")
-    app.run_polling(close_loop=False)  # close_loop=False agar bersih saat exit
+def worker_main(index: int, count: int, inbox):
+    global SHARD, DISPATCHER
+    # Berhenti lewat sentinel dari proses depan, bukan sinyal langsung
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(format=f"%(asctime)s %(levelname)s worker{index}: %(message)s", level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    SHARD = (index, count)
+    # batas global Telegram dibagi rata antar worker
+    DISPATCHER = Dispatcher(global_rate=SEND_GLOBAL_RATE / count)
+    asyncio.run(_worker_loop(inbox))
+
+def build_router(inboxes) -> Application:
+    """Aplikasi proses depan: tidak ada handler fitur, hanya meneruskan update."""
+    async def route(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat = update.effective_chat
+        index = shard_of(chat.id, len(inboxes)) if chat else 0
+        inboxes[index].put(update.to_dict())
+
+    async def stop_workers(app: Application):
+        for inbox in inboxes:
+            inbox.put(None)
+
+    app = _builder().post_stop(stop_workers).build()
+    app.add_handler(TypeHandler(Update, route))
+    return app
+
+def start_workers(count: int):
+    inboxes = [multiprocessing.Queue() for _ in range(count)]
+    procs = [multiprocessing.Process(target=worker_main, args=(i, count, inboxes[i]), name=f"worker{i}")
+             for i in range(count)]
+    for p in procs:
+        p.start()
+    return inboxes, procs
+
+def join_workers(procs, timeout: float = 15):
+    for p in procs:
+        p.join(timeout)
+        if p.is_alive():
+            p.terminate()
+
+# ========= MAIN =========
+def main():
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s", level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # jangan log tiap request API
+    if not STORAGE_URL:
+        init_db()   # skema PostgreSQL dibuat PostgresStore.start()
+
+    if "--check-queries" in sys.argv:
+        conn = db_connect()
+        bad = check_query_plans(conn)
+        conn.close()
+        for name, detail in bad:
+            print(f"FULL SCAN di {name}: {detail}")
+        sys.exit(1 if bad else 0)
+
+    if "--rebuild-ledger" in sys.argv:
+        conn = db_connect()
+        with conn:
+            rebuild_money_ledger(conn)
+        conn.close()
+        print("Ledger keuangan dihitung ulang.")
+        sys.exit(0)
+
+    if "--vacuum" in sys.argv:
+        conn = db_connect()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")   # tulis ulang seluruh file; setelah ini cukup VACUUM bertahap
+        conn.close()
+        print("Database di-VACUUM (mode auto_vacuum=INCREMENTAL).")
+        sys.exit(0)
+
+    if "--rebuild-search" in sys.argv:
+        conn = db_connect()
+        with conn:
+            rebuild_notes_index(conn)
+        conn.close()
+        print("Index pencarian catatan dibangun ulang.")
+        sys.exit(0)
+
+    procs = []
+    if WORKERS > 1:
+        inboxes, procs = start_workers(WORKERS)
+        app = build_router(inboxes)
+        print(f"🤖 {WORKERS} worker dijalankan")
+    else:
+        app = build_application()
+
+    if RUN_MODE == "webhook":
+        print(f"🤖 Bot berjalan (webhook) di {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL or None,
+            secret_token=WEBHOOK_SECRET or None,
+            close_loop=False,
+        )
+    else:
+        print("🤖 Bot berjalan...")
+        app.run_polling(close_loop=False)  # close_loop=False agar bersih saat exit
+    join_workers(procs)
 
 if __name__ == "__main__":
     main()
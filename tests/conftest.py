@@ -0,0 +1,138 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# bot.py membaca env saat di-import; STORE diganti per tes lewat fixture `backend`
+os.environ.setdefault("BOT_TOKEN", "1:test")
+os.environ.pop("STORAGE_URL", None)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bot  # noqa: E402
+
+PG_TABLES = "users, notes, money, money_totals, money_monthly, reminders, reminder_deliveries"
+
+# ---- update/context palsu untuk memanggil handler langsung ----
+class FakeMessage:
+    def __init__(self, replies, text=""):
+        self.replies = replies
+        self.text = text
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        return self
+
+    async def reply_document(self, document, **kwargs):
+        # file ditutup handler setelah terkirim, jadi isinya dibaca sekarang
+        data = document.read() if hasattr(document, "read") else document
+        self.replies.append(("document", kwargs.get("filename"), data))
+        return self
+
+    async def reply_photo(self, photo, **kwargs):
+        self.replies.append(("photo", kwargs.get("caption"), photo))
+        return self
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+        self.type = "private"
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+class FakeUpdate:
+    def __init__(self, chat_id, replies, text=""):
+        self.effective_chat = FakeChat(chat_id)
+        self.effective_user = FakeUser(chat_id)
+        self.message = self.effective_message = FakeMessage(replies, text)
+        self.callback_query = None
+
+class FakeContext:
+    def __init__(self, args):
+        self.args = args
+        self.bot_data, self.chat_data, self.user_data = {}, {}, {}
+
+async def call(handler, chat_id, *args):
+    """Panggil handler seperti perintah `/cmd arg1 arg2`; kembalikan semua balasan."""
+    replies = []
+    await handler(FakeUpdate(chat_id, replies, " ".join(args)), FakeContext(list(args)))
+    return replies
+
+class FakeDispatcher:
+    """Pengganti DISPATCHER: mencatat pesan reminder alih-alih mengirim ke Telegram."""
+
+    def __init__(self):
+        self.sent = []
+        self.tasks = []
+
+    async def send_batch(self, bot_, messages):
+        self.sent.extend(messages)
+        return bot.BatchStats(size=len(messages), results=[True] * len(messages))
+
+    def track(self, coro):
+        self.tasks.append(asyncio.ensure_future(coro))
+
+    async def drain(self):
+        while self.tasks:
+            await self.tasks.pop()
+
+class Backend:
+    def __init__(self, kind, store, dsn=None):
+        self.kind = kind
+        self.store = store
+        self.dsn = dsn
+
+    def run(self, scenario):
+        """Jalankan coroutine `scenario()` dengan STORE aktif (start/close di loop yang sama)."""
+        asyncio.run(self._main(scenario))
+
+    async def _main(self, scenario):
+        if self.kind == "postgres":
+            conn = await bot.asyncpg.connect(self.dsn)
+            try:
+                await conn.execute(f"DROP TABLE IF EXISTS {PG_TABLES}")
+            finally:
+                await conn.close()
+        await self.store.start()
+        try:
+            await scenario()
+        finally:
+            await self.store.close()
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def backend(request, tmp_path, monkeypatch):
+    """Tes yang memakai fixture ini jalan di kedua backend. PostgreSQL hanya
+    kalau TEST_STORAGE_URL di-set (mis. postgresql://postgres@localhost/bot_test)."""
+    if request.param == "postgres":
+        dsn = os.getenv("TEST_STORAGE_URL", "")
+        if not dsn:
+            pytest.skip("TEST_STORAGE_URL belum di-set")
+        if bot.asyncpg is None:
+            pytest.skip("asyncpg tidak terpasang")
+        store = bot.PostgresStore(dsn)
+    else:
+        dsn = None
+        monkeypatch.setattr(bot, "DB_PATH", str(tmp_path / "bot.sqlite3"))
+        monkeypatch.setattr(bot, "DB", bot.Database())
+        bot.init_db()
+        store = bot.SqliteStore()
+    monkeypatch.setattr(bot, "STORE", store)
+    for name in ("REMINDER_CACHE", "BALANCE_CACHE", "TZ_CACHE"):
+        monkeypatch.setattr(bot, name, bot.LRUCache())
+    monkeypatch.setattr(bot, "REPORT_CACHE", bot.LRUCache(bot.REPORT_CACHE_SIZE))
+    monkeypatch.setattr(bot, "KNOWN_USERS", set())
+    monkeypatch.setattr(bot, "SCHEDULER", bot.ReminderScheduler())
+    monkeypatch.setattr(bot, "DISPATCHER", FakeDispatcher())
+    return Backend(request.param, store, dsn)
+
+@pytest.fixture
+def sqlite_conn(tmp_path, monkeypatch):
+    """Koneksi tulis ke DB SQLite baru yang sudah dimigrasi."""
+    monkeypatch.setattr(bot, "DB_PATH", str(tmp_path / "bot.sqlite3"))
+    conn = bot.db_connect()
+    bot.migrate(conn)
+    yield conn
+    conn.close()
@@ -0,0 +1,121 @@
+"""Pemrosesan update: berurutan per chat, satu chat tidak menahan chat lain."""
+import asyncio
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+
+import httpx
+from telegram import Chat, Message, Update, User
+from telegram.ext import Application, ExtBot, TypeHandler
+
+import bot
+
+def _update(update_id, chat_id):
+    chat = Chat(id=chat_id, type="private")
+    return Update(update_id, message=Message(update_id, datetime.now(timezone.utc), chat))
+
+def test_busy_chat_does_not_block_other_chats():
+    async def scenario():
+        processor = bot.ChatOrderedUpdateProcessor(2)
+        release = asyncio.Event()
+        order = []
+
+        async def slow(n):
+            order.append(n)
+            await release.wait()
+
+        async def fast():
+            order.append("lain")
+
+        busy = [asyncio.create_task(processor.process_update(_update(n, 1), slow(n))) for n in range(5)]
+        await asyncio.sleep(0)
+        await asyncio.wait_for(processor.process_update(_update(99, 2), fast()), 1)
+        assert order == [0, "lain"]          # chat 1 tetap satu per satu
+        assert processor.current_concurrent_updates == 1
+        release.set()
+        await asyncio.gather(*busy)
+        assert order == [0, "lain", 1, 2, 3, 4]
+        assert processor._locks == {}
+
+    asyncio.run(scenario())
+
+def test_processor_limit_is_reported_from_own_slots():
+    processor = bot.ChatOrderedUpdateProcessor(3)
+    assert processor.max_concurrent_updates == 3
+    assert processor.current_concurrent_updates == 0
+
+# ---- ujung ke ujung: POST ke webhook lokal ----
+class OfflineBot(ExtBot):
+    """Bot tanpa jaringan: cukup untuk initialize() dan pasang webhook."""
+
+    async def get_me(self, *args, **kwargs):
+        self._bot_user = User(1, "Tes", True, username="tes_bot")
+        return self._bot_user
+
+    async def set_webhook(self, *args, **kwargs):
+        return True
+
+    async def delete_webhook(self, *args, **kwargs):
+        return True
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _payload(update_id, chat_id):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": f"u{update_id}",
+        "chat": {"id": chat_id, "type": "private"},
+    }}
+
+def test_webhook_keeps_chat_order():
+    events, done = [], threading.Event()
+    ready = {}
+
+    async def handle(update, context):
+        uid = update.update_id
+        events.append(("mulai", uid))
+        if uid == 1:
+            await asyncio.sleep(0.3)  # update pertama chat 7 lambat
+        events.append(("selesai", uid))
+        if len(events) == 6:
+            done.set()
+
+    async def post_init(app):
+        ready["loop"] = asyncio.get_running_loop()
+
+    app = (Application.builder().bot(OfflineBot("1:test"))
+           .concurrent_updates(bot.ChatOrderedUpdateProcessor(4)).post_init(post_init).build())
+    app.add_handler(TypeHandler(Update, handle))
+    port = _free_port()
+
+    def serve():
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        app.run_webhook(listen="127.0.0.1", port=port, url_path="telegram",
+                        webhook_url=f"http://127.0.0.1:{port}/telegram", stop_signals=None)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{port}/telegram"
+    try:
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                assert httpx.post(url, json=_payload(1, 7)).status_code == 200
+                break
+            except httpx.TransportError:
+                assert time.monotonic() < deadline, "webhook tidak pernah siap"
+                time.sleep(0.05)
+        for update_id, chat_id in ((2, 7), (3, 8)):
+            assert httpx.post(url, json=_payload(update_id, chat_id)).status_code == 200
+        assert done.wait(5)
+    finally:
+        ready["loop"].call_soon_threadsafe(app.stop_running)
+        thread.join(5)
+
+    # chat 7: update 2 baru mulai setelah update 1 selesai; chat 8 tidak ikut menunggu
+    assert events.index(("selesai", 1)) < events.index(("mulai", 2))
+    assert events.index(("selesai", 3)) < events.index(("selesai", 1))
+    assert not thread.is_alive()
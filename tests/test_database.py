@@ -0,0 +1,49 @@
+"""Thread penulis Database: error di luar job tidak boleh mematikan thread."""
+import asyncio
+import sqlite3
+
+import pytest
+
+import bot
+
+def test_writer_survives_locked_database(tmp_path, monkeypatch):
+    path = str(tmp_path / "bot.sqlite3")
+    monkeypatch.setattr(bot, "DB_PATH", path)
+    monkeypatch.setattr(bot, "DB_BUSY_TIMEOUT_MS", 50)
+    bot.init_db()
+    db = bot.Database()
+
+    async def scenario():
+        db.start()
+        try:
+            assert await db.execute("INSERT INTO users (chat_id) VALUES (0)") == 1
+            blocker = sqlite3.connect(path)
+            blocker.execute("BEGIN IMMEDIATE")   # pegang kunci tulis lebih lama dari busy_timeout
+            jobs = [db.execute("INSERT INTO users (chat_id) VALUES (?)", (i,)) for i in range(3)]
+            results = await asyncio.wait_for(asyncio.gather(*jobs, return_exceptions=True), 5)
+            assert all(isinstance(r, sqlite3.OperationalError) for r in results)
+            blocker.rollback()
+            blocker.close()
+            assert await asyncio.wait_for(db.execute("INSERT INTO users (chat_id) VALUES (1)"), 5) == 1
+        finally:
+            db.close()
+
+    asyncio.run(scenario())
+
+def test_writer_retries_connect(tmp_path, monkeypatch):
+    missing = tmp_path / "belum-ada"
+    monkeypatch.setattr(bot, "DB_PATH", str(missing / "bot.sqlite3"))
+    db = bot.Database()
+
+    async def scenario():
+        db.start()
+        try:
+            with pytest.raises(sqlite3.OperationalError):
+                await asyncio.wait_for(db.execute("INSERT INTO users (chat_id) VALUES (1)"), 5)
+            missing.mkdir()
+            bot.init_db()
+            assert await asyncio.wait_for(db.execute("INSERT INTO users (chat_id) VALUES (1)"), 10) == 1
+        finally:
+            db.close()
+
+    asyncio.run(scenario())
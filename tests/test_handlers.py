@@ -0,0 +1,294 @@
+"""Alur handler utama, dijalankan terhadap SQLite dan PostgreSQL (lihat conftest)."""
+import json
+from datetime import timedelta
+from types import SimpleNamespace
+
+import bot
+from conftest import FakeContext, FakeUpdate, call
+
+APP = SimpleNamespace(bot=None)   # deliver() hanya meneruskan app.bot ke DISPATCHER
+
+def test_notes(backend):
+    async def scenario():
+        assert await call(bot.note_list, 5) == ["Belum ada catatan."]
+        await call(bot.note_add, 5, "beli", "kopi", "susu")
+        await call(bot.note_add, 5, "rapat", "kantor")
+        await call(bot.note_add, -5, "kopi", "chat", "lain")
+
+        [text] = await call(bot.note_list, 5)
+        assert "beli kopi susu" in text and "rapat kantor" in text
+        assert "chat lain" not in text
+
+        [found] = await call(bot.note_search, 5, "kop")
+        assert "susu" in found and "lain" not in found
+        [missing] = await call(bot.note_search, 5, "teh")
+        assert "beli kopi susu" not in missing
+
+        # catatan chat lain tidak bisa dihapus
+        assert await call(bot.note_del, 5, "3") == await call(bot.note_del, 5, "99")
+        await call(bot.note_del, 5, "1")
+        [text] = await call(bot.note_list, 5)
+        assert "beli kopi susu" not in text and "rapat kantor" in text
+
+    backend.run(scenario)
+
+def test_notes_paging(backend):
+    async def scenario():
+        await bot.STORE.import_notes([(5, f"catatan {i}", "2025-01-01T00:00:00+07:00") for i in range(45)])
+        rows, has_newer, has_older = await bot.STORE.notes_page(5, "first", 0)
+        assert len(rows) == bot.PAGE_SIZE and not has_newer and has_older
+        seen = [r["id"] for r in rows]
+        while has_older:
+            rows, has_newer, has_older = await bot.STORE.notes_page(5, "old", seen[-1])
+            assert has_newer
+            seen += [r["id"] for r in rows]
+        assert seen == sorted(seen, reverse=True) and len(seen) == 45
+        rows, has_newer, has_older = await bot.STORE.notes_page(5, "new", seen[-1])
+        assert [r["id"] for r in rows] == seen[-bot.PAGE_SIZE - 1:-1] and has_older
+
+    backend.run(scenario)
+
+def test_money(backend):
+    async def scenario():
+        await call(bot.money_add, 5, "15000", "gaji")
+        await call(bot.money_add, 5, "-2000", "#makan", "kopi")
+        await call(bot.money_add, 5, "-3000", "#makan", "nasi")
+        await call(bot.money_add, 6, "-1", "chat", "lain")
+
+        [text] = await call(bot.money_balance, 5)
+        assert "Saldo:* 10000" in text and "chat lain" not in text
+        assert text.index("nasi") < text.index("kopi") < text.index("gaji")   # terbaru di atas
+
+        [report] = await call(bot.money_report, 5)
+        assert "Total: 10000" in report and "Pemasukan: 15000" in report and "Pengeluaran: 5000" in report
+        assert "makan" in report
+
+    backend.run(scenario)
+
+def test_import_export(backend):
+    async def scenario():
+        rows = [(5, -i, f"item {i}", f"2025-0{1 + i % 9}-01T00:00:00+07:00") for i in range(1, 31)]
+        assert await bot.STORE.import_money(rows) == 30
+        [text] = await call(bot.money_balance, 5)
+        assert f"Saldo:* {-sum(range(1, 31))}" in text
+
+        [(kind, filename, data)] = await call(bot.money_export, 5, "jsonl")
+        assert kind == "document" and filename.endswith(".jsonl")
+        records = [json.loads(line) for line in data.decode().splitlines()]
+        assert [r["amount"] for r in records] == [-i for i in range(1, 31)]
+
+        [(_, _, data)] = await call(bot.money_export, 5, "csv")
+        assert data.decode().splitlines()[0].split(",")[:2] == ["id", "amount"]
+        assert await call(bot.note_export, 5) == ["Belum ada data untuk diekspor."]
+
+    backend.run(scenario)
+
+def test_reminders(backend):
+    async def scenario():
+        await call(bot.reminder_daily, 5, "06:00", "pagi")
+        await call(bot.reminder_once, 5, "2030-01-01", "10:00", "tahun", "baru")
+        [text] = await call(bot.reminder_list, 5)
+        assert "pagi" in text and "tahun baru" in text
+
+        [reply] = await call(bot.timezone_cmd, 5, "wita")
+        assert "Asia/Makassar" in reply and "1 reminder" in reply
+        [text] = await call(bot.reminder_list, 5)
+        assert "pagi" in text
+
+        assert await call(bot.reminder_del, 5, "2") == ["Reminder 2 dimatikan."]
+        assert await call(bot.reminder_del, 5, "99") == ["ID reminder tidak ditemukan."]
+        [text] = await call(bot.reminder_list, 5)
+        assert "tahun baru" not in text
+
+    backend.run(scenario)
+
+def test_scheduler_tick(backend, monkeypatch):
+    async def scenario():
+        start = bot.now_local()
+        run_at = (start + timedelta(minutes=5)).replace(second=0, microsecond=0)
+        await call(bot.reminder_once, 5, f"{run_at:%Y-%m-%d}", f"{run_at:%H:%M}", "sekali")
+        await call(bot.reminder_daily, 6, f"{run_at:%H:%M}", "harian")
+        assert len(bot.SCHEDULER) == 2
+
+        monkeypatch.setattr(bot, "now_local", lambda: run_at + timedelta(seconds=1))
+        while await bot.scheduler_tick(APP):
+            pass
+        await bot.DISPATCHER.drain()
+        assert sorted(bot.DISPATCHER.sent) == [(5, "⏰ Reminder: sekali"), (6, "⏰ Reminder: harian")]
+        assert await call(bot.reminder_list, 5) == ["Tidak ada reminder aktif."]
+        [text] = await call(bot.reminder_list, 6)
+        assert "harian" in text
+
+        # tick kedua di waktu yang sama tidak mengirim ulang
+        await bot.scheduler_tick(APP)
+        await bot.DISPATCHER.drain()
+        assert len(bot.DISPATCHER.sent) == 2
+        assert await bot.STORE.pending_deliveries(1, 0) == []
+        # mode DB bersama: jadwal diklaim dari DB, heap lokal tidak menyimpan sisa
+        assert len(bot.SCHEDULER) == (0 if bot.STORE.shared else 1)
+
+    backend.run(scenario)
+
+def _page_ids(text):
+    return [int(line.split(".", 1)[0]) for line in text.splitlines()[1:]]
+
+def _buttons(markup):
+    return {b.callback_data.split(":")[1]: int(b.callback_data.split(":")[2])
+            for b in (markup.inline_keyboard[0] if markup else [])}
+
+def test_note_pages_fit_message_limit(backend):
+    async def scenario():
+        # kasus terburuk: isi lebih panjang dari preview, karakter 2 unit UTF-16
+        long_text = "😀" * (bot.PREVIEW_CHARS + 50)
+        await bot.STORE.import_notes([(5, f"{i} {long_text}", "2025-01-01T00:00:00.000000+07:00")
+                                      for i in range(3 * bot.PAGE_SIZE)])
+        text, markup = await bot._render_notes(5)
+        seen = []
+        while True:
+            assert bot._message_len(text) <= 4096
+            seen += _page_ids(text)
+            buttons = _buttons(markup)
+            if "old" not in buttons:
+                break
+            assert buttons["old"] == seen[-1]
+            text, markup = await bot._render_notes(5, "old", buttons["old"])
+        assert len(seen) == 3 * bot.PAGE_SIZE and seen == sorted(seen, reverse=True)
+
+        # kembali ke yang lebih baru: tidak ada catatan yang terlewat
+        back = _page_ids(text)
+        while "new" in _buttons(markup):
+            text, markup = await bot._render_notes(5, "new", _buttons(markup)["new"])
+            assert bot._message_len(text) <= 4096
+            back = _page_ids(text) + back
+        assert back == seen
+
+    backend.run(scenario)
+
+def test_money_rollup_keeps_report_and_order(backend):
+    async def scenario():
+        month = "2024-01"
+        rows = [(5, 500000, "gaji", f"{month}-01T08:00:00+07:00")]
+        rows += [(5, -1000 * i, f"#makan warung {i}", f"{month}-{i + 1:02d}T12:00:00+07:00") for i in range(1, 8)]
+        rows += [(5, -700, "bensin, motor", f"{month}-20T12:00:00+07:00"), (5, -300, "", f"{month}-21T12:00:00+07:00")]
+        await bot.STORE.import_money(rows)
+        [before] = await call(bot.money_report, 5, "01", "2024")
+
+        assert await bot.STORE.rollup_month(5, month) == len(rows) - 4
+        bot.REPORT_CACHE.invalidate((5, month))
+        bot.BALANCE_CACHE.invalidate(5)
+        [after] = await call(bot.money_report, 5, "01", "2024")
+        assert after.split("\n\n")[0] == before.split("\n\n")[0]   # ringkasan & rincian kategori sama
+        assert "#makan rekap pengeluaran 2024-01" in after and "bensin, rekap pengeluaran" in after
+
+        # transaksi baru tetap paling atas di /money_balance, bukan baris rekap
+        await call(bot.money_add, 5, "-5000", "kopi")
+        [text] = await call(bot.money_balance, 5)
+        recent = text.split("*Terakhir:*", 1)[1].strip().splitlines()
+        assert "(kopi)" in recent[0] and "rekap" in recent[1]
+
+    backend.run(scenario)
+
+def test_rollup_runs_in_the_worker_owning_the_chat(backend, monkeypatch):
+    monkeypatch.setattr(bot, "MONEY_ROLLUP_MONTHS", 1)
+    monkeypatch.setattr(bot, "SHARD", (1, 2))   # worker 1 dari 2: chat ganjil
+    vacuumed = []
+    async def optimize(budget):
+        vacuumed.append(budget)
+        return 0
+    monkeypatch.setattr(bot.STORE, "optimize", optimize)
+
+    async def scenario():
+        for chat_id in (5, 6):
+            await bot.STORE.import_money([(chat_id, -1000 * i, f"jajan {i}", f"2024-01-{i:02d}T12:00:00+07:00")
+                                          for i in range(1, 6)])
+            await call(bot.money_balance, chat_id)      # isi cache saldo
+        assert bot.BALANCE_CACHE.get(5) and bot.BALANCE_CACHE.get(6)
+
+        await bot.run_maintenance(None)
+        # chat 5 direkap & cache-nya dibuang di worker ini; chat 6 milik worker 0
+        assert bot.BALANCE_CACHE.get(5) is None and bot.BALANCE_CACHE.get(6)
+        assert await bot.STORE.rollup_candidates("2024-02", 1, 0, 10) == [(6, "2024-01")]
+        [text] = await call(bot.money_balance, 5)
+        assert "rekap" in text
+        assert vacuumed == []                            # VACUUM hanya di worker 0
+
+    backend.run(scenario)
+
+async def _import(chat_id, kind, filename, data):
+    """Jalankan impor seperti file yang dikirim user; kembalikan balasan bot."""
+    class FakeFile:
+        async def download_to_drive(self, path):
+            with open(path, "wb") as f:
+                f.write(data.encode())
+
+    async def get_file(file_id):
+        return FakeFile()
+
+    replies = []
+    context = FakeContext([])
+    context.bot = SimpleNamespace(get_file=get_file)
+    document = SimpleNamespace(file_name=filename, file_id="x")
+    await bot._run_import(FakeUpdate(chat_id, replies), context, kind, document)
+    return replies
+
+def test_money_import_skips_out_of_range_amount(backend):
+    async def scenario():
+        data = "amount,description\n1000,gaji\n99999999999999999999,rusak\n-500,kopi\n"
+        assert await _import(5, "money", "keuangan.csv", data) == \
+            ["📥 2 transaksi diimpor, 1 baris dilewati (tidak valid)."]
+        [text] = await call(bot.money_balance, 5)
+        assert "Saldo:* 500" in text
+        assert await call(bot.money_add, 5, str(2**63), "rusak") == ["Nominal terlalu besar."]
+
+    backend.run(scenario)
+
+def test_money_import_rejects_balance_overflow(backend):
+    async def scenario():
+        # tiap baris valid, tapi jumlahnya melewati int64 (saldo dan pemasukan bulanan)
+        data = f"amount,description,created_at\n{2**62},a,2025-01-01\n{2**62},b,2025-01-02\n5,c,2025-02-01\n"
+        assert await _import(5, "money", "keuangan.csv", data) == \
+            ["📥 2 transaksi diimpor, 1 baris dilewati (tidak valid)."]
+        [text] = await call(bot.money_balance, 5)
+        assert f"Saldo:* {2**62 + 5}\n" in text
+
+    backend.run(scenario)
+
+def test_money_add_rejects_balance_overflow(backend):
+    async def scenario():
+        await call(bot.money_add, 5, str(bot.AMOUNT_MAX), "besar")
+        [reply] = await call(bot.money_add, 5, "1", "lagi")
+        assert reply.startswith("Transaksi ditolak")
+        await call(bot.money_add, 5, "-1", "kurang")
+        [text] = await call(bot.money_balance, 5)
+        assert f"Saldo:* {bot.AMOUNT_MAX - 1}\n" in text
+
+    backend.run(scenario)
+
+def test_money_import_reports_write_error(backend, monkeypatch):
+    monkeypatch.setattr(bot, "IMPORT_CHUNK", 1)
+
+    async def scenario():
+        real = bot.STORE.import_money
+        calls = []
+
+        async def failing(rows):
+            calls.append(rows)
+            if len(calls) > 1:
+                raise OverflowError("Python int too large to convert to SQLite INTEGER")
+            return await real(rows)
+
+        monkeypatch.setattr(bot.STORE, "import_money", failing)
+        [reply] = await _import(5, "money", "keuangan.csv", "amount,description\n1,a\n2,b\n3,c\n")
+        assert reply.startswith("Gagal menyimpan data") and reply.endswith("(1 transaksi sudah terimpor)")
+
+    backend.run(scenario)
+
+def test_note_import_rejects_non_text_content(backend):
+    async def scenario():
+        data = '{"content": null}\n{"content": 12}\n{"isi": "beli kopi"}\n{}\n'
+        assert await _import(5, "note", "catatan.jsonl", data) == \
+            ["📥 1 catatan diimpor, 3 baris dilewati (tidak valid)."]
+        [text] = await call(bot.note_list, 5)
+        assert "beli kopi" in text and "None" not in text
+
+    backend.run(scenario)
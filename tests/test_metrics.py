@@ -0,0 +1,27 @@
+"""bot_sql_seconds mencakup semua jalur query: conn.execute, conn.cursor() dan asyncpg."""
+import bot
+from conftest import call
+
+def _sql_count(sql):
+    hist = bot.METRICS.histogram("bot_sql_seconds", sql=bot._sql_label(sql))
+    return hist.count if hist else 0
+
+def test_queries_are_timed_on_every_path(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "METRICS", bot.Metrics())
+    export_sql = bot.EXPORTS["note"][0]
+
+    async def scenario():
+        await call(bot.note_add, 5, "beli", "kopi")
+        await call(bot.money_add, 5, "-5000", "#makan", "siang")
+        await bot.STORE.load_schedule(1, 0)
+        await bot.STORE.month_categories(5, bot.now_local().strftime("%Y-%m"))
+        assert await bot.STORE.export("note", 5, "jsonl", str(tmp_path / "notes.jsonl")) == 1
+
+    backend.run(scenario)
+    # sekali per panggilan: tidak dihitung dua kali lewat execute + cursor
+    assert _sql_count(bot.SCHEDULE_SQL if backend.kind == "sqlite" else bot._pg(bot.SCHEDULE_SQL)) == 1
+    assert _sql_count(export_sql if backend.kind == "sqlite" else bot._pg(export_sql)) == 1
+    labels = {dict(labels)["sql"] for name, labels in bot.METRICS.histograms if name == "bot_sql_seconds"}
+    # kategori bulan ini (di PostgreSQL SUM-nya di-cast, jadi cukup cocokkan awalnya)
+    assert any(label.startswith("SELECT description, SUM(CASE WHEN amount > 0") for label in labels)
+    assert any(label.startswith("INSERT INTO notes") for label in labels)
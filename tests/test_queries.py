@@ -0,0 +1,28 @@
+"""Rencana query SQLite: query handler tidak boleh full table scan."""
+import bot
+
+def test_handler_queries_use_indexes(sqlite_conn):
+    assert bot.check_query_plans(sqlite_conn) == []
+
+def test_handler_queries_cover_paging_directions():
+    names = set(bot.handler_queries())
+    assert {"note_list_first", "note_list_old", "note_list_new"} <= names
+    assert {"money_report_first", "money_report_prev", "money_report_next"} <= names
+
+def test_check_query_plans_reports_full_scan(sqlite_conn, monkeypatch):
+    monkeypatch.setattr(bot, "handler_queries",
+                        lambda: {"by_content": ("SELECT id FROM notes WHERE content=?", ("x",))})
+    [(name, detail)] = bot.check_query_plans(sqlite_conn)
+    assert name == "by_content" and detail.startswith("SCAN notes")
+
+def test_check_query_plans_reports_covering_index_scan(sqlite_conn, monkeypatch):
+    # lewat index, tapi tetap membaca semua baris semua chat
+    monkeypatch.setattr(bot, "handler_queries", lambda: {"count_all": ("SELECT count(*) FROM notes", ())})
+    [(name, detail)] = bot.check_query_plans(sqlite_conn)
+    assert name == "count_all" and detail.startswith("SCAN notes USING COVERING INDEX")
+
+def test_check_query_plans_reports_unconstrained_fts_scan(sqlite_conn, monkeypatch):
+    monkeypatch.setattr(bot, "handler_queries",
+                        lambda: {"fts_all": ("SELECT rowid FROM notes_fts WHERE content LIKE ?", ("%x%",))})
+    [(name, detail)] = bot.check_query_plans(sqlite_conn)
+    assert name == "fts_all" and detail.startswith("SCAN notes_fts VIRTUAL TABLE")
@@ -0,0 +1,67 @@
+"""Token bucket per chat dan guard di grup -1."""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from telegram import Chat, Message, Update
+from telegram.ext import ApplicationHandlerStop
+
+import bot
+
+LIMITS = {"light": (2, 1.0), "external": (1, 0.1)}   # (kapasitas, token per detik)
+
+def test_acquire_refills_and_notifies_once():
+    limiter = bot.RateLimiter(LIMITS)
+    assert limiter.acquire(1, "light", 100.0) == (True, 0.0, False)
+    assert limiter.acquire(1, "light", 100.0) == (True, 0.0, False)
+    ok, wait, notify = limiter.acquire(1, "light", 100.0)
+    assert not ok and notify and wait == pytest.approx(1.0)
+    ok, wait, notify = limiter.acquire(1, "light", 100.5)
+    assert not ok and not notify and wait == pytest.approx(0.5)   # flood tidak dibalas flood
+    assert limiter.acquire(2, "light", 100.5)[0]                   # chat lain punya bucket sendiri
+    assert limiter.acquire(1, "light", 101.0) == (True, 0.0, False)
+    # setelah lolos lagi, penolakan berikutnya kembali diberi tahu
+    assert limiter.acquire(1, "light", 101.0)[2]
+
+def test_acquire_without_limit():
+    limiter = bot.RateLimiter({"light": None})
+    assert all(limiter.acquire(1, "light", 0.0)[0] for _ in range(100))
+    assert len(limiter) == 0
+
+def test_prune_drops_only_refilled_buckets():
+    limiter = bot.RateLimiter(LIMITS)
+    limiter.acquire(1, "light", 0.0)
+    limiter.acquire(2, "external", 0.0)
+    assert len(limiter) == 2
+    assert limiter.prune(1.0) == 1          # light penuh lagi setelah 1 detik, external belum
+    assert limiter.prune(10.0) == 1
+    assert len(limiter) == 0
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+def _command_update(text, edited=False):
+    message = Message(1, datetime.now(timezone.utc), Chat(7, "private"), text=text)
+    fake = FakeBot()
+    message.set_bot(fake)
+    update = Update(1, edited_message=message) if edited else Update(1, message=message)
+    return update, fake
+
+@pytest.mark.parametrize("edited", [False, True])
+def test_guard_limits_commands_including_edits(edited, monkeypatch):
+    monkeypatch.setattr(bot, "RATE_LIMITER", bot.RateLimiter(LIMITS))
+
+    async def scenario():
+        update, fake = _command_update("/weather Jakarta", edited)
+        assert (update.message is None) == edited
+        await bot.rate_limit_guard(update, None)            # token pertama
+        for _ in range(3):
+            with pytest.raises(ApplicationHandlerStop):
+                await bot.rate_limit_guard(update, None)
+        assert len(fake.sent) == 1 and fake.sent[0][0] == 7 # diberi tahu sekali saja
+
+    asyncio.run(scenario())
@@ -0,0 +1,316 @@
+"""Scheduler reminder & Dispatcher: error sementara tidak menghilangkan kejadian,
+pengiriman tetap dalam batas rate."""
+import asyncio
+import selectors
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+import pytz
+from telegram.error import RetryAfter
+
+import bot
+from conftest import call
+
+APP = SimpleNamespace(bot=None)
+
+def test_failed_claim_keeps_occurrence(backend, monkeypatch):
+    async def scenario():
+        run_at = (bot.now_local() + timedelta(minutes=5)).replace(second=0, microsecond=0)
+        await call(bot.reminder_daily, 6, f"{run_at:%H:%M}", "harian")
+        monkeypatch.setattr(bot, "now_local", lambda: run_at + timedelta(seconds=1))
+
+        name = "claim_due" if bot.STORE.shared else "claim_occurrences"
+        real = getattr(bot.STORE, name)
+        async def locked(*args):
+            raise RuntimeError("database is locked")
+        monkeypatch.setattr(bot.STORE, name, locked)
+        with pytest.raises(RuntimeError):
+            await bot.scheduler_tick(APP)
+        assert bot.DISPATCHER.sent == []
+
+        monkeypatch.setattr(bot.STORE, name, real)
+        while await bot.scheduler_tick(APP):
+            pass
+        await bot.DISPATCHER.drain()
+        assert bot.DISPATCHER.sent == [(6, "⏰ Reminder: harian")]
+        if not bot.STORE.shared:
+            # dijadwal ulang ke besok setelah klaim berhasil
+            assert bot.SCHEDULER.seconds_until_next(run_at.timestamp()) == bot.SCHEDULER.max_sleep
+            assert len(bot.SCHEDULER) == 1
+
+    backend.run(scenario)
+
+def test_deleted_during_claim_is_not_rescheduled(backend):
+    if backend.store.shared:
+        pytest.skip("mode DB bersama tidak memakai heap lokal untuk jadwal")
+
+    async def scenario():
+        run_at = (bot.now_local() + timedelta(minutes=5)).replace(second=0, microsecond=0)
+        await call(bot.reminder_daily, 6, f"{run_at:%H:%M}", "harian")
+        [item] = bot.SCHEDULER.pop_due(run_at.timestamp() + 1)
+        bot.SCHEDULER.remove(item.id)       # /reminder_del selagi klaim berjalan
+        bot.SCHEDULER.reschedule(item, run_at.timestamp() + 86400)
+        assert len(bot.SCHEDULER) == 0
+
+    backend.run(scenario)
+
+async def _rows(sql):
+    if bot.STORE.shared:
+        rows = await bot.STORE.pool.fetch(sql)
+    else:
+        rows = await bot.DB.fetchall(sql)
+    return [tuple(r) for r in rows]
+
+def test_catch_up_window_expires_old_occurrences(backend, monkeypatch):
+    monkeypatch.setattr(bot, "REMINDER_CATCHUP_SECONDS", 600)
+
+    async def scenario():
+        old = (bot.now_local() + timedelta(minutes=5)).replace(second=0, microsecond=0)
+        recent = old + timedelta(minutes=15)
+        await call(bot.reminder_once, 5, f"{old:%Y-%m-%d}", f"{old:%H:%M}", "sekali lama")
+        await call(bot.reminder_daily, 6, f"{old:%H:%M}", "harian lama")
+        await call(bot.reminder_daily, 7, f"{recent:%H:%M}", "harian baru")
+
+        # bot mati 20 menit setelah `old`: lag 1200 s > jendela 600 s, `recent` baru 300 s
+        now = old + timedelta(minutes=20)
+        monkeypatch.setattr(bot, "now_local", lambda: now)
+        while await bot.scheduler_tick(APP):
+            pass
+        await bot.DISPATCHER.drain()
+        assert bot.DISPATCHER.sent == [(7, "⏰ Reminder: harian baru")]
+        assert await _rows("SELECT chat_id, occurrence, state FROM reminder_deliveries ORDER BY chat_id") == [
+            (5, int(old.timestamp()), "expired"),
+            (6, int(old.timestamp()), "expired"),
+            (7, int(recent.timestamp()), "sent"),
+        ]
+        # yang terlewat tidak dikejar: harian lanjut besok, sekali dinonaktifkan
+        assert await _rows("SELECT chat_id, active, next_run FROM reminders ORDER BY chat_id") == [
+            (5, 0, int(old.timestamp())),
+            (6, 1, int((old + timedelta(days=1)).timestamp())),
+            (7, 1, int((recent + timedelta(days=1)).timestamp())),
+        ]
+        # tick lagi di waktu yang sama: tidak ada yang dikirim/diklaim ulang
+        await bot.scheduler_tick(APP)
+        await bot.DISPATCHER.drain()
+        assert len(bot.DISPATCHER.sent) == 1
+        assert len(await _rows("SELECT 1 FROM reminder_deliveries")) == 3
+
+    backend.run(scenario)
+
+def test_compaction_keeps_pending_deliveries(backend, monkeypatch):
+    monkeypatch.setattr(bot, "REMINDER_CATCHUP_SECONDS", 600)
+
+    async def scenario():
+        run_at = (bot.now_local() + timedelta(minutes=5)).replace(second=0, microsecond=0)
+        for chat_id in (5, 6, 7):
+            await call(bot.reminder_daily, chat_id, f"{run_at:%H:%M}", f"r{chat_id}")
+        monkeypatch.setattr(bot, "now_local", lambda: run_at + timedelta(seconds=1))
+        while await bot.scheduler_tick(APP):
+            pass
+        await bot.DISPATCHER.drain()
+        [(rid, occ)] = await _rows("SELECT reminder_id, occurrence FROM reminder_deliveries WHERE chat_id=7")
+        # proses mati setelah klaim: baris kembali 'pending' dan basi
+        await bot.STORE.mark_delivered([("pending", 0, rid, occ)])
+
+        # retensi negatif = semua baris selesai sudah "lama"; batch 1 memaksa beberapa putaran
+        monkeypatch.setattr(bot, "DELIVERY_RETENTION_SECONDS", -3600)
+        monkeypatch.setattr(bot, "DELIVERY_COMPACT_BATCH", 1)
+        await bot.compact_deliveries(None)
+        assert await _rows("SELECT chat_id, state FROM reminder_deliveries") == [(7, "pending")]
+        assert await bot.STORE.pending_deliveries(1, 0) == [(rid, occ, 7, "r7")]
+
+    backend.run(scenario)
+
+def test_run_survives_tick_errors(monkeypatch):
+    calls = []
+
+    async def flaky_tick(app):
+        calls.append(app)
+        if len(calls) < 3:
+            raise RuntimeError("koneksi putus")
+        return False
+
+    monkeypatch.setattr(bot, "scheduler_tick", flaky_tick)
+    monkeypatch.setattr(bot, "SCHEDULER_RETRY_SECONDS", 0)
+
+    async def scenario():
+        scheduler = bot.ReminderScheduler()
+        scheduler.start(APP)
+        for _ in range(100):
+            if len(calls) >= 3:
+                break
+            await asyncio.sleep(0.01)
+        assert not scheduler._task.done()
+        await scheduler.stop()
+
+    asyncio.run(scenario())
+    assert len(calls) >= 3
+
+# ---- aturan berulang & DST ----
+BERLIN = pytz.timezone("Europe/Berlin")
+
+def _ts(tz, *args):
+    return int(bot.localize(tz, datetime(*args)).timestamp())
+
+def _local(ts, tz=BERLIN):
+    return datetime.fromtimestamp(ts, tz)
+
+def test_spring_forward_gap_moves_forward():
+    # 30 Mar 2025: 02:00 -> 03:00 di Berlin; 02:30 tidak ada
+    rule = bot.Recurrence("daily", "Europe/Berlin", time_of_day="02:30")
+    fire = _local(bot.next_fire_ts(rule, _ts(BERLIN, 2025, 3, 29, 12, 0)))
+    assert fire.isoformat() == "2025-03-30T03:30:00+02:00"
+    nxt = _local(bot.next_fire_ts(rule, int(fire.timestamp())))
+    assert nxt.isoformat() == "2025-03-31T02:30:00+02:00"
+
+def test_fall_back_overlap_fires_once_at_first_occurrence():
+    # 26 Okt 2025: 03:00 -> 02:00 di Berlin; 02:30 muncul dua kali
+    rule = bot.Recurrence("daily", "Europe/Berlin", time_of_day="02:30")
+    first = bot.next_fire_ts(rule, _ts(BERLIN, 2025, 10, 25, 12, 0))
+    assert _local(first).isoformat() == "2025-10-26T02:30:00+02:00"
+    # kemunculan kedua (02:30+01:00, satu jam kemudian) dilewati
+    nxt = bot.next_fire_ts(rule, first)
+    assert _local(nxt).isoformat() == "2025-10-27T02:30:00+01:00"
+    assert bot.advance_due(rule, first, first + 3600) == nxt
+
+def test_monthly_day_31_clamps_to_month_end():
+    rule = bot.Recurrence("monthly", "Asia/Jakarta", time_of_day="08:00", month_day=31)
+    jkt = pytz.timezone("Asia/Jakarta")
+    seen, ts = [], _ts(jkt, 2024, 1, 1, 0, 0)
+    for _ in range(4):
+        ts = bot.next_fire_ts(rule, ts)
+        seen.append(_local(ts, jkt).date().isoformat())
+    assert seen == ["2024-01-31", "2024-02-29", "2024-03-31", "2024-04-30"]
+    feb = _local(bot.next_fire_ts(rule, _ts(jkt, 2025, 2, 1, 0, 0)), jkt)
+    assert feb.date().isoformat() == "2025-02-28"
+
+def test_every_n_days_follows_anchor():
+    jkt = pytz.timezone("Asia/Jakarta")
+    rule = bot.Recurrence("daily", "Asia/Jakarta", time_of_day="09:00", every=3, anchor="2025-01-01")
+    def next_day(*after):
+        return _local(bot.next_fire_ts(rule, _ts(jkt, *after)), jkt).date().isoformat()
+    assert next_day(2024, 12, 25, 0, 0) == "2025-01-01"   # sebelum anchor: anchor itu sendiri
+    assert next_day(2025, 1, 1, 9, 0) == "2025-01-04"     # tepat saat jalan: kejadian berikutnya
+    assert next_day(2025, 1, 2, 8, 0) == "2025-01-04"
+    assert next_day(2025, 1, 4, 10, 0) == "2025-01-07"
+    assert next_day(2025, 3, 1, 0, 0) == "2025-03-02"     # 60 hari setelah anchor
+
+def test_advance_due_skips_occurrences_older_than_catchup():
+    rule = bot.Recurrence("daily", "Asia/Jakarta", time_of_day="09:00")
+    jkt = pytz.timezone("Asia/Jakarta")
+    due = _ts(jkt, 2025, 1, 1, 9, 0)
+    # bot mati 3 hari: lanjut dari jendela catch-up, bukan dari kejadian 2 Jan
+    now = _ts(jkt, 2025, 1, 4, 12, 0)
+    assert _local(bot.advance_due(rule, due, now), jkt).isoformat() == "2025-01-05T09:00:00+07:00"
+    # terlambat sebentar: kejadian berikutnya tetap besok
+    assert bot.advance_due(rule, due, due + 60) == due + 86400
+    assert bot.advance_due(bot.Recurrence("once", run_at="2025-01-01T09:00:00+07:00"), due, now) is None
+
+def test_timezone_change_is_not_served_from_cache():
+    after = _ts(BERLIN, 2025, 6, 1, 0, 0)
+    rows = [{"id": 1, "kind": "daily", "message": "pagi", "run_at": None, "time_of_day": "06:00",
+             "tz": "Asia/Jakarta", "every": 1, "anchor": None, "days_mask": 0, "month_day": 0}]
+    old = bot.rule_from_row(rows[0])
+    old_due = bot.next_fire_ts(old, after)                      # masuk cache
+    [(rid, message, rule, due)] = bot._moved_reminders(rows, "Europe/Berlin", after)
+    assert rule.tz == "Europe/Berlin" and rule != old
+    assert _local(due).isoformat() == "2025-06-01T06:00:00+02:00"
+    assert due - old_due == 5 * 3600                            # jam dinding sama, zona beda
+    assert bot.next_fire_ts(old, after) == old_due
+
+# ---- Dispatcher: pacing global/per chat dengan jam virtual ----
+class _InstantSelector(selectors.DefaultSelector):
+    """Tidak pernah tidur: kalau tidak ada I/O, jam loop dimajukan sebesar timeout."""
+
+    def __init__(self, loop):
+        super().__init__()
+        self.loop = loop
+
+    def select(self, timeout=None):
+        events = super().select(0 if timeout is not None else None)
+        if not events and timeout:
+            self.loop.now += timeout
+        return events
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Event loop dengan jam virtual: asyncio.sleep(1) selesai seketika tapi
+    loop.time() maju 1 detik. Dipakai sebagai `clock` Dispatcher/TokenBucket."""
+
+    def __init__(self):
+        self.now = 0.0
+        super().__init__(_InstantSelector(self))
+
+    def time(self):
+        return self.now
+
+def run_virtual(coro_fn):
+    loop = VirtualTimeLoop()
+    try:
+        return loop.run_until_complete(coro_fn(loop))
+    finally:
+        loop.close()
+
+class PacedBot:
+    """Bot palsu: catat (waktu, chat, teks); teks di `flood` gagal sekali dengan RetryAfter."""
+
+    def __init__(self, loop, flood=(), retry_after=1):
+        self.loop = loop
+        self.flood = set(flood)
+        self.retry_after = retry_after
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if text in self.flood:
+            self.flood.discard(text)
+            raise RetryAfter(self.retry_after)
+        self.sent.append((self.loop.time(), chat_id, text))
+
+def test_global_rate_and_retry_after_backoff():
+    # 300 pesan ke 300 chat, 100/s (burst 100), satu RetryAfter 1 s di tengah:
+    # 100 langsung + 200 / 100/s + 1 s jeda ~= 3 s (uji manual: ~3.07 s)
+    async def scenario(loop):
+        fake = PacedBot(loop, flood={"m150"})
+        dispatcher = bot.Dispatcher(concurrency=50, global_rate=100, chat_rate=1, clock=loop.time)
+        stats = await dispatcher.send_batch(fake, [(i, f"m{i}") for i in range(300)])
+        return fake, stats
+
+    fake, stats = run_virtual(scenario)
+    assert stats.sent == 300 and stats.failed == 0 and stats.retries == 1
+    assert all(stats.results) and sorted(text for _, _, text in fake.sent) == sorted(f"m{i}" for i in range(300))
+    assert 2.9 <= stats.finished - stats.started <= 3.2
+    times = [t for t, _, _ in fake.sent]
+    # tidak ada kiriman selama jeda flood-wait
+    flood_at = next(t for t, _, text in fake.sent if text == "m149")
+    assert not [t for t in times if flood_at < t < flood_at + 0.99]
+    # setelah burst awal, tiap jendela 1 detik paling banyak ~rate pesan
+    for start in times[100:]:
+        assert sum(start <= t < start + 1 for t in times) <= 101
+
+def test_per_chat_rate_does_not_block_other_chats():
+    async def scenario(loop):
+        fake = PacedBot(loop)
+        dispatcher = bot.Dispatcher(concurrency=10, global_rate=1000, chat_rate=1, clock=loop.time)
+        await dispatcher.send_batch(fake, [(1, f"a{i}") for i in range(4)] + [(2, "b0")])
+        return fake
+
+    fake = run_virtual(scenario)
+    by_chat = {}
+    for t, chat_id, _ in fake.sent:
+        by_chat.setdefault(chat_id, []).append(round(t, 2))
+    assert by_chat[1] == [0.0, 1.0, 2.0, 3.0]
+    assert by_chat[2] == [0.0]
+
+def test_retry_after_is_retried_until_max_retries():
+    class AlwaysFlooded(PacedBot):
+        async def send_message(self, chat_id, text):
+            raise RetryAfter(2)
+
+    async def scenario(loop):
+        dispatcher = bot.Dispatcher(global_rate=100, chat_rate=100, max_retries=2, clock=loop.time)
+        return await dispatcher.send_batch(AlwaysFlooded(loop), [(1, "x")])
+
+    stats = run_virtual(scenario)
+    assert stats.results == [False] and stats.failed == 1 and stats.retries == 2
+    # tiga percobaan, dua jeda 2 detik di antaranya
+    assert 4.0 <= stats.finished - stats.started < 4.1
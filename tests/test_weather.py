@@ -0,0 +1,114 @@
+"""WeatherClient terhadap server OpenWeatherMap tiruan lokal (OPENWEATHER_URL)."""
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import bot
+from conftest import call
+
+class StubWeather(BaseHTTPRequestHandler):
+    """q=atlantis -> 404, q=rusak -> 500, q=lambat -> tidak menjawab sebelum timeout,
+    selain itu 200 setelah jeda singkat (cukup lama untuk permintaan yang bertumpuk)."""
+    hits = Counter()
+
+    def do_GET(self):
+        city = parse_qs(urlparse(self.path).query)["q"][0]
+        self.hits[city] += 1
+        if city == "lambat":
+            time.sleep(0.6)
+            return self._reply(200, {"cod": 200})
+        time.sleep(0.1)
+        if city == "atlantis":
+            return self._reply(404, {"cod": "404", "message": "city not found"})
+        if city == "rusak":
+            return self._reply(500, {"cod": 500, "message": "internal error"})
+        self._reply(200, {"cod": 200, "weather": [{"description": "cerah"}],
+                          "main": {"temp": 31, "humidity": 70}, "wind": {"speed": 2}})
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def weather_url():
+    StubWeather.hits.clear()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubWeather)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/data/2.5/weather"
+    server.shutdown()
+    server.server_close()
+
+def _client(url, **kwargs):
+    return bot.WeatherClient(api_key="k", base_url=url, **kwargs)
+
+def test_ttl_cache_hit_and_expiry(weather_url):
+    async def scenario():
+        client = _client(weather_url, ttl=0.3)
+        try:
+            first = await client.get("Jakarta")
+            assert await client.get("  jakarta ") is first
+            assert StubWeather.hits["Jakarta"] == 1 and client.stats["hits"] == 1
+            await asyncio.sleep(0.35)
+            await client.get("Jakarta")
+            assert StubWeather.hits["Jakarta"] == 2
+        finally:
+            await client.close()
+    asyncio.run(scenario())
+
+def test_concurrent_requests_share_one_upstream_call(weather_url):
+    async def scenario():
+        client = _client(weather_url)
+        try:
+            results = await asyncio.gather(*(client.get(c) for c in ["Bandung", "bandung"] * 10))
+            assert all(r is results[0] for r in results)
+            assert StubWeather.hits["Bandung"] == 1
+            assert client.stats["upstream_calls"] == 1 and client.stats["coalesced"] == 19
+        finally:
+            await client.close()
+    asyncio.run(scenario())
+
+def test_city_not_found_is_cached_negatively(weather_url):
+    async def scenario():
+        client = _client(weather_url, negative_ttl=60)
+        try:
+            for _ in range(3):
+                with pytest.raises(bot.CityNotFound):
+                    await client.get("atlantis")
+            assert StubWeather.hits["atlantis"] == 1 and client.stats["negative_hits"] == 2
+        finally:
+            await client.close()
+    asyncio.run(scenario())
+
+def test_upstream_failures_are_reported_to_user(weather_url, monkeypatch):
+    monkeypatch.setattr(bot, "OPENWEATHER_API_KEY", "k")
+
+    async def scenario():
+        client = _client(weather_url, timeout=0.3)
+        monkeypatch.setattr(bot, "WEATHER", client)
+        try:
+            # 5xx tidak di-cache: permintaan berikutnya mencoba lagi ke upstream
+            for _ in range(2):
+                assert await call(bot.weather, 1, "rusak") == ["Kota tidak ditemukan atau API error."]
+            assert StubWeather.hits["rusak"] == 2
+            assert await call(bot.weather, 1, "lambat") == ["Layanan cuaca tidak merespons, coba lagi nanti."]
+            assert client.stats["errors"] == 3
+            [reply] = await call(bot.weather, 1, "Jakarta")
+            assert "Suhu: 31°C" in reply
+        finally:
+            await client.close()
+    asyncio.run(scenario())